@@ -23,8 +23,7 @@ class InvoiceAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        company = request.user.employee.company
-        return qs.filter(company=company)
+        return request.tenant.filter(qs)
 
     def has_change_permission(self, request, obj=None):
         return False
@@ -44,8 +43,7 @@ class OrganizationAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        company = request.user.employee.company
-        return qs.filter(company=company)
+        return request.tenant.filter(qs)
 
 # @admin.register(PaymentItem)
 # class PaymentItemAdmin(admin.ModelAdmin):
@@ -0,0 +1,69 @@
+"""Async variants of the read-heavy invoice endpoints, for ASGI serving.
+
+They reuse InvoiceViewSet for authentication, permissions, querysets,
+filtering, pagination and serialization, so responses are the same as the
+sync endpoints. Queries are awaited instead of blocking the event loop, and
+an invoice is read at the same time as its payment items."""
+import datetime
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from django.utils import timezone
+from rest_framework.response import Response
+
+from bill.models import Invoice
+from bill.services.statistics import get_paid_day, get_daily_statistic, get_monthly_statistic
+from bill.views import InvoiceViewSet
+from finance.asynchronous import async_action, afetch, gather_queries
+
+
+def _serialize(viewset, instance, many=False):
+    return sync_to_async(lambda: viewset.get_serializer(instance, many=many).data)()
+
+
+async def invoice_list(viewset, request):
+    def paginate():
+        # the page has to be known before its payment items can be read
+        if viewset.lean_list:
+            return viewset.get_lean_list_response(request)
+        queryset = viewset.filter_queryset(viewset.get_queryset())
+        page = viewset.paginate_queryset(queryset)
+        return viewset.get_paginated_response(viewset.get_serializer(page, many=True).data)
+    response, = await gather_queries(paginate)
+    return response
+
+
+async def invoice_detail(viewset, request, pk):
+    queryset = await sync_to_async(lambda: viewset.filter_queryset(viewset.get_queryset()).filter(pk=pk))()
+    invoices = await afetch(queryset)
+    if not invoices:
+        raise Http404
+    await sync_to_async(viewset.check_object_permissions)(request, invoices[0])
+    return Response(await _serialize(viewset, invoices[0]))
+
+
+async def review_invoices(viewset, request):
+    queryset = await sync_to_async(lambda: viewset.get_queryset()
+                                   .filter(approver=request.tenant.employee, status=Invoice.ON_REVIEW))()
+    invoices = await afetch(queryset)
+    return Response(await _serialize(viewset, invoices, many=True))
+
+
+async def daily_statistic(viewset, request):
+    today = get_paid_day(timezone.now())
+    statistic, = await gather_queries(lambda: get_daily_statistic(request.tenant.company, today))
+    return Response(statistic)
+
+
+async def stats_invoices(viewset, request):
+    today = get_paid_day(timezone.now())
+    date_from = today - datetime.timedelta(days=365)
+    statistic, = await gather_queries(lambda: get_monthly_statistic(request.tenant.company, date_from, today))
+    return Response(statistic)
+
+
+invoice_list_view = async_action(InvoiceViewSet, 'list', invoice_list)
+invoice_detail_view = async_action(InvoiceViewSet, 'retrieve', invoice_detail)
+review_invoices_view = async_action(InvoiceViewSet, 'review_invoices', review_invoices)
+daily_statistic_view = async_action(InvoiceViewSet, 'daily_statistic', daily_statistic)
+stats_invoices_view = async_action(InvoiceViewSet, 'stats_invoices', stats_invoices)
@@ -1,20 +1,34 @@
 import codecs
 import csv
 
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
+
+
+class Echo:
+    """An object that implements just the write method of the file-like
+    interface, so csv.writer hands every formatted row straight back."""
+    def write(self, value):
+        return value
 
 
 class CSVStream:
     """Class to stream (download) an iterator to a
     CSV file."""
-    def export(self, filename, fieldnames,  iterator):
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename={filename}.csv"'
-        writer = csv.writer(response)
-        writer.writerow(fieldnames)
-
-        for data in iterator:
-            writer.writerow(data)
+    chunk_size = 2000
 
-        response.write(codecs.BOM_UTF8)
+    def export(self, filename, fieldnames, iterator):
+        response = StreamingHttpResponse(self.rows(fieldnames, iterator), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
         return response
+
+    def rows(self, fieldnames, iterator):
+        # Querysets are read through a chunked (server-side on PostgreSQL)
+        # cursor, so only one chunk of rows is held in memory at a time.
+        if hasattr(iterator, 'iterator'):
+            iterator = iterator.iterator(chunk_size=self.chunk_size)
+
+        writer = csv.writer(Echo())
+        yield codecs.BOM_UTF8.decode('utf-8')
+        yield writer.writerow(fieldnames)
+        for data in iterator:
+            yield writer.writerow(data)
@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from finance.loadgen import load
+
+# (название, синхронный маршрут, асинхронный маршрут, нужен ли id счета)
+ENDPOINTS = [
+    ('list', 'invoices-list', 'async-invoices-list', False),
+    ('detail', 'invoice-detail', 'async-invoice-detail', True),
+    ('review', 'invoices-review', 'async-invoices-review', False),
+    ('daily_stats', 'daily-stats', 'async-daily-stats', False),
+    ('stats', 'stats', 'async-stats', False),
+]
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает пропускную способность синхронных и асинхронных эндпоинтов счетов "
+            "под конкурентной нагрузкой. Сервер запускается отдельно, например "
+            "`uvicorn finance.asgi:application --workers 4` или `daphne finance.asgi:application`.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help="адрес запущенного сервера")
+        parser.add_argument('--token', required=True, help="токен сотрудника, от имени которого идут запросы")
+        parser.add_argument('--invoice', type=int, help="id счета для detail; без него detail пропускается")
+        parser.add_argument('--requests', type=int, default=2000, help="запросов на каждый эндпоинт")
+        parser.add_argument('--concurrency', type=int, default=50, help="одновременных запросов")
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            choices=[name for name, *_ in ENDPOINTS], help="по умолчанию все")
+        parser.add_argument('--json', action='store_true', help="вывести результаты в JSON")
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        headers = {'Authorization': f"Token {options['token']}"}
+        selected = options['endpoints'] or [name for name, *_ in ENDPOINTS]
+
+        results = []
+        for name, sync_name, async_name, needs_invoice in ENDPOINTS:
+            if name not in selected:
+                continue
+            if needs_invoice and options['invoice'] is None:
+                if options['endpoints']:
+                    raise CommandError("Для detail нужен --invoice")
+                continue
+            url_args = [options['invoice']] if needs_invoice else []
+            for mode, route in (('sync', sync_name), ('async', async_name)):
+                path = reverse(route, args=url_args)
+                result = load(base_url + path, requests=options['requests'],
+                              concurrency=options['concurrency'], headers=headers)
+                results.append({'endpoint': name, 'mode': mode, **result.as_dict()})
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'endpoint':<12} {'mode':<6} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} "
+                          f"{'p99 ms':>9} {'errors':>7}")
+        for row in results:
+            errors = row['errors'] + sum(count for code, count in row['statuses'].items() if int(code) >= 400)
+            self.stdout.write(f"{row['endpoint']:<12} {row['mode']:<6} {row['throughput']:>9} "
+                              f"{row['p50'] or '-':>9} {row['p95'] or '-':>9} {row['p99'] or '-':>9} "
+                              f"{errors:>7}")
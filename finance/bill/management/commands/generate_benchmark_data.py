@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from bill.services.benchmark_data import generate_tenants, clear_benchmark_data, DEFAULT_PASSWORD
+
+
+class Command(BaseCommand):
+    help = ("Создает синтетические компании с сотрудниками, организациями, продуктами и счетами "
+            "для нагрузочного тестирования (см. run_benchmark)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=10, help="количество компаний")
+        parser.add_argument('--employees', type=int, default=20, help="сотрудников в компании")
+        parser.add_argument('--organizations', type=int, default=200, help="организаций в компании")
+        parser.add_argument('--products', type=int, default=100, help="продуктов в компании")
+        parser.add_argument('--categories', type=int, default=20, help="общих категорий продуктов")
+        parser.add_argument('--invoices', type=int, default=20000, help="счетов в компании")
+        parser.add_argument('--items', type=int, default=5, help="наибольшее количество позиций в счете")
+        parser.add_argument('--days', type=int, default=365, help="за сколько последних дней созданы счета")
+        parser.add_argument('--password', default=DEFAULT_PASSWORD, help="пароль всех сотрудников")
+        parser.add_argument('--seed', type=int, default=0, help="одинаковый seed дает одинаковые данные")
+        parser.add_argument('--clear', action='store_true',
+                            help="сначала удалить данные, созданные ранее этой командой и run_benchmark")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = clear_benchmark_data()
+            self.stdout.write(f"Удалено компаний: {deleted}")
+        company_ids = generate_tenants(tenants=options['tenants'], employees=options['employees'],
+                                       organizations=options['organizations'], products=options['products'],
+                                       categories=options['categories'], invoices=options['invoices'],
+                                       items=options['items'], days=options['days'],
+                                       password=options['password'], seed=options['seed'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Создано компаний: {len(company_ids)}"))
@@ -0,0 +1,51 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bill.services import partitions
+
+
+def month(value):
+    return datetime.datetime.strptime(value, '%Y-%m').date()
+
+
+class Command(BaseCommand):
+    help = ("Секционирует таблицы счетов и позиций по месяцам создания (только PostgreSQL): "
+            "convert переносит существующие таблицы в секционированные, create создает секции "
+            "на следующие месяцы, archive отсоединяет старые месяцы, status выводит секции.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['convert', 'create', 'archive', 'status'])
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help="на сколько месяцев вперед создать секции (convert, create)")
+        parser.add_argument('--keep-months', type=int, default=24,
+                            help="сколько последних месяцев оставить в таблицах (archive)")
+        parser.add_argument('--before', type=month, help="архивировать месяцы до этого, ГГГГ-ММ (archive)")
+        parser.add_argument('--drop', action='store_true',
+                            help="удалить старые секции вместо переноса в схему archive")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Секционирование счетов поддерживается только в PostgreSQL")
+        action = options['action']
+        if action != 'convert' and not partitions.is_partitioned(connection):
+            raise CommandError("Таблица счетов не секционирована, сначала выполните convert")
+        this_month = partitions.month_start(datetime.date.today())
+
+        if action == 'convert':
+            created = partitions.convert_to_partitioned(connection, options['months_ahead'])
+            self.stdout.write(self.style.SUCCESS(f"Создано месячных секций: {created}"))
+        elif action == 'create':
+            created = partitions.create_partitions(
+                connection, partitions.add_months(this_month, options['months_ahead']))
+            self.stdout.write(self.style.SUCCESS(f"Создано секций: {len(created)}"))
+        elif action == 'archive':
+            before = options['before'] or partitions.add_months(this_month, 1 - options['keep_months'])
+            archived = partitions.archive_partitions(connection, before, drop=options['drop'])
+            self.stdout.write(self.style.SUCCESS(f"{'Удалено' if options['drop'] else 'Архивировано'} "
+                                                 f"секций: {len(archived)}"))
+        else:
+            for table, _ in partitions.PARTITIONED_TABLES:
+                for name, rows in partitions.list_partitions(connection, table):
+                    self.stdout.write(f"{name}\t~{rows}")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from bill.services.statistics import rebuild_daily_totals
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает дневную статистику оплаченных счетов по таблице счетов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies',
+                            help="id компании, можно указать несколько раз; по умолчанию все компании")
+
+    def handle(self, *args, **options):
+        created = rebuild_daily_totals(options['companies'])
+        self.stdout.write(self.style.SUCCESS(f"Создано записей статистики: {created}"))
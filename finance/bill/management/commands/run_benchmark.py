@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from bill.services.benchmark_data import DEFAULT_PASSWORD
+from finance.benchmark import BenchmarkFixtures, SCENARIOS, SKIPPED, check_coverage, run_benchmark
+from staff.models import Company
+
+
+class Command(BaseCommand):
+    help = ("Нагружает все эндпоинты bill, goods и staff запущенного сервера и выводит p50/p95/p99 "
+            "и пропускную способность каждого в JSON. Данные создаются командой generate_benchmark_data, "
+            "сервер должен работать с той же базой данных.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help="адрес запущенного сервера")
+        parser.add_argument('--company', type=int, help="id компании; по умолчанию первая синтетическая")
+        parser.add_argument('--password', default=DEFAULT_PASSWORD, help="пароль синтетических сотрудников")
+        parser.add_argument('--requests', type=int, default=1000, help="запросов на каждый сценарий")
+        parser.add_argument('--concurrency', type=int, default=50, help="одновременных запросов")
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            choices=[scenario.name for scenario in SCENARIOS], help="по умолчанию все")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="файл для результатов; по умолчанию stdout")
+
+    def handle(self, *args, **options):
+        missing = check_coverage()
+        if missing:
+            raise CommandError("Нет сценария для " + ", ".join(f"{method} {route}" for route, method in missing))
+        try:
+            fixtures = BenchmarkFixtures(options['company'], options['password'], options['seed'])
+        except Company.DoesNotExist as exc:
+            raise CommandError(str(exc))
+
+        scenarios = [scenario for scenario in SCENARIOS
+                     if not options['scenarios'] or scenario.name in options['scenarios']]
+        started_at = timezone.now()
+        results = run_benchmark(options['base_url'].rstrip('/'), fixtures, scenarios,
+                                requests=options['requests'], concurrency=options['concurrency'],
+                                stdout=self.stderr)
+        report = json.dumps({'base_url': options['base_url'],
+                             'company': fixtures.company.id,
+                             'requests': options['requests'],
+                             'concurrency': options['concurrency'],
+                             'started_at': started_at.isoformat(),
+                             'finished_at': timezone.now().isoformat(),
+                             'results': results,
+                             'skipped': [{'route': route, 'method': method, 'reason': reason}
+                                         for (route, method), reason in SKIPPED.items()]},
+                            indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
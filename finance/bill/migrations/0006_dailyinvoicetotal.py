@@ -0,0 +1,31 @@
+# Generated by Django 4.1.2 on 2026-10-18 20:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staff', '0004_alter_company_name'),
+        ('bill', '0005_alter_invoice_status_alter_paymentitem_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyInvoiceTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День оплаты')),
+                ('income_price', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма поступлений')),
+                ('income_count', models.IntegerField(default=0, verbose_name='Количество поступлений')),
+                ('costs_price', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма расходов')),
+                ('costs_count', models.IntegerField(default=0, verbose_name='Количество расходов')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='staff.company')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyinvoicetotal',
+            constraint=models.UniqueConstraint(fields=('company', 'day'), name='unique_daily_invoice_total'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.2 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bill', '0006_dailyinvoicetotal'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['company', 'status', 'type', 'paid_at'], name='invoice_company_stats_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['company', 'approver', 'status'], name='invoice_company_review_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['company', '-created_at', 'id'], name='invoice_company_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organization',
+            index=models.Index(fields=['company', 'name'], name='organization_company_name_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models.functions import Upper
+
+# GIN indexes behind finance.search.FullTextSearchFilter. They only exist on
+# PostgreSQL and are not part of the model state, other databases fall back
+# to the plain icontains search.
+SEARCH_INDEXES = [
+    GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='organization_name_trgm_idx'),
+    GinIndex(SearchVector('name', 'address', 'description', config='russian'),
+             name='organization_search_idx'),
+]
+
+
+def add_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    model = apps.get_model('bill', 'Organization')
+    for index in SEARCH_INDEXES:
+        schema_editor.add_index(model, index)
+
+
+def remove_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    model = apps.get_model('bill', 'Organization')
+    for index in SEARCH_INDEXES:
+        schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bill', '0007_tenant_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(add_search_indexes, remove_search_indexes),
+    ]
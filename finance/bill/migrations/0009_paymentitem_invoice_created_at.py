@@ -0,0 +1,27 @@
+# Generated by Django 4.1.2 on 2026-10-18 20:35
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_invoice_created_at(apps, schema_editor):
+    Invoice = apps.get_model('bill', 'Invoice')
+    PaymentItem = apps.get_model('bill', 'PaymentItem')
+    PaymentItem.objects.update(invoice_created_at=Subquery(
+        Invoice.objects.filter(id=OuterRef('invoice_id')).values('created_at')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bill', '0008_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentitem',
+            name='invoice_created_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(copy_invoice_created_at, migrations.RunPython.noop),
+    ]
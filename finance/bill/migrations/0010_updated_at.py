@@ -0,0 +1,27 @@
+# Generated by Django 4.1.2 on 2026-10-18 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bill', '0009_paymentitem_invoice_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='organization',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['company', 'updated_at'], name='invoice_company_updated_idx'),
+        ),
+    ]
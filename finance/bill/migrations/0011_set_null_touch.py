@@ -0,0 +1,25 @@
+# Generated by Django 4.1.2 on 2026-10-18 21:10
+
+from django.db import migrations, models
+import finance.conditional
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staff', '0006_set_null_touch'),
+        ('bill', '0010_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='approver',
+            field=models.ForeignKey(null=True, on_delete=finance.conditional.SET_NULL_AND_TOUCH, to='staff.employee'),
+        ),
+        migrations.AlterField(
+            model_name='organization',
+            name='bank_detail',
+            field=models.ForeignKey(null=True, on_delete=finance.conditional.SET_NULL_AND_TOUCH, to='staff.bankdetails'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from phonenumber_field.modelfields import PhoneNumberField
 
+from finance.conditional import SET_NULL_AND_TOUCH
 from goods.models import Product
 from staff.models import Employee, Company, BankDetails
 
@@ -12,8 +13,16 @@ class Organization(models.Model):
     phone_number = PhoneNumberField(verbose_name="Телефон предприятия")
     email = models.EmailField(verbose_name="Email предприятия")
     description = models.TextField(verbose_name="Описание предприятия")
-    bank_detail = models.ForeignKey(BankDetails, null=True, on_delete=models.SET_NULL)
+    bank_detail = models.ForeignKey(BankDetails, null=True, on_delete=SET_NULL_AND_TOUCH)
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    # validator of conditional GET requests, see finance.conditional
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # tenant lists ordered or looked up by name
+            models.Index(fields=['company', 'name'], name='organization_company_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.id} {self.name} {self.email}"
@@ -45,8 +54,22 @@ class Invoice(models.Model):
     paid_at = models.DateTimeField(null=True, blank=True)
     total_price = models.DecimalField(null=True, blank=True, max_digits=8, decimal_places=2)
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
-    approver = models.ForeignKey(Employee, on_delete=models.SET_NULL, null=True)
+    approver = models.ForeignKey(Employee, on_delete=SET_NULL_AND_TOUCH, null=True)
     company = models.ForeignKey(Company, on_delete=models.SET_NULL, null=True)
+    # validator of conditional GET requests, see finance.conditional
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # statistics, analytics and the paid invoices report
+            models.Index(fields=['company', 'status', 'type', 'paid_at'], name='invoice_company_stats_idx'),
+            # review_invoices of an approver
+            models.Index(fields=['company', 'approver', 'status'], name='invoice_company_review_idx'),
+            # the default list ordering, also used as the pagination cursor
+            models.Index(fields=['company', '-created_at', 'id'], name='invoice_company_created_idx'),
+            # validators of conditional GET requests
+            models.Index(fields=['company', 'updated_at'], name='invoice_company_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.id} {self.type} {self.status} - {self.created_at}"
@@ -57,8 +80,43 @@ class PaymentItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     price = models.DecimalField(verbose_name='Цена за одну единицу', max_digits=8, decimal_places=2)
     amount = models.PositiveIntegerField(verbose_name='Количество продуктов или услуг')
+    # copy of invoice.created_at: payment items are partitioned by it together
+    # with their invoices, see bill.services.partitions
+    invoice_created_at = models.DateTimeField(null=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        if self.invoice_created_at is None and self.invoice_id is not None:
+            field = self._meta.get_field('invoice')
+            if field.is_cached(self):
+                # no query when the item was made with the invoice object
+                self.invoice_created_at = field.get_cached_value(self).created_at
+            else:
+                self.invoice_created_at = Invoice.objects.filter(pk=self.invoice_id)\
+                    .values_list('created_at', flat=True).first()
+        super().save(*args, **kwargs)
+
+
+class DailyInvoiceTotal(models.Model):
+    """Per-company, per-day rollup of paid invoices.
+
+    Kept up to date by bill.services.statistics when an invoice moves to or
+    out of the paid status or a paid invoice is deleted (see bill.signals),
+    so statistics never scan the invoice table. Writes around these paths
+    (queryset update(), raw SQL) make it drift from the invoices; the
+    rebuild_invoice_stats command recomputes it."""
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    day = models.DateField(verbose_name='День оплаты')
+    income_price = models.DecimalField(max_digits=14, decimal_places=2, default=0,
+                                       verbose_name='Сумма поступлений')
+    income_count = models.IntegerField(default=0, verbose_name='Количество поступлений')
+    costs_price = models.DecimalField(max_digits=14, decimal_places=2, default=0,
+                                      verbose_name='Сумма расходов')
+    costs_count = models.IntegerField(default=0, verbose_name='Количество расходов')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'day'], name='unique_daily_invoice_total'),
+        ]
 
-
-
-
-
+    def __str__(self):
+        return f"{self.company_id} {self.day}"
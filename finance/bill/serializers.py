@@ -1,11 +1,15 @@
-from decimal import Decimal
+import datetime
+import zoneinfo
 
+from django.conf import settings
+from django.db.models import Prefetch, prefetch_related_objects
 from django.db.transaction import atomic
 from rest_framework import serializers
 
 from bill.models import Organization, Invoice, PaymentItem
 from bill.services.helpers import CurrentCompanyDefault
-from goods.models import Product
+from bill.services.invoices import MAX_BULK_INVOICES, check_invoice_company, get_company_products, \
+    get_total_price, build_payment_items
 from goods.serializers import ProductSerializer
 from staff.models import BankDetails
 from staff.serializers import EmployeeSerializer, BankDetailsSerializer, CompanySerializer
@@ -68,6 +72,47 @@ class ReviewInvoiceSerializer(serializers.ModelSerializer):
         fields = ('status', )
 
 
+class BulkInvoiceStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False,
+                                max_length=MAX_BULK_INVOICES)
+    status = serializers.ChoiceField(choices=Invoice.PAYMENT_CHOICES)
+
+
+class InvoiceAnalyticsSerializer(serializers.Serializer):
+    GRANULARITIES = ('day', 'week', 'month', 'quarter', 'year')
+    MAX_SPAN = datetime.timedelta(days=100 * 366)
+
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    granularity = serializers.ChoiceField(choices=GRANULARITIES, default='month')
+    timezone = serializers.CharField(default=settings.TIME_ZONE)
+
+    def validate_timezone(self, value):
+        try:
+            return zoneinfo.ZoneInfo(value)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise serializers.ValidationError("Неизвестный часовой пояс")
+
+    def validate_date_from(self, value):
+        # periods start at midnight of date_from, in UTC it may be the day before
+        if value <= datetime.date.min:
+            raise serializers.ValidationError("Дата вне допустимого диапазона")
+        return value
+
+    def validate_date_to(self, value):
+        # the range ends at midnight after date_to
+        if value >= datetime.date.max - datetime.timedelta(days=1):
+            raise serializers.ValidationError("Дата вне допустимого диапазона")
+        return value
+
+    def validate(self, attrs):
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("Дата начала должна быть не позже даты окончания")
+        if attrs['date_to'] - attrs['date_from'] > self.MAX_SPAN:
+            raise serializers.ValidationError(f"Период не может быть больше {self.MAX_SPAN.days} дней")
+        return attrs
+
+
 class InvoiceSerializer(serializers.ModelSerializer):
     organization = OrganizationSerializer(read_only=True)
     approver = EmployeeSerializer(read_only=True)
@@ -90,24 +135,13 @@ class InvoiceSerializer(serializers.ModelSerializer):
         users_company = validated_data.pop('company')
         payments = validated_data.pop('payment_items')
 
-        if approver.company != users_company:
-            raise serializers.ValidationError("Проверяющий должен быть из той же компании!")
-        if organization.company != users_company:
-            raise serializers.ValidationError("Организация в счете должна быть из той же компании!")
+        check_invoice_company(users_company, organization, approver)
+        products = get_company_products(users_company, [item['product_id'] for item in payments])
 
         invoice = Invoice.objects.create(**validated_data, approver=approver, company=users_company,
-                               organization=organization)
-
-        total_price = Decimal(0)
-        for item in payments:
-            total_price += item['price'] * item['amount']
-            product = Product.objects.get(pk=item.pop('product_id'))
-            if product.company != users_company:
-                raise serializers.ValidationError(
-                    "Услуга в счете должна быть из той же компании!")
-            PaymentItem.objects.create(product=product, invoice=invoice, **item)
-
-        invoice.total_price = total_price
-        invoice.save()
+                                         organization=organization, total_price=get_total_price(payments))
+        PaymentItem.objects.bulk_create(build_payment_items(invoice, payments, products))
+        prefetch_related_objects([invoice], Prefetch('payment_items',
+                                                     queryset=PaymentItem.objects.select_related('product__category')))
 
-        return invoice
\ No newline at end of file
+        return invoice
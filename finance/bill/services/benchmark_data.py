@@ -0,0 +1,164 @@
+"""Synthetic tenants for load benchmarks.
+
+Everything is written with bulk inserts in batches, so hundreds of
+thousands of invoices take minutes rather than hours. Generated users share
+the BENCHMARK_DOMAIN email domain and companies the BENCHMARK_COMPANY
+prefix, which is how clear_benchmark_data and the benchmark runner find
+them again."""
+import datetime
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from bill.models import Organization, Invoice, PaymentItem
+from bill.services.statistics import rebuild_daily_totals
+from goods.models import Category, Product
+from staff.models import BankDetails, Company, Employee
+
+BENCHMARK_DOMAIN = 'benchmark.local'
+BENCHMARK_COMPANY = 'Benchmark tenant'
+BENCHMARK_CATEGORY = 'Benchmark категория'
+DEFAULT_PASSWORD = 'benchmark-password'
+BATCH_SIZE = 5000
+# invoices are created this long before their payment deadline
+PAYMENT_TERM = datetime.timedelta(days=14)
+
+STATUS_WEIGHTS = ((Invoice.PAID, 60), (Invoice.APPLYED, 15), (Invoice.ON_REVIEW, 15), (Invoice.CANCELED, 10))
+TYPE_WEIGHTS = ((Invoice.INCOME, 70), (Invoice.COST, 30))
+
+
+def benchmark_email(tenant, number):
+    return f'tenant{tenant}-{number}@{BENCHMARK_DOMAIN}'
+
+
+def _bank_details(rng, name):
+    return BankDetails(name=f'{name} банк',
+                       address=f'г. Минск, ул. Банковская, {rng.randint(1, 200)}',
+                       bank_number=f'BY{rng.randint(10 ** 9, 10 ** 10 - 1)}',
+                       settlement_account=f'BY{rng.randint(10 ** 15, 10 ** 16 - 1)}')
+
+
+def _choose(rng, weights):
+    return rng.choices([value for value, _ in weights], [weight for _, weight in weights])[0]
+
+
+def _create_tenant(rng, tenant, employees, organizations, products, categories, password):
+    company_bank = _bank_details(rng, f'{BENCHMARK_COMPANY} {tenant}')
+    company_bank.save()
+    company = Company.objects.create(name=f'{BENCHMARK_COMPANY} {tenant}', bank_detail=company_bank,
+                                     description='Синтетические данные для нагрузочного тестирования')
+
+    # the first user is the manager: approves invoices and invites staff
+    users = User.objects.bulk_create([
+        User(username=benchmark_email(tenant, number), email=benchmark_email(tenant, number),
+             password=password, is_staff=number == 0)
+        for number in range(employees)])
+    staff = Employee.objects.bulk_create([
+        Employee(user=user, company=company, position='Менеджер' if user.is_staff else 'Бухгалтер')
+        for user in users])
+
+    banks = BankDetails.objects.bulk_create([_bank_details(rng, f'Организация {number}')
+                                             for number in range(organizations)])
+    customers = Organization.objects.bulk_create([
+        Organization(name=f'ООО «Контрагент {tenant}-{number}»', taxes_number=str(rng.randint(10 ** 8, 10 ** 9 - 1)),
+                     address=f'г. Минск, пр. Независимости, {number + 1}', phone_number='+375291234567',
+                     email=f'organization{number}@tenant{tenant}.{BENCHMARK_DOMAIN}',
+                     description=f'Постоянный контрагент номер {number}', bank_detail=bank, company=company)
+        for number, bank in enumerate(banks)])
+    goods = Product.objects.bulk_create([
+        Product(name=f'Услуга {tenant}-{number}', description=f'Описание услуги {number}',
+                category=rng.choice(categories), producer=f'Производитель {number % 10}', company=company)
+        for number in range(products)])
+    return company, staff, customers, goods
+
+
+def _create_invoices(rng, company, staff, customers, goods, count, items, days, now):
+    prices = {product.id: Decimal(rng.randint(100, 100000)) / 100 for product in goods}
+    created = 0
+    while created < count:
+        size = min(BATCH_SIZE, count - created)
+        invoices, invoice_items = [], []
+        for _ in range(size):
+            created_at = now - datetime.timedelta(seconds=rng.randint(0, days * 86400))
+            status = _choose(rng, STATUS_WEIGHTS)
+            paid_at = None
+            if status == Invoice.PAID:
+                paid_at = min(created_at + datetime.timedelta(seconds=rng.randint(0, 14 * 86400)), now)
+            payments = [(product, rng.randint(1, 20)) for product in rng.sample(goods, rng.randint(1, min(items, len(goods))))]
+            invoices.append(Invoice(type=_choose(rng, TYPE_WEIGHTS), status=status,
+                                    pay_to=created_at + PAYMENT_TERM, paid_at=paid_at,
+                                    total_price=sum(prices[product.id] * amount for product, amount in payments),
+                                    organization=rng.choice(customers), approver=rng.choice(staff),
+                                    company=company))
+            invoice_items.append(payments)
+        with transaction.atomic():
+            Invoice.objects.bulk_create(invoices)
+            # auto_now_add stamps every row with the insert time, spread them back in time;
+            # in the same transaction, as the partitioned tables check it against payment items
+            Invoice.objects.filter(id__in=[invoice.id for invoice in invoices]) \
+                .update(created_at=F('pay_to') - PAYMENT_TERM)
+            PaymentItem.objects.bulk_create([
+                PaymentItem(invoice=invoice, product=product, price=prices[product.id], amount=amount,
+                            invoice_created_at=invoice.pay_to - PAYMENT_TERM)
+                for invoice, payments in zip(invoices, invoice_items) for product, amount in payments
+            ], batch_size=BATCH_SIZE)
+        created += size
+    return created
+
+
+def clear_benchmark_data():
+    """Deletes generated tenants, with the companies that signed up during
+    benchmark runs. Returns the number of deleted companies."""
+    users = User.objects.filter(email__endswith=f'@{BENCHMARK_DOMAIN}')
+    companies = Company.objects.filter(name__startswith=BENCHMARK_COMPANY) \
+        | Company.objects.filter(employee__user__in=users)
+    company_ids = list(companies.values_list('id', flat=True).distinct())
+    # bank details outlive companies and organizations, collect them first
+    bank_ids = set(Company.objects.filter(id__in=company_ids).values_list('bank_detail_id', flat=True)) \
+        | set(Organization.objects.filter(company_id__in=company_ids).values_list('bank_detail_id', flat=True))
+    with transaction.atomic():
+        # invoices keep their company on delete, so they go first
+        Invoice.objects.filter(company_id__in=company_ids).delete()
+        Company.objects.filter(id__in=company_ids).delete()
+        users.delete()
+        BankDetails.objects.filter(id__in=bank_ids - {None}).delete()
+        Category.objects.filter(name__startswith=BENCHMARK_CATEGORY).delete()
+    return len(company_ids)
+
+
+def generate_tenants(tenants=10, employees=20, organizations=200, products=100, categories=20,
+                     invoices=20000, items=5, days=365, password=DEFAULT_PASSWORD, seed=0, stdout=None):
+    """Creates `tenants` companies with their staff, customers, products and
+    `invoices` invoices each, having 1 to `items` payment items and created
+    within the last `days` days. Every user gets `password`, the first user
+    of a tenant is a manager. The same seed gives the same data.
+
+    Returns the ids of the created companies."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    # hashing is slow on purpose, do it once for all users
+    password = make_password(password)
+    offset = Company.objects.filter(name__startswith=BENCHMARK_COMPANY).count()
+    shared_categories = Category.objects.bulk_create([Category(name=f'{BENCHMARK_CATEGORY} {number}')
+                                                      for number in range(categories)])
+
+    company_ids = []
+    for tenant in range(offset, offset + tenants):
+        company, staff, customers, goods = _create_tenant(rng, tenant, employees, organizations, products,
+                                                          shared_categories, password)
+        created = _create_invoices(rng, company, staff, customers, goods, invoices, items, days, now)
+        company_ids.append(company.id)
+        if stdout is not None:
+            stdout.write(f"{company.name}: счетов {created}")
+
+    rebuild_daily_totals(company_ids)
+    if connection.vendor == 'postgresql':
+        # fresh statistics, otherwise the planner guesses on empty tables
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    return company_ids
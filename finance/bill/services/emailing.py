@@ -1,12 +1,12 @@
-from django.core.mail import send_mail
+from mailing.services.outbox import enqueue_mail, enqueue_mails
 
-from finance import settings
 
-
-def send_customer_invoice(company, invoice):
+def render_customer_invoice(company, invoice):
+    """Returns subject, text and recipients of the email with the invoice.
+    Payment items should be prefetched together with their products."""
     products_details = (f"{item.product.name}, цена - {item.price}, кол-во - {item.amount}.\n " for item in invoice.payment_items.all())
     products_details = ''.join(products_details)
-    send_mail(
+    return (
         'Оплата счета',
         f'Продукты и услуги:\n'
         f'{products_details}'
@@ -18,9 +18,14 @@ def send_customer_invoice(company, invoice):
         f'Расчетный счет для оплаты - {company.bank_detail.settlement_account},\n'
         f'Доп. информация - {company.bank_detail.details}.\n'
         ,
-        settings.EMAIL_HOST_USER,
         [invoice.organization.email],
-        fail_silently=False,
     )
 
 
+def send_customer_invoice(company, invoice):
+    return enqueue_mail(*render_customer_invoice(company, invoice))
+
+
+def send_customer_invoices(company, invoices):
+    """Queues emails for all invoices with one insert, returns them in order."""
+    return enqueue_mails([render_customer_invoice(company, invoice) for invoice in invoices])
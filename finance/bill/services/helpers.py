@@ -2,4 +2,4 @@ class CurrentCompanyDefault:
     requires_context = True
 
     def __call__(self, serializer_field):
-        return serializer_field.context['request'].user.employee.company
+        return serializer_field.context['request'].tenant.company
@@ -0,0 +1,181 @@
+from collections import defaultdict
+from decimal import Decimal
+from itertools import chain
+
+from django.db.transaction import atomic
+from django.utils import timezone
+from rest_framework import serializers
+
+from bill.models import Invoice, Organization, PaymentItem
+from bill.services.statistics import get_paid_day, update_daily_totals
+from goods.models import Product
+from staff.models import Employee
+
+MAX_BULK_INVOICES = 1000
+
+# statuses an invoice can be moved to from each status
+STATUS_TRANSITIONS = {
+    Invoice.ON_REVIEW: (Invoice.APPLYED, Invoice.CANCELED),
+    Invoice.APPLYED: (Invoice.PAID, Invoice.CANCELED),
+}
+# statuses only the approver of the invoice can move it out of
+APPROVER_STATUSES = (Invoice.ON_REVIEW,)
+
+
+def check_invoice_company(company, organization, approver):
+    """Checks that the organization and the approver of an invoice
+    belong to the company the invoice is created for."""
+    if approver.company_id != company.id:
+        raise serializers.ValidationError("Проверяющий должен быть из той же компании!")
+    if organization.company_id != company.id:
+        raise serializers.ValidationError("Организация в счете должна быть из той же компании!")
+
+
+def check_invoice_products(company, product_ids, products):
+    """Checks that every product referenced by payment items was found
+    and belongs to the company."""
+    for product_id in product_ids:
+        product = products.get(product_id)
+        if product is None:
+            raise serializers.ValidationError("Услуга в счете не найдена!")
+        if product.company_id != company.id:
+            raise serializers.ValidationError("Услуга в счете должна быть из той же компании!")
+
+
+def get_company_products(company, product_ids):
+    """Fetches all products referenced by payment items with a single query
+    and checks that every one of them belongs to the company."""
+    products = Product.objects.in_bulk(set(product_ids))
+    check_invoice_products(company, product_ids, products)
+    return products
+
+
+def get_total_price(payments):
+    return sum((item['price'] * item['amount'] for item in payments), Decimal(0))
+
+
+def build_payment_items(invoice, payments, products):
+    """Builds unsaved payment items of the invoice, ready for bulk_create."""
+    return [PaymentItem(invoice=invoice,
+                        invoice_created_at=invoice.created_at,
+                        product=products[item['product_id']],
+                        price=item['price'],
+                        amount=item['amount'])
+            for item in payments]
+
+
+def _to_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def resolve_bulk_invoices(company, items):
+    """Resolves organizations, approvers and products of a batch of validated
+    invoices with one query per model.
+
+    `items` is a list of (payload, validated_data) pairs. Returns a list of
+    (invoice kwargs, error) pairs in the same order, where exactly one of the
+    two is not None."""
+    organization_ids = {_to_id(payload.get('organization')) for payload, _ in items}
+    approver_ids = {_to_id(payload.get('approver')) for payload, _ in items}
+    product_ids = {item['product_id'] for _, data in items for item in data['payment_items']}
+
+    organizations = Organization.objects.in_bulk(organization_ids - {None})
+    approvers = Employee.objects.in_bulk(approver_ids - {None})
+    products = Product.objects.in_bulk(product_ids)
+
+    resolved = []
+    for payload, data in items:
+        organization = organizations.get(_to_id(payload.get('organization')))
+        approver = approvers.get(_to_id(payload.get('approver')))
+        payments = data['payment_items']
+        try:
+            if organization is None:
+                raise serializers.ValidationError("Организация не найдена!")
+            if approver is None:
+                raise serializers.ValidationError("Проверяющий не найден!")
+            check_invoice_company(company, organization, approver)
+            check_invoice_products(company, [item['product_id'] for item in payments], products)
+        except serializers.ValidationError as exc:
+            resolved.append((None, {"non_field_errors": exc.detail}))
+            continue
+
+        fields = {key: value for key, value in data.items() if key not in ('company', 'payment_items')}
+        resolved.append(({**fields, 'organization': organization, 'approver': approver,
+                          'payments': payments}, None))
+    return resolved, products
+
+
+@atomic
+def bulk_save_invoices(company, invoices_kwargs, products):
+    """Writes invoices and all their payment items with two bulk inserts."""
+    payments = [kwargs.pop('payments') for kwargs in invoices_kwargs]
+    invoices = [Invoice(**kwargs, company=company, total_price=get_total_price(items))
+                for kwargs, items in zip(invoices_kwargs, payments)]
+    Invoice.objects.bulk_create(invoices)
+    PaymentItem.objects.bulk_create(chain.from_iterable(
+        build_payment_items(invoice, items, products) for invoice, items in zip(invoices, payments)))
+    return invoices
+
+
+def get_transition_error(current_status, new_status, is_approver):
+    """Why an invoice can't be moved from `current_status` to `new_status`,
+    None when it can."""
+    if current_status in APPROVER_STATUSES and not is_approver:
+        return 'Только начальник может подтвердить или отменить заказ'
+    if new_status not in STATUS_TRANSITIONS.get(current_status, ()):
+        return f'Статус не может быть обновлен на {new_status}'
+    return None
+
+
+@atomic
+def bulk_change_status(invoices, employee, ids, new_status):
+    """Moves the invoices of `invoices` with the given ids to `new_status`
+    by the rules of get_transition_error, as `employee`.
+
+    The invoices are locked, then changed with one conditional UPDATE per
+    current status, and the daily totals of paid invoices are updated once
+    per day and type. Returns the number of changed invoices and a result
+    per id, in the order of `ids`."""
+    results = {invoice_id: {"id": invoice_id} for invoice_id in ids}
+    rows = invoices.filter(id__in=list(results)).order_by('id').select_for_update()\
+        .values('id', 'status', 'type', 'approver_id', 'company_id', 'total_price', 'paid_at')
+
+    by_status = defaultdict(list)
+    for row in rows:
+        error = get_transition_error(row['status'], new_status,
+                                     employee is not None and row['approver_id'] == employee.pk)
+        if error is not None:
+            results[row['id']]["message"] = error
+        else:
+            by_status[row['status']].append(row)
+
+    now = timezone.now()
+    # QuerySet.update() doesn't fill auto_now fields
+    changes = {'status': new_status, 'updated_at': now}
+    if new_status == Invoice.PAID:
+        changes['paid_at'] = now
+    totals = defaultdict(lambda: [0, 0])
+    changed = 0
+    for current_status, group in by_status.items():
+        # the status condition keeps the update right even for unlocked rows
+        changed += Invoice.objects.filter(id__in=[row['id'] for row in group], status=current_status)\
+            .update(**changes)
+        for row in group:
+            results[row['id']]["status"] = new_status
+            # the same rules as sync_daily_totals
+            paid_at = changes.get('paid_at', row['paid_at'])
+            sign = 1 if new_status == Invoice.PAID else -1 if current_status == Invoice.PAID else 0
+            if sign and row['company_id'] is not None and paid_at is not None:
+                total = totals[row['company_id'], get_paid_day(paid_at), row['type']]
+                total[0] += sign * (row['total_price'] or 0)
+                total[1] += sign
+
+    for (company_id, day, invoice_type), (price, count) in totals.items():
+        update_daily_totals(company_id, day, invoice_type, price, count)
+    for result in results.values():
+        if "status" not in result and "message" not in result:
+            result["message"] = "Счет не найден"
+    return changed, list(results.values())
@@ -0,0 +1,240 @@
+"""Monthly range partitioning of invoices and payment items on PostgreSQL.
+
+bill_invoice is partitioned by created_at and bill_paymentitem by its copy
+of it, invoice_created_at, with the same month boundaries (in UTC), so an
+invoice and its items always live in partitions of the same month. Each
+table also has a DEFAULT partition for rows outside the created months
+(and items without invoice_created_at).
+
+The ORM keeps working on the partitioned tables: inserts are routed by
+PostgreSQL, and queries bounded by created_at (the list cursor, the
+`created_after` / `created_before` filters) only read the partitions of
+those months.
+
+Differences from the plain tables:
+- the primary key of invoices is (id, created_at), because unique
+  constraints of a partitioned table must contain the partition key; ids
+  still come from a single sequence;
+- payment items have no primary key constraint, and reference invoices
+  with a deferrable (invoice_id, invoice_created_at) foreign key. Rows
+  without invoice_created_at are not checked. Cascades are done by the ORM
+  as before.
+
+Archived months are detached from the tables and moved to the
+ARCHIVE_SCHEMA schema, so they can still be queried by hand. Paid
+invoices stay in the daily statistics (DailyInvoiceTotal), which is
+not partitioned."""
+import datetime
+
+from django.db import NotSupportedError, transaction
+
+# referenced table first
+PARTITIONED_TABLES = (('bill_invoice', 'created_at'), ('bill_paymentitem', 'invoice_created_at'))
+ARCHIVE_SCHEMA = 'archive'
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """Start and end of the month as UTC datetimes."""
+    start = datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc)
+    next_month = add_months(month, 1)
+    return start, datetime.datetime(next_month.year, next_month.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y_%m}'
+
+
+def default_partition_name(table):
+    return f'{table}_default'
+
+
+def partition_month(name):
+    """Month of a partition made by partition_name, None for the others."""
+    suffix = name.rpartition('_p')[2]
+    try:
+        return datetime.datetime.strptime(suffix, '%Y_%m').date()
+    except ValueError:
+        return None
+
+
+def _check_vendor(connection):
+    if connection.vendor != 'postgresql':
+        raise NotSupportedError("Секционирование счетов поддерживается только в PostgreSQL")
+
+
+def is_partitioned(connection, table='bill_invoice'):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+        return cursor.fetchone() is not None
+
+
+def list_partitions(connection, table):
+    """(name, estimated rows) of the partitions of the table, by name."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname, child.reltuples
+            FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+            ORDER BY child.relname""", [table])
+        return [(name, max(int(rows), 0)) for name, rows in cursor.fetchall()]
+
+
+def _create_partition(cursor, table, column, month):
+    """Creates the partition of the month, moving its rows out of the
+    default partition if there are any there."""
+    name = partition_name(table, month)
+    start, end = month_bounds(month)
+    cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(f"""
+        WITH moved AS (DELETE FROM {default_partition_name(table)} WHERE {column} >= %s AND {column} < %s
+                       RETURNING *)
+        INSERT INTO {name} SELECT * FROM moved""", [start, end])
+    cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', [start, end])
+    return name
+
+
+def create_partitions(connection, until, since=None):
+    """Creates the missing monthly partitions of both tables from `since`
+    (the current month by default) to `until` inclusive. Returns their names."""
+    _check_vendor(connection)
+    month = month_start(since or datetime.date.today())
+    until = month_start(until)
+    created = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        # the foreign key is checked at commit, after both tables are moved
+        cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+        existing = {name for table, _ in PARTITIONED_TABLES for name, _ in list_partitions(connection, table)}
+        while month <= until:
+            for table, column in PARTITIONED_TABLES:
+                if partition_name(table, month) not in existing:
+                    created.append(_create_partition(cursor, table, column, month))
+            month = add_months(month, 1)
+    return created
+
+
+def archive_partitions(connection, before, drop=False):
+    """Detaches the monthly partitions of the months before `before` from
+    both tables and moves them to ARCHIVE_SCHEMA, or drops them. Returns
+    their names."""
+    _check_vendor(connection)
+    before = month_start(before)
+    archived = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if not drop:
+            cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}')
+        # payment items first, they reference the invoices
+        for table, _ in reversed(PARTITIONED_TABLES):
+            for name, _ in list_partitions(connection, table):
+                month = partition_month(name)
+                if month is None or month >= before:
+                    continue
+                cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+                if drop:
+                    cursor.execute(f'DROP TABLE {name}')
+                else:
+                    cursor.execute(f'ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}')
+                archived.append(name)
+    return archived
+
+
+def _copy_indexes(cursor, source, table, skip_unique=True):
+    cursor.execute("""
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = %s""", [source])
+    for name, definition in cursor.fetchall():
+        if skip_unique and definition.startswith('CREATE UNIQUE'):
+            continue
+        cursor.execute(f'ALTER INDEX {name} RENAME TO {name[:49]}_unpartitioned')
+        cursor.execute(definition.replace(f' ON {source} ', f' ON {table} ')
+                                 .replace(f'.{source} ', f'.{table} '))
+
+
+def _copy_foreign_keys(cursor, source, table, skip_referenced=()):
+    cursor.execute("""
+        SELECT conname, pg_get_constraintdef(oid), confrelid::regclass::text FROM pg_constraint
+        WHERE conrelid = to_regclass(%s) AND contype = 'f'""", [source])
+    for name, definition, referenced in cursor.fetchall():
+        if referenced not in skip_referenced:
+            cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+
+
+def _take_over_sequence(cursor, source, table):
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id'), pg_get_serial_sequence(%s, 'id')", [source, table])
+    old_sequence, new_sequence = cursor.fetchone()
+    if new_sequence is None:
+        # serial column: the copied default still uses the old sequence
+        cursor.execute(f'ALTER SEQUENCE {old_sequence} OWNED BY {table}.id')
+    else:
+        # identity column: the copy got a sequence of its own
+        cursor.execute(f"SELECT setval(%s, COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)",
+                       [new_sequence])
+
+
+def _partition_table(cursor, table, column, months, primary_key=None, skip_referenced=()):
+    source = f'{table}_unpartitioned'
+    cursor.execute(f'ALTER TABLE {table} RENAME TO {source}')
+    cursor.execute(f'CREATE TABLE {table} (LIKE {source} INCLUDING DEFAULTS INCLUDING IDENTITY '
+                   f'INCLUDING CONSTRAINTS INCLUDING STORAGE) PARTITION BY RANGE ({column})')
+    if primary_key:
+        cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY ({primary_key})')
+    else:
+        cursor.execute(f'CREATE INDEX {table}_id_idx ON {table} (id)')
+    _copy_indexes(cursor, source, table)
+    _copy_foreign_keys(cursor, source, table, skip_referenced)
+
+    cursor.execute(f'CREATE TABLE {default_partition_name(table)} PARTITION OF {table} DEFAULT')
+    for month in months:
+        start, end = month_bounds(month)
+        cursor.execute(f'CREATE TABLE {partition_name(table, month)} PARTITION OF {table} '
+                       f'FOR VALUES FROM (%s) TO (%s)', [start, end])
+    cursor.execute(f'INSERT INTO {table} SELECT * FROM {source}')
+    _take_over_sequence(cursor, source, table)
+
+
+def convert_to_partitioned(connection, months_ahead=3):
+    """Replaces the plain invoice and payment item tables with partitioned
+    ones holding the same rows, with a partition for every month from the
+    oldest invoice to `months_ahead` months from now.
+
+    Takes an exclusive lock on both tables and copies them, run it in a
+    maintenance window. Returns the number of created monthly partitions."""
+    _check_vendor(connection)
+    if is_partitioned(connection):
+        return 0
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('LOCK TABLE bill_invoice, bill_paymentitem IN ACCESS EXCLUSIVE MODE')
+        cursor.execute("""
+            UPDATE bill_paymentitem SET invoice_created_at = bill_invoice.created_at FROM bill_invoice
+            WHERE bill_invoice.id = bill_paymentitem.invoice_id
+            AND bill_paymentitem.invoice_created_at IS DISTINCT FROM bill_invoice.created_at""")
+        cursor.execute('SELECT MIN(created_at) FROM bill_invoice')
+        oldest = cursor.fetchone()[0]
+        month = month_start(oldest or datetime.date.today())
+        last = add_months(month_start(datetime.date.today()), months_ahead)
+        months = []
+        while month <= last:
+            months.append(month)
+            month = add_months(month, 1)
+
+        # the old foreign key to bill_invoice would keep the old table alive
+        _partition_table(cursor, 'bill_invoice', 'created_at', months, primary_key='id, created_at')
+        _partition_table(cursor, 'bill_paymentitem', 'invoice_created_at', months,
+                         skip_referenced=('bill_invoice_unpartitioned',))
+        cursor.execute('ALTER TABLE bill_paymentitem ADD CONSTRAINT bill_paymentitem_invoice_fk '
+                       'FOREIGN KEY (invoice_id, invoice_created_at) REFERENCES bill_invoice (id, created_at) '
+                       'DEFERRABLE INITIALLY DEFERRED')
+        cursor.execute('DROP TABLE bill_paymentitem_unpartitioned, bill_invoice_unpartitioned')
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE bill_invoice, bill_paymentitem')
+    return len(months)
@@ -0,0 +1,141 @@
+import datetime
+
+from django.db.models import F, Sum, Count, Q, DateField
+from django.db.models.functions import Trunc, TruncDate
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from bill.models import Invoice, DailyInvoiceTotal
+
+
+def get_paid_day(paid_at):
+    """Day of the rollup a payment belongs to, in the project time zone."""
+    return timezone.localdate(paid_at, timezone.get_default_timezone())
+
+
+def update_daily_totals(company_id, day, invoice_type, price, count):
+    """Adds `price` and `count` (negative to subtract) to the company's totals
+    of the day with a single conditional UPDATE. Must be called inside the
+    transaction that changes the invoices."""
+    total, _ = DailyInvoiceTotal.objects.get_or_create(company_id=company_id, day=day)
+    if invoice_type == Invoice.INCOME:
+        changes = {'income_price': F('income_price') + price, 'income_count': F('income_count') + count}
+    else:
+        changes = {'costs_price': F('costs_price') + price, 'costs_count': F('costs_count') + count}
+    DailyInvoiceTotal.objects.filter(pk=total.pk).update(**changes)
+
+
+def sync_daily_totals(invoice, previous_status):
+    """Moves the invoice into or out of the rollup after its status changed
+    from `previous_status`. `paid_at` must still hold the payment time."""
+    if invoice.company_id is None or invoice.paid_at is None or previous_status == invoice.status:
+        return
+    if invoice.status == Invoice.PAID:
+        sign = 1
+    elif previous_status == Invoice.PAID:
+        sign = -1
+    else:
+        return
+    update_daily_totals(invoice.company_id, get_paid_day(invoice.paid_at), invoice.type,
+                        sign * (invoice.total_price or 0), sign)
+
+
+def subtract_paid_invoices(invoices):
+    """Takes the paid invoices of the `invoices` queryset out of the rollup
+    with one UPDATE per company, day and type. Call it inside the
+    transaction that deletes them."""
+    rows = invoices.filter(status=Invoice.PAID, paid_at__isnull=False, company__isnull=False)\
+        .annotate(day=TruncDate('paid_at', tzinfo=timezone.get_default_timezone()))\
+        .values('company_id', 'day', 'type')\
+        .annotate(price=Sum('total_price', default=0), count=Count('id'))\
+        .order_by()
+    for row in rows:
+        update_daily_totals(row['company_id'], row['day'], row['type'], -row['price'], -row['count'])
+
+
+@atomic
+def rebuild_daily_totals(company_ids=None):
+    """Recomputes the rollup from the invoice table, for all or some companies."""
+    invoices = Invoice.objects.filter(status=Invoice.PAID, paid_at__isnull=False, company__isnull=False)
+    totals = DailyInvoiceTotal.objects.all()
+    if company_ids:
+        invoices = invoices.filter(company_id__in=company_ids)
+        totals = totals.filter(company_id__in=company_ids)
+    totals.delete()
+
+    rows = invoices.annotate(day=TruncDate('paid_at', tzinfo=timezone.get_default_timezone()))\
+        .values('company_id', 'day')\
+        .annotate(income_price=Sum('total_price', filter=Q(type=Invoice.INCOME), default=0),
+                  income_count=Count('id', filter=Q(type=Invoice.INCOME)),
+                  costs_price=Sum('total_price', filter=Q(type=Invoice.COST), default=0),
+                  costs_count=Count('id', filter=Q(type=Invoice.COST)))\
+        .order_by()
+    created = DailyInvoiceTotal.objects.bulk_create(
+        (DailyInvoiceTotal(**row) for row in rows.iterator(chunk_size=2000)), batch_size=1000)
+    return len(created)
+
+
+def _as_datetime(day, tzinfo):
+    return datetime.datetime.combine(day, datetime.time.min, tzinfo=tzinfo)
+
+
+def _is_rollup_timezone(tzinfo):
+    # Rollup rows are days of the project time zone, they can only serve
+    # requests whose periods start at the same midnight.
+    return str(tzinfo) == str(timezone.get_default_timezone())
+
+
+def get_invoice_analytics(company, date_from, date_to, granularity='month', tzinfo=None):
+    """Sums and counts of paid income and costs per period between two dates
+    (inclusive), computed with a single conditional-aggregation query.
+
+    Periods are truncated in `tzinfo`. In the project time zone the query
+    reads the daily rollup, in any other zone it reads invoices with a
+    `paid_at` range predicate that can use an index."""
+    tzinfo = tzinfo or timezone.get_default_timezone()
+
+    if _is_rollup_timezone(tzinfo):
+        rows = DailyInvoiceTotal.objects.filter(company=company, day__gte=date_from, day__lte=date_to)\
+            .annotate(period=Trunc('day', granularity, output_field=DateField()))\
+            .values('period')\
+            .annotate(income_price=Sum('income_price'), income_count=Sum('income_count'),
+                      costs_price=Sum('costs_price'), costs_count=Sum('costs_count'))\
+            .order_by('period')
+        return [{**row, 'period': _as_datetime(row['period'], tzinfo)} for row in rows
+                if row['income_count'] or row['costs_count']]
+
+    start = _as_datetime(date_from, tzinfo)
+    end = _as_datetime(date_to + datetime.timedelta(days=1), tzinfo)
+    rows = Invoice.objects.filter(company=company, status=Invoice.PAID, paid_at__gte=start, paid_at__lt=end)\
+        .annotate(period=Trunc('paid_at', granularity, tzinfo=tzinfo))\
+        .values('period')\
+        .annotate(income_price=Sum('total_price', filter=Q(type=Invoice.INCOME), default=0),
+                  income_count=Count('id', filter=Q(type=Invoice.INCOME)),
+                  costs_price=Sum('total_price', filter=Q(type=Invoice.COST), default=0),
+                  costs_count=Count('id', filter=Q(type=Invoice.COST)))\
+        .order_by('period')
+    return list(rows)
+
+
+def get_daily_statistic(company, day):
+    rows = get_invoice_analytics(company, day, day, 'day')
+    row = rows[0] if rows else {'income_count': 0, 'costs_count': 0}
+    return {'income': {'price': row['income_price'] if row['income_count'] else None,
+                       'amount': row['income_count']},
+            'costs': {'price': row['costs_price'] if row['costs_count'] else None,
+                      'amount': row['costs_count']}}
+
+
+def get_monthly_statistic(company, date_from, date_to):
+    income_data, costs_data, income_count_data = [], [], []
+    for row in get_invoice_analytics(company, date_from, date_to, 'month'):
+        month = row['period']
+        year = month.replace(month=1)
+        if row['income_count']:
+            income_data.append({'month': month, 'year': year, 'total_price': row['income_price']})
+            income_count_data.append({'month': month, 'year': year, 'counts': row['income_count']})
+        if row['costs_count']:
+            costs_data.append({'month': month, 'year': year, 'total_price': row['costs_price']})
+    return {"income_data": income_data,
+            "costs_data": costs_data,
+            "income_count_data": income_count_data}
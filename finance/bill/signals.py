@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from bill.models import Invoice, Organization
+from bill.services.statistics import get_paid_day, subtract_paid_invoices, update_daily_totals
+
+
+# Deleted paid invoices leave the daily rollup. A deleted organization takes
+# its invoices out in one grouped query before they are deleted, other
+# deletes one invoice at a time.
+@receiver(pre_delete, sender=Organization)
+def subtract_organization_invoices(sender, instance, **kwargs):
+    subtract_paid_invoices(Invoice.objects.filter(organization=instance))
+
+
+@receiver(post_delete, sender=Invoice)
+def subtract_deleted_invoice(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Organization) or instance.status != Invoice.PAID \
+            or instance.paid_at is None or instance.company_id is None:
+        return
+    update_daily_totals(instance.company_id, get_paid_day(instance.paid_at), instance.type,
+                        -(instance.total_price or 0), -1)
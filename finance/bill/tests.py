@@ -1,16 +1,39 @@
 import datetime
 import decimal
+import unittest
+from io import StringIO
+from urllib.parse import urlencode
 from unittest.mock import patch, MagicMock
+from types import SimpleNamespace
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import NotSupportedError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework import status
+from django.utils import timezone
+from rest_framework import serializers, status
 from rest_framework.authtoken.models import Token
 
-from bill.models import Organization, Invoice, PaymentItem
+from bill.models import Organization, Invoice, PaymentItem, DailyInvoiceTotal
+from bill.serializers import InvoiceSerializer, OrganizationSerializer
+from bill.services import partitions
+from bill.services.benchmark_data import generate_tenants, clear_benchmark_data
+from bill.services.invoices import MAX_BULK_INVOICES
+from bill.services.statistics import rebuild_daily_totals
+from bill.views import InvoiceViewSet, OrganizationViewSet
+from finance.lean import get_lean_plan
+from finance.query_budgets import QueryBudget, QueryBudgetMixin
 from goods.models import Category, Product
+from goods.views import ProductViewSet
+from mailing.models import OutgoingEmail
+from staff.authentication import token_cache
 from staff.models import Company, Employee, BankDetails
+from staff.views import EmployeeViewSet
 from rest_framework.test import APIClient
 
 User = get_user_model()
@@ -62,6 +85,7 @@ class InvoiceTestCase(TestCase):
         self.assertEqual(len(PaymentItem.objects.all()), 1)
         self.assertEqual(PaymentItem.objects.first().invoice, actual_invoice)
         self.assertEqual(PaymentItem.objects.first().product, test_product)
+        self.assertEqual(PaymentItem.objects.first().invoice_created_at, actual_invoice.created_at)
 
     def test_create_invoice_without_approver(self):
         test_organization = Organization.objects.create(company=self.company,
@@ -158,6 +182,114 @@ class InvoiceTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data[0].title(), "Услуга В Счете Должна Быть Из Той Же Компании!")
 
+    def test_create_invoice_queries_do_not_depend_on_items(self):
+        test_organization = Organization.objects.create(company=self.company,
+                                                        name="name",
+                                                        taxes_number="taxes_number",
+                                                        address="address",
+                                                        phone_number="+376291234567",
+                                                        email="email@mail.com",
+                                                        description="description")
+        test_category = Category.objects.create(name="test_category")
+        products = [Product.objects.create(name=f"test{i}", description="test desc",
+                                           category=test_category, producer="test",
+                                           company=self.company) for i in range(20)]
+        url = reverse('invoices-list')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+        queries = []
+        for amount_of_items in (1, 20):
+            test_data = {"type": "Поступление",
+                         "approver": self.employee.id, "organization": test_organization.id,
+                         "payment_items": [{"product_id": product.id, "amount": 1, "price": "10.00"}
+                                           for product in products[:amount_of_items]]}
+            token_cache.clear()  # оба запроса без закешированного токена
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(url, test_data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.data["payment_items"]), amount_of_items)
+            queries.append(len(context.captured_queries))
+
+        # количество запросов не зависит от количества позиций в счете
+        self.assertEqual(queries[0], queries[1])
+
+    def test_create_invoice_with_unknown_product(self):
+        test_organization = Organization.objects.create(company=self.company,
+                                                        name="name",
+                                                        taxes_number="taxes_number",
+                                                        address="address",
+                                                        phone_number="+376291234567",
+                                                        email="email@mail.com",
+                                                        description="description")
+        test_data = {"type": "Поступление",
+                     "approver": self.employee.id, "organization": test_organization.id,
+                     "payment_items": [{"product_id": 100500, "amount": 2, "price": "10.00"}]}
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.post(reverse('invoices-list'), test_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], "Услуга в счете не найдена!")
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_bulk_create_invoices(self):
+        test_organization = Organization.objects.create(company=self.company,
+                                                        name="name",
+                                                        taxes_number="taxes_number",
+                                                        address="address",
+                                                        phone_number="+376291234567",
+                                                        email="email@mail.com",
+                                                        description="description")
+        test_category = Category.objects.create(name="test_category")
+        test_product = Product.objects.create(name="test", description="test desc",
+                                              category=test_category, producer="test",
+                                              company=self.company)
+        test_data = [{"type": "Поступление",
+                      "approver": self.employee.id, "organization": test_organization.id,
+                      "payment_items": [{"product_id": test_product.id, "amount": amount, "price": "10.00"}]}
+                     for amount in (1, 2, 3)]
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.post(reverse('invoices-bulk'), test_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 3)
+        ids = [result["id"] for result in response.data["results"]]
+        totals = [Invoice.objects.get(id=invoice_id).total_price for invoice_id in ids]
+        self.assertEqual(totals, [decimal.Decimal("10.00"), decimal.Decimal("20.00"), decimal.Decimal("30.00")])
+        self.assertEqual(PaymentItem.objects.filter(invoice_id__in=ids).count(), 3)
+
+    def test_bulk_create_invoices_all_or_nothing(self):
+        test_organization = Organization.objects.create(company=self.company,
+                                                        name="name",
+                                                        taxes_number="taxes_number",
+                                                        address="address",
+                                                        phone_number="+376291234567",
+                                                        email="email@mail.com",
+                                                        description="description")
+        test_category = Category.objects.create(name="test_category")
+        test_product = Product.objects.create(name="test", description="test desc",
+                                              category=test_category, producer="test",
+                                              company=self.company)
+        valid_invoice = {"type": "Поступление",
+                         "approver": self.employee.id, "organization": test_organization.id,
+                         "payment_items": [{"product_id": test_product.id, "amount": 1, "price": "10.00"}]}
+        test_data = [valid_invoice,
+                     {**valid_invoice, "approver": 100500},
+                     {**valid_invoice, "type": "unknown"}]
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.post(reverse('invoices-bulk'), test_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["created"], 0)
+        self.assertNotIn("errors", response.data["results"][0])
+        self.assertEqual(response.data["results"][1]["errors"]["non_field_errors"][0], "Проверяющий не найден!")
+        self.assertIn("type", response.data["results"][2]["errors"])
+        self.assertFalse(Invoice.objects.exists())
+
+        response = self.client.post(reverse('invoices-bulk') + "?partial=true", test_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(Invoice.objects.get().id, response.data["results"][0]["id"])
+
     def test_change_status_invoice_to_applyed(self):
         test_organization = Organization.objects.create(company=self.company,
                                                         name="name",
@@ -278,6 +410,14 @@ class InvoiceTestCase(TestCase):
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+        # файл отдается потоком, BOM идет в начале файла
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.startswith('\ufeff'))
+        rows = content.lstrip('\ufeff').splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[0].startswith('id,Создано'))
+        self.assertIn('name,position,test@mail.com', rows[1])
+
     def test_list_invoice(self):
         test_organization = Organization.objects.create(company=self.company,
                                                         name="name",
@@ -294,11 +434,87 @@ class InvoiceTestCase(TestCase):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data[0]["type"], "Поступление")
-        self.assertEqual(response.data[0]["status"], "Оплачен")
-        self.assertIsNotNone(response.data[0]["created_at"])
-        self.assertEqual(response.data[0]["organization"]["id"], test_organization.id)
-        self.assertEqual(response.data[0]["approver"]["id"], self.employee.id)
+        self.assertEqual(response.data["results"][0]["type"], "Поступление")
+        self.assertEqual(response.data["results"][0]["status"], "Оплачен")
+        self.assertIsNotNone(response.data["results"][0]["created_at"])
+        self.assertEqual(response.data["results"][0]["organization"]["id"], test_organization.id)
+        self.assertEqual(response.data["results"][0]["approver"]["id"], self.employee.id)
+
+    def test_list_invoice_cursor_pagination(self):
+        test_organization = Organization.objects.create(company=self.company,
+                                                        name="name",
+                                                        taxes_number="taxes_number",
+                                                        address="address",
+                                                        phone_number="+376291234567",
+                                                        email="email@mail.com",
+                                                        description="description")
+        invoices = [Invoice.objects.create(type="Поступление", organization=test_organization,
+                                           approver=self.employee, company=self.company, status=Invoice.PAID)
+                    for _ in range(5)]
+        Invoice.objects.create(type="Расходы", organization=test_organization,
+                               approver=self.employee, company=self.company, status=Invoice.PAID)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse('invoices-list') + "?" + urlencode({"type": Invoice.INCOME, "page_size": 2})
+        ids = []
+        while url:
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            ids.extend(invoice["id"] for invoice in response.data["results"])
+            url = response.data["next"]
+
+        # новые счета идут первыми, каждый счет попадает ровно на одну страницу
+        self.assertEqual(ids, [invoice.id for invoice in reversed(invoices)])
+
+        # порядок клиента: счета с одинаковым created_at упорядочены по id
+        Invoice.objects.filter(id__in=[invoice.id for invoice in invoices[1:4]])\
+            .update(created_at=invoices[0].created_at)
+        # paid_at может быть пустым и не годится для курсора, такой порядок не применяется
+        for ordering, expected in (("created_at", invoices), ("-id", list(reversed(invoices))),
+                                   ("paid_at", invoices[4:] + invoices[:4])):
+            url = reverse('invoices-list') + "?" + urlencode({"type": Invoice.INCOME, "page_size": 2,
+                                                             "ordering": ordering})
+            ids = []
+            while url:
+                response = self.client.get(url, format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                ids.extend(invoice["id"] for invoice in response.data["results"])
+                url = response.data["next"]
+            self.assertEqual(ids, [invoice.id for invoice in expected], ordering)
+
+    def test_list_invoice_queries_do_not_depend_on_rows(self):
+        test_category = Category.objects.create(name="test_category")
+        test_product = Product.objects.create(name="test", description="test desc",
+                                              category=test_category, producer="test",
+                                              company=self.company)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+        queries = []
+        for _ in range(2):
+            details = BankDetails.objects.create(name="name", address="address",
+                                                 bank_number="bank_number", settlement_account="account")
+            test_organization = Organization.objects.create(company=self.company,
+                                                            name="name",
+                                                            taxes_number="taxes_number",
+                                                            address="address",
+                                                            phone_number="+376291234567",
+                                                            email="email@mail.com",
+                                                            description="description",
+                                                            bank_detail=details)
+            for _ in range(3):
+                invoice = Invoice.objects.create(type="Поступление", organization=test_organization,
+                                                 approver=self.employee, company=self.company)
+                PaymentItem.objects.create(invoice=invoice, product=test_product, price="10.00", amount=2)
+
+            token_cache.clear()  # оба запроса без закешированного токена
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('invoices-list'), format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            queries.append(len(context.captured_queries))
+
+        self.assertEqual(len(response.data["results"]), 6)
+        self.assertEqual(queries[0], queries[1])
 
     def test_list_review_invoice(self):
         test_organization = Organization.objects.create(company=self.company,
@@ -338,12 +554,16 @@ class InvoiceTestCase(TestCase):
                                               company=self.company)
 
         invoice_paid = Invoice.objects.create(type="Поступление", organization=test_organization,
-                                              approver=self.employee, company=self.company, status=Invoice.PAID,
-                                              total_price="20.00", paid_at=datetime.datetime.now())
+                                              approver=self.employee, company=self.company, status=Invoice.APPLYED,
+                                              total_price="20.00")
 
         PaymentItem.objects.create(invoice=invoice_paid, product=test_product, price="10.00", amount=2)
 
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        # статистика считается при оплате счета
+        response = self.client.post(reverse('invoice-status', args=[invoice_paid.id]),
+                                    {"status": "Оплачен"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
         response = self.client.get(reverse("daily-stats"), format='json')
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -352,6 +572,110 @@ class InvoiceTestCase(TestCase):
         self.assertEqual(response.data["costs"]["price"], None)
         self.assertEqual(response.data["costs"]["amount"], 0)
 
+    def test_monthly_stats_invoice(self):
+        test_organization = Organization.objects.create(company=self.company,
+                                                        name="name",
+                                                        taxes_number="taxes_number",
+                                                        address="address",
+                                                        phone_number="+376291234567",
+                                                        email="email@mail.com",
+                                                        description="description")
+        now = timezone.now()
+        for invoice_type, price in (("Поступление", "20.00"), ("Поступление", "5.00"), ("Расходы", "7.00")):
+            Invoice.objects.create(type=invoice_type, organization=test_organization,
+                                   approver=self.employee, company=self.company, status=Invoice.PAID,
+                                   total_price=price, paid_at=now)
+        # счет другой компании и неоплаченный счет в статистику не попадают
+        Invoice.objects.create(type="Поступление", organization=test_organization, approver=self.employee,
+                               company=Company.objects.create(name="another"), status=Invoice.PAID,
+                               total_price="100.00", paid_at=now)
+        Invoice.objects.create(type="Поступление", organization=test_organization, approver=self.employee,
+                               company=self.company, status=Invoice.APPLYED, total_price="100.00")
+
+        call_command('rebuild_invoice_stats', stdout=StringIO())
+        self.assertEqual(DailyInvoiceTotal.objects.count(), 2)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(reverse("stats"), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["income_data"]), 1)
+        self.assertEqual(response.data["income_data"][0]["total_price"], decimal.Decimal("25.00"))
+        self.assertEqual(response.data["income_data"][0]["month"].month, now.month)
+        self.assertEqual(response.data["costs_data"][0]["total_price"], decimal.Decimal("7.00"))
+        self.assertEqual(response.data["income_count_data"][0]["counts"], 2)
+
+    def test_invoice_analytics(self):
+        test_organization = Organization.objects.create(company=self.company,
+                                                        name="name",
+                                                        taxes_number="taxes_number",
+                                                        address="address",
+                                                        phone_number="+376291234567",
+                                                        email="email@mail.com",
+                                                        description="description")
+        paid_at = datetime.datetime(2022, 3, 31, 22, 30, tzinfo=datetime.timezone.utc)
+        for invoice_type, price in (("Поступление", "20.00"), ("Расходы", "7.00")):
+            Invoice.objects.create(type=invoice_type, organization=test_organization,
+                                   approver=self.employee, company=self.company, status=Invoice.PAID,
+                                   total_price=price, paid_at=paid_at)
+        call_command('rebuild_invoice_stats', stdout=StringIO())
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse("invoice-analytics")
+        # в UTC платеж относится к марту, в Минске (UTC+3) - уже к апрелю
+        for tz, month in (("UTC", 3), ("Europe/Minsk", 4)):
+            response = self.client.get(url, {"date_from": "2022-01-01", "date_to": "2022-12-31",
+                                             "granularity": "month", "timezone": tz}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data["results"]), 1)
+            row = response.data["results"][0]
+            self.assertEqual(row["period"].month, month)
+            self.assertEqual(row["income_price"], decimal.Decimal("20.00"))
+            self.assertEqual(row["income_count"], 1)
+            self.assertEqual(row["costs_price"], decimal.Decimal("7.00"))
+            self.assertEqual(row["costs_count"], 1)
+
+        response = self.client.get(url, {"date_from": "2022-01-01", "date_to": "2022-12-31",
+                                         "timezone": "Mars/Olympus"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # границы дат и длина периода ограничены, без переполнения datetime
+        for date_from, date_to in (("9999-01-01", "9999-12-31"), ("0001-01-01", "0001-12-31"),
+                                   ("1000-01-01", "3000-01-01")):
+            response = self.client.get(url, {"date_from": date_from, "date_to": date_to, "timezone": "UTC"},
+                                       format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invoice_analytics_after_delete(self):
+        organizations = [Organization.objects.create(company=self.company, name=f"name{i}",
+                                                     taxes_number=f"taxes_number{i}", address="address",
+                                                     phone_number="+376291234567", email="email@mail.com",
+                                                     description="description") for i in range(2)]
+        paid_at = datetime.datetime(2022, 3, 15, 12, 0, tzinfo=datetime.timezone.utc)
+        invoices = [Invoice.objects.create(type=invoice_type, organization=organization,
+                                           approver=self.employee, company=self.company, status=Invoice.PAID,
+                                           total_price=price, paid_at=paid_at)
+                    for organization in organizations
+                    for invoice_type, price in (("Поступление", "20.00"), ("Расходы", "7.00"))]
+        call_command('rebuild_invoice_stats', stdout=StringIO())
+
+        # удаленная организация забирает свои оплаченные счета, отдельный счет удаляется сам
+        organizations[0].delete()
+        Invoice.objects.get(pk=invoices[3].pk).delete()
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        url = reverse("invoice-analytics")
+        # UTC - зона проекта, читается свод, Europe/Minsk считается по счетам
+        for tz in ("UTC", "Europe/Minsk"):
+            response = self.client.get(url, {"date_from": "2022-01-01", "date_to": "2022-12-31",
+                                             "granularity": "month", "timezone": tz}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data["results"]), 1)
+            row = response.data["results"][0]
+            self.assertEqual(row["income_price"], decimal.Decimal("20.00"))
+            self.assertEqual(row["income_count"], 1)
+            self.assertEqual(row["costs_price"] or 0, 0)
+            self.assertEqual(row["costs_count"], 0)
+
     @patch("bill.views.send_customer_invoice")
     def test_send_customer_invoice(self, mock):
         mock.return_value = MagicMock()
@@ -377,3 +701,777 @@ class InvoiceTestCase(TestCase):
 
         self.assertEqual(response.data["message"], "Email был отправлен!")
         mock.assert_called_once()
+
+    def test_send_customer_invoices(self):
+        test_organization = Organization.objects.create(company=self.company,
+                                                        name="name",
+                                                        taxes_number="taxes_number",
+                                                        address="address",
+                                                        phone_number="+376291234567",
+                                                        email="email@mail.com",
+                                                        description="description")
+        test_category = Category.objects.create(name="test_category")
+        test_product = Product.objects.create(name="test", description="test desc",
+                                              category=test_category, producer="test",
+                                              company=self.company)
+        applyed = []
+        for _ in range(3):
+            invoice = Invoice.objects.create(type="Поступление", organization=test_organization,
+                                             approver=self.employee, company=self.company,
+                                             status=Invoice.APPLYED, total_price="20.00")
+            PaymentItem.objects.create(invoice=invoice, product=test_product, price="10.00", amount=2)
+            applyed.append(invoice)
+        on_review = Invoice.objects.create(type="Поступление", organization=test_organization,
+                                           approver=self.employee, company=self.company)
+        details = BankDetails.objects.create(name="name", address="address",
+                                             bank_number="bank_number", settlement_account="settlement_account")
+        self.company.bank_detail = details
+        self.company.save()
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        ids = [invoice.id for invoice in applyed] + [on_review.id, 100500]
+        response = self.client.post(reverse("invoices-sending"), {"ids": ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["sent"], 3)
+        self.assertEqual([result["id"] for result in response.data["results"]], ids)
+        self.assertEqual(response.data["results"][3]["message"], "Неверный статус или тип!")
+        self.assertEqual(response.data["results"][4]["message"], "Счет не найден")
+
+        emails = OutgoingEmail.objects.filter(id__in=[result["email_id"] for result in response.data["results"][:3]])
+        self.assertEqual(len(emails), 3)
+        self.assertIn("test, цена - 10.00, кол-во - 2.", emails[0].body)
+        self.assertEqual(emails[0].recipients, ["email@mail.com"])
+
+        # без списка id отправляются все выставленные счета, подходящие под фильтр
+        response = self.client.post(reverse("invoices-sending"), {}, format='json')
+        self.assertEqual(response.data["sent"], 3)
+        self.assertFalse(response.data["has_more"])
+
+        self.assertIsNone(response.data["after"])
+
+        # за раз отправляется не больше MAX_BULK_INVOICES, следующая часть - по after из ответа
+        with patch('bill.views.MAX_BULK_INVOICES', 2):
+            response = self.client.post(reverse("invoices-sending"), {}, format='json')
+            self.assertEqual([result["id"] for result in response.data["results"]], ids[:2])
+            self.assertTrue(response.data["has_more"])
+            response = self.client.post(reverse("invoices-sending"), {"after": response.data["after"]},
+                                        format='json')
+            self.assertEqual([result["id"] for result in response.data["results"]], ids[2:3])
+            self.assertFalse(response.data["has_more"])
+            self.assertIsNone(response.data["after"])
+            response = self.client.post(reverse("invoices-sending"), {"ids": ids[:1], "after": ids[0]},
+                                        format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            response = self.client.post(reverse("invoices-sending"), {"ids": ids[:3]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncInvoiceTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@mail.com', 'testingpassword')
+        self.company = Company.objects.create(name="test", description="description")
+        self.employee = Employee.objects.create(position="position", company=self.company,
+                                                user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+        organization = Organization.objects.create(company=self.company, name="name",
+                                                   taxes_number="taxes_number", address="address",
+                                                   phone_number="+376291234567", email="email@mail.com",
+                                                   description="description")
+        category = Category.objects.create(name="test_category")
+        product = Product.objects.create(name="test", description="test desc", category=category,
+                                         producer="test", company=self.company)
+        self.invoices = []
+        for invoice_status in (Invoice.ON_REVIEW, Invoice.ON_REVIEW, Invoice.APPLYED):
+            invoice = Invoice.objects.create(type="Поступление", organization=organization,
+                                             approver=self.employee, company=self.company,
+                                             status=invoice_status, total_price="20.00")
+            PaymentItem.objects.create(invoice=invoice, product=product, price="10.00", amount=2)
+            self.invoices.append(invoice)
+        self.client.post(reverse('invoice-status', args=[self.invoices[2].id]), {"status": "Оплачен"},
+                         format='json')
+
+    async def assertSameResponse(self, sync_url, async_url):
+        sync_response = await sync_to_async(self.client.get)(sync_url)
+        async_response = await self.async_client.get(async_url, authorization='Token ' + self.token.key)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.content, sync_response.content)
+        return async_response
+
+    async def test_async_endpoints_match_sync(self):
+        # асинхронные эндпоинты отвечают так же, как синхронные
+        response = await self.assertSameResponse(reverse('invoices-list'), reverse('async-invoices-list'))
+        self.assertEqual(len(response.json()["results"]), 3)
+        response = await self.assertSameResponse(reverse('invoice-detail', args=[self.invoices[0].id]),
+                                                 reverse('async-invoice-detail', args=[self.invoices[0].id]))
+        self.assertEqual(len(response.json()["payment_items"]), 1)
+        response = await self.assertSameResponse("/api/invoices/review", reverse('async-invoices-review'))
+        self.assertEqual(len(response.json()), 2)
+        await self.assertSameResponse(reverse('daily-stats'), reverse('async-daily-stats'))
+        await self.assertSameResponse(reverse('stats'), reverse('async-stats'))
+
+    async def test_async_errors_match_sync(self):
+        other_company = await Company.objects.acreate(name="other")
+        organization = await Organization.objects.acreate(company=other_company, name="name",
+                                                          taxes_number="taxes_number", address="address",
+                                                          phone_number="+376291234567",
+                                                          email="email@mail.com", description="description")
+        invoice = await Invoice.objects.acreate(type="Поступление", organization=organization,
+                                                company=other_company)
+        # счет чужой компании не найден
+        await self.assertSameResponse(reverse('invoice-detail', args=[invoice.id]),
+                                      reverse('async-invoice-detail', args=[invoice.id]))
+        response = await self.async_client.get(reverse('async-invoices-list'), authorization='Token wrong')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        # асинхронные эндпоинты только читают
+        response = await self.async_client.post(reverse('async-invoices-list'),
+                                                authorization='Token ' + self.token.key)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class InvoiceIndexTestCase(TestCase):
+    """Checks with EXPLAIN that the hot tenant-scoped queries are served by
+    the composite indexes, on a dataset with many tenants."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="category")
+        companies = Company.objects.bulk_create(Company(name=f"company {i}") for i in range(20))
+        users = User.objects.bulk_create(User(username=f"user{i}", email=f"user{i}@mail.com") for i in range(20))
+        employees = Employee.objects.bulk_create(Employee(user=user, company=company, position="position")
+                                                 for user, company in zip(users, companies))
+        organizations = Organization.objects.bulk_create(
+            Organization(company=company, name=f"organization {i}", taxes_number="taxes_number",
+                         address="address", phone_number="+376291234567", email="email@mail.com",
+                         description="description")
+            for company in companies for i in range(20))
+        Product.objects.bulk_create(Product(company=company, name=f"product {i}", description="description",
+                                            category=category, producer="producer")
+                                    for company in companies for i in range(20))
+        statuses = [Invoice.ON_REVIEW, Invoice.APPLYED, Invoice.PAID, Invoice.CANCELED]
+        paid_at = timezone.now() - datetime.timedelta(days=30)
+        Invoice.objects.bulk_create(
+            Invoice(company=organization.company, organization=organization, approver=employee,
+                    type=Invoice.INCOME if i % 3 else Invoice.COST, status=statuses[i % 4],
+                    total_price="10.00", paid_at=paid_at + datetime.timedelta(hours=i))
+            for organization, employee in zip(organizations, [e for e in employees for _ in range(20)])
+            for i in range(25))
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        cls.employee = employees[0]
+        cls.token = Token.objects.create(user=users[0])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def assertUsesIndex(self, url, params, table, *index_names):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        queries = [query["sql"] for query in context.captured_queries
+                   if query["sql"].startswith("SELECT") and f' FROM "{table}"' in query["sql"]]
+        self.assertTrue(queries, f"{url} не обращается к {table}")
+        for sql in queries:
+            with connection.cursor() as cursor:
+                cursor.execute(connection.ops.explain_query_prefix() + " " + sql)
+                plan = "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+            self.assertTrue(any(index_name in plan for index_name in index_names), f"{url}: {sql}\n{plan}")
+
+    # ETag списков считается по всем строкам компании: по индексу компании или updated_at
+
+    def test_invoice_list_uses_index(self):
+        self.assertUsesIndex(reverse('invoices-list'), {}, "bill_invoice",
+                             "invoice_company_created_idx", "invoice_company_updated_idx")
+
+    def test_review_invoices_uses_index(self):
+        self.assertUsesIndex("/api/invoices/review", {}, "bill_invoice", "invoice_company_review_idx")
+
+    def test_invoice_report_uses_index(self):
+        # отчет отсортирован по дате создания, планировщик может выбрать любой из индексов
+        self.assertUsesIndex(reverse('invoice-report'), {}, "bill_invoice",
+                             "invoice_company_stats_idx", "invoice_company_created_idx")
+
+    def test_invoice_analytics_uses_index(self):
+        today = timezone.now().date()
+        self.assertUsesIndex(reverse('invoice-analytics'),
+                             {"date_from": today - datetime.timedelta(days=60), "date_to": today,
+                              "timezone": "Europe/Minsk"},
+                             "bill_invoice", "invoice_company_stats_idx")
+
+    def test_organization_list_uses_index(self):
+        self.assertUsesIndex("/api/organizations/", {"ordering": "name"},
+                             "bill_organization", "organization_company_name_idx", "bill_organization_company_id")
+
+    def test_product_list_uses_index(self):
+        self.assertUsesIndex(reverse('product-list-create'), {"ordering": "name"},
+                             "goods_product", "product_company_name_idx", "goods_product_company_id")
+
+
+class BenchmarkDataTestCase(TestCase):
+    def test_generate_tenants(self):
+        company_ids = generate_tenants(tenants=2, employees=3, organizations=4, products=5, categories=2,
+                                       invoices=30, items=3, days=30, password='benchmark')
+        self.assertEqual(len(company_ids), 2)
+        self.assertEqual(Employee.objects.filter(company_id__in=company_ids).count(), 6)
+        self.assertEqual(Organization.objects.filter(company_id__in=company_ids).count(), 8)
+        self.assertEqual(Invoice.objects.filter(company_id__in=company_ids).count(), 60)
+
+        invoices = Invoice.objects.filter(company_id__in=company_ids)
+        for invoice in invoices.prefetch_related('payment_items'):
+            items = list(invoice.payment_items.all())
+            self.assertTrue(1 <= len(items) <= 3)
+            self.assertEqual(invoice.total_price, sum(item.price * item.amount for item in items))
+            self.assertEqual(invoice.pay_to - invoice.created_at, datetime.timedelta(days=14))
+            self.assertEqual(invoice.paid_at is not None, invoice.status == Invoice.PAID)
+            # позиции лежат в секции того же месяца, что и счет
+            self.assertTrue(all(item.invoice_created_at == invoice.created_at for item in items))
+        # даты создания распределены по периоду, а не равны времени вставки
+        self.assertGreater(invoices.values('created_at').distinct().count(), 1)
+        self.assertTrue(DailyInvoiceTotal.objects.filter(company_id__in=company_ids).exists())
+
+        # менеджер входит с общим паролем
+        response = APIClient().post("/api/login/", {"email": "tenant0-0@benchmark.local", "password": "benchmark"},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(clear_benchmark_data(), 2)
+        self.assertFalse(Invoice.objects.exists())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(BankDetails.objects.exists())
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@mail.com', 'testingpassword')
+        self.company = Company.objects.create(name="test", description="description")
+        self.employee = Employee.objects.create(position="position", company=self.company, user=self.user)
+        self.organization = Organization.objects.create(company=self.company, name="name",
+                                                        taxes_number="taxes_number", address="address",
+                                                        phone_number="+375291234567", email="email@mail.com",
+                                                        description="description")
+        self.product = Product.objects.create(name="test", description="description",
+                                              category=Category.objects.create(name="category"),
+                                              producer="test", company=self.company)
+        self.invoice = Invoice.objects.create(company=self.company, organization=self.organization,
+                                              approver=self.employee, total_price="20.00")
+        PaymentItem.objects.create(invoice=self.invoice, product=self.product, price="10.00", amount=2)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.detail_url = reverse('invoice-detail', args=[self.invoice.id])
+
+    def assertNotModified(self, url, etag):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        # счет и его позиции не читаются, сериализатор не вызывается
+        self.assertFalse([query for query in context.captured_queries
+                          if "bill_paymentitem" in query["sql"]])
+
+    def test_invoice_detail(self):
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+        self.assertIn("Authorization", response["Vary"])
+        self.assertNotModified(self.detail_url, etag)
+
+        # Last-Modified проверяется, если клиент не прислал ETag
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.post(reverse('invoice-status', args=[self.invoice.id]),
+                                    {"status": Invoice.APPLYED}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], Invoice.APPLYED)
+
+    def test_invoice_changes_with_rendered_models(self):
+        for change in (lambda: self.organization.save(), lambda: self.product.save(),
+                       lambda: self.product.category.save(), lambda: self.employee.save(),
+                       lambda: self.company.save()):
+            etag = self.client.get(self.detail_url)["ETag"]
+            change()
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deleted_dependencies(self):
+        # удаление обнуляет связь запросом без auto_now; удаляемые строки не самые свежие,
+        # так что максимум updated_at зависимостей не меняется, а ETag все равно должен
+        colleague = Employee.objects.create(position="position", company=self.company,
+                                            user=User.objects.create_user('other', 'other@mail.com', 'password'))
+        Invoice.objects.filter(id=self.invoice.id).update(approver=colleague)
+        Product.objects.create(name="newer", category=Category.objects.create(name="newer"), company=self.company)
+        self.employee.save()
+
+        product_url = reverse('product-delete-update', args=[self.product.id])
+        etags = [self.client.get(url)["ETag"] for url in (self.detail_url, product_url)]
+        response = self.client.delete(reverse('categories-delete-update', args=[self.product.category_id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        for url, etag in zip((self.detail_url, product_url), etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = self.client.get(self.detail_url)["ETag"]
+        response = self.client.delete(f'/api/employees/{colleague.id}')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data["approver"])
+
+    def test_invoice_list(self):
+        url = reverse('invoices-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+        self.assertNotIn("Last-Modified", response)
+        self.assertNotModified(url, etag)
+
+        # ETag зависит от фильтров и от количества строк
+        self.assertNotEqual(self.client.get(url, data={"status": Invoice.PAID}).get("ETag"), etag)
+        invoice = Invoice.objects.create(company=self.company, organization=self.organization,
+                                         approver=self.employee, total_price="20.00")
+        etag = self.client.get(url)["ETag"]
+        Invoice.objects.filter(id=invoice.id).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_other_tenant(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        user = User.objects.create_user('other', 'other@mail.com', 'testingpassword')
+        Employee.objects.create(position="position", company=Company.objects.create(name="other"), user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class InvoiceListFixture:
+    """Счета с разными связями для проверки формы списков."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@mail.com', 'testingpassword')
+        bank_detail = BankDetails.objects.create(name="bank", address="address", bank_number="123",
+                                                 settlement_account="456", details="details")
+        self.company = Company.objects.create(name="test", description="description", bank_detail=bank_detail)
+        self.employee = Employee.objects.create(position="position", company=self.company, user=self.user)
+        colleague = Employee.objects.create(position="", company=self.company,
+                                            user=User.objects.create_user('other', 'other@mail.com', 'password'))
+        organizations = [
+            Organization.objects.create(company=self.company, name="name", taxes_number="taxes_number",
+                                        address="address", phone_number="+375291234567",
+                                        email="email@mail.com", description="description",
+                                        bank_detail=BankDetails.objects.create(name="org bank")),
+            Organization.objects.create(company=self.company, name="other", taxes_number="1",
+                                        address="", phone_number="+375297654321", email="other@mail.com",
+                                        description=""),
+        ]
+        products = [Product.objects.create(name="test", description="description",
+                                           category=Category.objects.create(name="category"),
+                                           producer="test", company=self.company),
+                    Product.objects.create(name="no category", description="", producer="",
+                                           company=self.company)]
+        for number in range(5):
+            invoice = Invoice.objects.create(company=self.company, organization=organizations[number % 2],
+                                             approver=(self.employee, colleague, None)[number % 3],
+                                             type=(Invoice.INCOME, Invoice.COST)[number % 2],
+                                             total_price=decimal.Decimal("1234.5") + number,
+                                             pay_to=timezone.now() + datetime.timedelta(days=number),
+                                             paid_at=timezone.now() if number % 2 else None)
+            for product in products[:number % 3]:
+                PaymentItem.objects.create(invoice=invoice, product=product, price="10.1", amount=number)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+
+    def assertSameAsSerializer(self, view, url, data=None):
+        """Ответ быстрого списка совпадает с ответом сериализатора байт в байт."""
+        lean = self.client.get(url, data=data)
+        with patch.object(view, 'lean_list', False):
+            full = self.client.get(url, data=data)
+        self.assertEqual(lean.status_code, status.HTTP_200_OK)
+        self.assertEqual(full.status_code, status.HTTP_200_OK)
+        self.assertEqual(lean.content, full.content)
+        return lean.json()
+
+
+class LeanListTestCase(InvoiceListFixture, TestCase):
+    def test_invoice_list(self):
+        # сериализатор счетов в быстром режиме не вызывается
+        with patch.object(InvoiceSerializer, 'to_representation', side_effect=AssertionError):
+            self.client.get(reverse('invoices-list'))
+        data = self.assertSameAsSerializer(InvoiceViewSet, reverse('invoices-list'))
+        self.assertEqual(len(data["results"]), 5)
+        self.assertEqual(sorted(len(invoice["payment_items"]) for invoice in data["results"]), [0, 0, 1, 1, 2])
+        self.assertIn(None, [invoice["approver"] for invoice in data["results"]])
+
+    def test_invoice_list_pages(self):
+        url = reverse('invoices-list')
+        data = self.assertSameAsSerializer(InvoiceViewSet, url, {"page_size": 2})
+        pages = 1
+        while data["next"]:
+            data = self.assertSameAsSerializer(InvoiceViewSet, data["next"])
+            pages += 1
+        self.assertEqual(pages, 3)
+        for params in ({"ordering": "total_price", "page_size": 3}, {"search": "other"},
+                       {"type": Invoice.COST}, {"status": Invoice.PAID}):
+            self.assertSameAsSerializer(InvoiceViewSet, url, params)
+
+    def test_async_invoice_list(self):
+        with patch.object(InvoiceSerializer, 'to_representation', side_effect=AssertionError):
+            response = self.client.get(reverse('async-invoices-list'))
+        with patch.object(InvoiceViewSet, 'lean_list', False):
+            self.assertEqual(self.client.get(reverse('invoices-list')).content, response.content)
+
+    def test_other_lists(self):
+        self.assertSameAsSerializer(OrganizationViewSet, '/api/organizations/')
+        self.assertSameAsSerializer(ProductViewSet, reverse('product-list-create'))
+        self.assertSameAsSerializer(EmployeeViewSet, '/api/employees/', {"page_size": 1})
+
+    def test_unsupported_serializer(self):
+        class MethodFieldSerializer(OrganizationSerializer):
+            label = serializers.SerializerMethodField()
+
+            class Meta(OrganizationSerializer.Meta):
+                fields = OrganizationSerializer.Meta.fields + ['label']
+
+        with self.assertRaises(ImproperlyConfigured):
+            get_lean_plan(MethodFieldSerializer)
+
+
+class SparseFieldsTestCase(InvoiceListFixture, TestCase):
+    def get_list_queries(self, data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('invoices-list'), data=data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, [query["sql"] for query in context.captured_queries]
+
+    def test_fields(self):
+        params = {"fields": "id,status,total_price,organization.name"}
+        data = self.assertSameAsSerializer(InvoiceViewSet, reverse('invoices-list'), params)
+        invoice = data["results"][0]
+        self.assertEqual(list(invoice), ["id", "status", "total_price", "organization"])
+        self.assertEqual(list(invoice["organization"]), ["name"])
+
+        # позиции, товары и сотрудники не читаются, к счетам присоединяются только организации
+        for lean in (True, False):
+            with patch.object(InvoiceViewSet, 'lean_list', lean):
+                _, queries = self.get_list_queries(params)
+                _, full_queries = self.get_list_queries({})
+            self.assertLess(len(queries), len(full_queries))
+            self.assertFalse([sql for sql in queries if "bill_paymentitem" in sql])
+            # страница счетов, а не агрегат условного GET
+            page_sql, = [sql for sql in queries if 'FROM "bill_invoice"' in sql and "COUNT(" not in sql]
+            self.assertEqual(page_sql.count("JOIN"), 1)
+            self.assertIn('"bill_organization"', page_sql)
+
+    def test_expand(self):
+        data = self.assertSameAsSerializer(InvoiceViewSet, reverse('invoices-list'),
+                                           {"expand": "organization,payment_items.product"})
+        for invoice in data["results"]:
+            self.assertIsInstance(invoice["organization"], dict)
+            self.assertIn(type(invoice["organization"]["bank_detail"]), (int, type(None)))
+            self.assertIn(type(invoice["approver"]), (int, type(None)))
+            for item in invoice["payment_items"]:
+                self.assertIn(type(item["product"]["category"]), (int, type(None)))
+
+        # пустой expand оставляет вместо всех вложенных объектов их ключи
+        data = self.assertSameAsSerializer(InvoiceViewSet, reverse('invoices-list'), {"expand": ""})
+        items = [item for invoice in data["results"] for item in invoice["payment_items"]]
+        self.assertEqual(sorted(items), sorted(PaymentItem.objects.values_list("id", flat=True)))
+
+    def test_detail(self):
+        invoice = Invoice.objects.filter(approver__isnull=False).first()
+        url = reverse('invoice-detail', args=[invoice.id])
+        response = self.client.get(url, data={"fields": "id,approver.user.email"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"id": invoice.id,
+                                           "approver": {"user": {"email": invoice.approver.user.email}}})
+        # представления с разными полями не делят ETag
+        self.assertNotEqual(response["ETag"], self.client.get(url)["ETag"])
+
+    def test_unknown_fields(self):
+        for params in ({"fields": "id,unknown"}, {"fields": "status.name"}, {"fields": "company"},
+                       {"expand": "total_price"}, {"expand": "organization.unknown"}):
+            response = self.client.get(reverse('invoices-list'), data=params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertIn(next(iter(params)), response.json())
+
+
+class BulkInvoiceStatusTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test', 'test@mail.com', 'testingpassword')
+        self.company = Company.objects.create(name="test", description="description")
+        self.employee = Employee.objects.create(position="position", company=self.company, user=self.user)
+        self.colleague = Employee.objects.create(position="position", company=self.company,
+                                                 user=User.objects.create_user('other', 'other@mail.com', 'password'))
+        self.organization = Organization.objects.create(company=self.company, name="name",
+                                                        taxes_number="taxes_number", address="address",
+                                                        phone_number="+375291234567", email="email@mail.com",
+                                                        description="description")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = reverse('invoices-bulk-status')
+
+    def create_invoice(self, invoice_status, approver=None, company=None, **kwargs):
+        return Invoice.objects.create(company=company or self.company, organization=self.organization,
+                                      approver=approver or self.employee, status=invoice_status, **kwargs)
+
+    def test_pay_invoices(self):
+        applied = [self.create_invoice(Invoice.APPLYED, total_price=price) for price in ("10.00", "15.50")]
+        cost = self.create_invoice(Invoice.APPLYED, type=Invoice.COST, total_price="7.00")
+        on_review = self.create_invoice(Invoice.ON_REVIEW)
+        paid = self.create_invoice(Invoice.PAID, paid_at=timezone.now(), total_price="4.50")
+        rebuild_daily_totals()
+        foreign = self.create_invoice(Invoice.APPLYED, company=Company.objects.create(name="other"))
+        updated_at = applied[0].updated_at
+        ids = [invoice.id for invoice in applied + [cost, on_review, paid, foreign]] + [100500, applied[0].id]
+
+        response = self.client.post(self.url, {"ids": ids, "status": Invoice.PAID}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["changed"], 3)
+        # результат по каждому id в порядке запроса, повторы схлопываются
+        self.assertEqual(response.data["results"], [
+            {"id": applied[0].id, "status": Invoice.PAID},
+            {"id": applied[1].id, "status": Invoice.PAID},
+            {"id": cost.id, "status": Invoice.PAID},
+            {"id": on_review.id, "message": f'Статус не может быть обновлен на {Invoice.PAID}'},
+            {"id": paid.id, "message": f'Статус не может быть обновлен на {Invoice.PAID}'},
+            {"id": foreign.id, "message": "Счет не найден"},
+            {"id": 100500, "message": "Счет не найден"},
+        ])
+
+        invoice = Invoice.objects.get(id=applied[0].id)
+        self.assertEqual(invoice.status, Invoice.PAID)
+        self.assertIsNotNone(invoice.paid_at)
+        self.assertGreater(invoice.updated_at, updated_at)
+        self.assertEqual(Invoice.objects.get(id=foreign.id).status, Invoice.APPLYED)
+
+        # сводка совпадает с пересчитанной по таблице счетов
+        totals = list(DailyInvoiceTotal.objects.values('income_price', 'income_count', 'costs_price', 'costs_count'))
+        self.assertEqual(totals, [{'income_price': decimal.Decimal("30.00"), 'income_count': 3,
+                                   'costs_price': decimal.Decimal("7.00"), 'costs_count': 1}])
+        rebuild_daily_totals()
+        self.assertEqual(list(DailyInvoiceTotal.objects.values('income_price', 'income_count',
+                                                               'costs_price', 'costs_count')), totals)
+
+    def test_same_rules_as_single_change(self):
+        invoices = [self.create_invoice(invoice_status, approver=approver)
+                    for invoice_status in (Invoice.ON_REVIEW, Invoice.APPLYED, Invoice.PAID, Invoice.CANCELED)
+                    for approver in (self.employee, self.colleague)]
+        for new_status in (Invoice.APPLYED, Invoice.CANCELED, Invoice.PAID, Invoice.ON_REVIEW):
+            expected = []
+            for invoice in invoices:
+                response = self.client.post(reverse('invoice-status', args=[invoice.id]),
+                                            {"status": new_status}, format='json')
+                expected.append({"id": invoice.id, "status": new_status} if response.status_code == 200
+                                else {"id": invoice.id, "message": response.data["message"]})
+                # возвращаем исходный статус, чтобы проверить то же самое массово
+                Invoice.objects.filter(id=invoice.id).update(status=invoice.status, paid_at=None)
+
+            response = self.client.post(self.url, {"ids": [invoice.id for invoice in invoices],
+                                                   "status": new_status}, format='json')
+            self.assertEqual(response.data["results"], expected, new_status)
+            self.assertEqual(response.data["changed"], len([result for result in expected if "status" in result]))
+            for invoice in invoices:
+                Invoice.objects.filter(id=invoice.id).update(status=invoice.status, paid_at=None)
+
+    def test_one_update_per_status(self):
+        invoices = [self.create_invoice(invoice_status)
+                    for invoice_status in (Invoice.ON_REVIEW, Invoice.APPLYED) for _ in range(5)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.url, {"ids": [invoice.id for invoice in invoices],
+                                                   "status": Invoice.CANCELED}, format='json')
+        self.assertEqual(response.data["changed"], 10)
+        updates = [query["sql"] for query in context.captured_queries
+                   if query["sql"].startswith('UPDATE "bill_invoice"')]
+        self.assertEqual(len(updates), 2)
+        self.assertFalse(Invoice.objects.exclude(status=Invoice.CANCELED).exists())
+
+    def test_invalid_request(self):
+        for data in ({"ids": [], "status": Invoice.PAID}, {"ids": [1], "status": "unknown"},
+                     {"ids": "1", "status": Invoice.PAID}, {"status": Invoice.PAID},
+                     {"ids": list(range(MAX_BULK_INVOICES + 1)), "status": Invoice.PAID}):
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+
+
+class InvoicePartitionTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        generate_tenants(tenants=1, employees=2, organizations=3, products=3, categories=1,
+                         invoices=40, items=2, days=120, password='benchmark')
+        cls.company = Company.objects.get()
+        cls.token = Token.objects.create(user=User.objects.get(is_staff=True))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_month_helpers(self):
+        self.assertEqual(partitions.add_months(datetime.date(2022, 11, 1), 3), datetime.date(2023, 2, 1))
+        self.assertEqual(partitions.add_months(datetime.date(2023, 1, 1), -1), datetime.date(2022, 12, 1))
+        start, end = partitions.month_bounds(datetime.date(2022, 12, 1))
+        self.assertEqual(start, datetime.datetime(2022, 12, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(end, datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc))
+
+        name = partitions.partition_name('bill_invoice', datetime.date(2022, 12, 1))
+        self.assertEqual(name, 'bill_invoice_p2022_12')
+        self.assertEqual(partitions.partition_month(name), datetime.date(2022, 12, 1))
+        self.assertIsNone(partitions.partition_month(partitions.default_partition_name('bill_invoice')))
+
+    def test_save_copies_invoice_created_at(self):
+        invoice = Invoice.objects.first()
+        product = Product.objects.first()
+        # счет передан объектом, только INSERT позиции
+        with self.assertNumQueries(1):
+            item = PaymentItem.objects.create(invoice=invoice, product=product, price="10.00", amount=1)
+        self.assertEqual(item.invoice_created_at, invoice.created_at)
+        # по id дата создания читается одним запросом без загрузки счета
+        with self.assertNumQueries(2):
+            item = PaymentItem.objects.create(invoice_id=invoice.id, product=product, price="10.00", amount=1)
+        self.assertEqual(item.invoice_created_at, invoice.created_at)
+
+    def test_filter_by_created(self):
+        since = timezone.now() - datetime.timedelta(days=30)
+        response = self.client.get(reverse('invoices-list'), {"created_after": since.date(), "page_size": 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = Invoice.objects.filter(created_at__date__gte=since.date()).count()
+        self.assertEqual(len(response.data["results"]), expected)
+
+    def test_command_requires_postgresql(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('проверяется на других базах данных')
+        with self.assertRaises(CommandError):
+            call_command('invoice_partitions', 'status')
+        with self.assertRaises(NotSupportedError):
+            partitions.create_partitions(connection, datetime.date.today())
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'секционирование есть только в PostgreSQL')
+    def test_convert_to_partitioned(self):
+        invoices = Invoice.objects.count()
+        items = PaymentItem.objects.count()
+        call_command('invoice_partitions', 'convert', stdout=StringIO())
+        self.assertTrue(partitions.is_partitioned(connection))
+        self.assertTrue(partitions.is_partitioned(connection, 'bill_paymentitem'))
+        self.assertEqual(Invoice.objects.count(), invoices)
+        self.assertEqual(PaymentItem.objects.count(), items)
+
+        # ORM и API работают с секционированными таблицами как раньше
+        product = Product.objects.filter(company=self.company).first()
+        response = self.client.post(reverse('invoices-list'), {
+            "type": "Поступление", "approver": Employee.objects.filter(company=self.company).first().id,
+            "organization": Organization.objects.filter(company=self.company).first().id,
+            "payment_items": [{"product_id": product.id, "amount": 2, "price": "10.00"}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(response.data["id"], Invoice.objects.exclude(id=response.data["id"])
+                           .order_by('-id').values_list('id', flat=True).first())
+        response = self.client.get(reverse('invoices-detail', args=[response.data["id"]]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["payment_items"]), 1)
+
+        # запрос с границей по дате создания читает только нужные секции
+        this_month = partitions.month_start(timezone.now())
+        since = partitions.month_bounds(this_month)[0]
+        plan = Invoice.objects.filter(created_at__gte=since).explain()
+        self.assertIn(partitions.partition_name('bill_invoice', this_month), plan)
+        self.assertNotIn(partitions.partition_name('bill_invoice', partitions.add_months(this_month, -2)), plan)
+
+        # старые месяцы уходят в архив вместе с позициями
+        archived = partitions.archive_partitions(connection, this_month)
+        self.assertIn(partitions.partition_name('bill_paymentitem', partitions.add_months(this_month, -1)),
+                      archived)
+        self.assertFalse(Invoice.objects.filter(created_at__lt=since).exists())
+        self.assertFalse(PaymentItem.objects.filter(invoice_created_at__lt=since).exists())
+
+        created = partitions.create_partitions(connection, partitions.add_months(this_month, 6))
+        self.assertIn(partitions.partition_name('bill_invoice', partitions.add_months(this_month, 6)), created)
+
+
+def organization_data(number):
+    return {"name": f"organization {number}", "taxes_number": "taxes_number", "address": "address",
+            "phone_number": "+375291234567", "email": "email@mail.com", "description": "description",
+            "bank_detail": {"name": "bank", "address": "address", "bank_number": "number",
+                            "settlement_account": "account"}}
+
+
+def invoice_data(rows):
+    return {"type": "Поступление", "approver": rows.employee.id, "organization": rows.organization.id,
+            "payment_items": [{"product_id": product.id, "amount": 2, "price": "10.00"}
+                              for product in rows.products]}
+
+
+class InvoiceQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    urlconf = 'bill.urls'
+    budgets = [
+        QueryBudget('GET', 'invoices/', 4),
+        QueryBudget('GET', 'invoices/', 4, query=lambda rows: {"search": "organization"}),
+        QueryBudget('POST', 'invoices/', 9, data=invoice_data),
+        QueryBudget('POST', 'invoices/bulk', 8, data=lambda rows: [invoice_data(rows)] * len(rows.products)),
+        QueryBudget('GET', 'invoices/<int:pk>', 4, kwargs=lambda rows: {"pk": rows.invoice.id}),
+        QueryBudget('POST', 'invoices/<int:pk>/change-status', 6, kwargs=lambda rows: {"pk": rows.invoice.id},
+                    data=lambda rows: {"status": "Выставлен"}),
+        QueryBudget('POST', 'invoices/change-status', 7,
+                    data=lambda rows: {"ids": rows.applied, "status": "Оплачен"}),
+        QueryBudget('GET', 'invoices/invoices-report', 2),
+        QueryBudget('GET', 'invoices/daily_stats', 2),
+        QueryBudget('GET', 'invoices/stats', 2),
+        QueryBudget('GET', 'invoices/analytics', 2,
+                    query=lambda rows: {"date_from": "2000-01-01", "date_to": "2100-01-01", "granularity": "day"}),
+        QueryBudget('POST', 'invoices/send-customer-invoices', 6),
+        QueryBudget('POST', 'invoices/send-customer-invoices', 6, data=lambda rows: {"ids": rows.applied}),
+        QueryBudget('POST', 'invoices/<int:pk>/send-customer-invoice', 6,
+                    kwargs=lambda rows: {"pk": rows.applied[0]}),
+        QueryBudget('GET', 'invoices/review', 5),
+        QueryBudget('GET', 'async/invoices/', 3),
+        QueryBudget('GET', 'async/invoices/<int:pk>', 3, kwargs=lambda rows: {"pk": rows.invoice.id}),
+        QueryBudget('GET', 'async/invoices/review', 3),
+        QueryBudget('GET', 'async/invoices/daily_stats', 2),
+        QueryBudget('GET', 'async/invoices/stats', 2),
+        QueryBudget('GET', 'organizations/', 3),
+        QueryBudget('POST', 'organizations/', 5, data=lambda rows: organization_data(0)),
+        QueryBudget('GET', 'organizations/<int:pk>', 3, kwargs=lambda rows: {"pk": rows.organization.id}),
+        QueryBudget('PUT', 'organizations/<int:pk>', 7, kwargs=lambda rows: {"pk": rows.organization.id},
+                    data=lambda rows: organization_data(1)),
+        QueryBudget('DELETE', 'organizations/<int:pk>', 9, kwargs=lambda rows: {"pk": rows.organization.id}),
+    ]
+
+    def create_rows(self, count):
+        # по count организаций, продуктов и счетов в каждом статусе; счет rows.invoice
+        # на проверке и в нем count позиций
+        rows = SimpleNamespace()
+        rows.employee = self.employee
+        category = Category.objects.create(name="category")
+        rows.products = Product.objects.bulk_create(
+            Product(name=f"product {i}", description="description", category=category, producer="producer",
+                    company=self.company) for i in range(count))
+        banks = BankDetails.objects.bulk_create(
+            BankDetails(name="bank", address="address", bank_number="number", settlement_account="account")
+            for _ in range(count))
+        organizations = Organization.objects.bulk_create(
+            Organization(company=self.company, name=f"organization {i}", taxes_number="taxes_number",
+                         address="address", phone_number="+376291234567", email="email@mail.com",
+                         description="description", bank_detail=bank)
+            for i, bank in enumerate(banks))
+        rows.organization = organizations[0]
+
+        paid_at = timezone.now()
+        invoices = Invoice.objects.bulk_create(
+            Invoice(type=Invoice.INCOME, status=invoice_status, organization=organization,
+                    approver=self.employee, company=self.company, total_price="20.00",
+                    paid_at=paid_at if invoice_status == Invoice.PAID else None)
+            for invoice_status in (Invoice.ON_REVIEW, Invoice.APPLYED, Invoice.PAID)
+            for organization in organizations)
+        PaymentItem.objects.bulk_create(
+            PaymentItem(invoice=invoice, product=rows.products[i % count], price="10.00", amount=2)
+            for i, invoice in enumerate(invoices))
+        rows.invoice = invoices[0]
+        PaymentItem.objects.bulk_create(PaymentItem(invoice=rows.invoice, product=product, price="10.00", amount=2)
+                                        for product in rows.products[1:])
+        rows.applied = [invoice.id for invoice in invoices if invoice.status == Invoice.APPLYED]
+        rebuild_daily_totals([self.company.id])
+        return rows
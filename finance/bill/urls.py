@@ -1,13 +1,17 @@
 from django.urls import path, include
 from rest_framework import routers
 
+from bill import async_views
 from bill.views import InvoiceViewSet, OrganizationViewSet
 
 
 urlpatterns = [
     path('invoices/', InvoiceViewSet.as_view({'get': 'list', 'post': 'create'}), name="invoices-list"),
+    path('invoices/bulk', InvoiceViewSet.as_view({'post': 'bulk_create_invoices'}), name="invoices-bulk"),
     path('invoices/<int:pk>', InvoiceViewSet.as_view({'get': 'retrieve'}), name="invoice-detail"),
 
+    path('invoices/change-status', InvoiceViewSet.as_view({'post': 'bulk_change_invoice_status'}),
+         name="invoices-bulk-status"),
     path('invoices/<int:pk>/change-status', InvoiceViewSet.as_view({'post': 'change_invoice_status'}), name="invoice-status"),
     path('invoices/invoices-report',
          InvoiceViewSet.as_view({'get': 'get_invoice_report'}), name="invoice-report"),
@@ -15,10 +19,22 @@ urlpatterns = [
          InvoiceViewSet.as_view({'get': 'daily_statistic'}), name="daily-stats"),
     path('invoices/stats',
          InvoiceViewSet.as_view({'get': 'stats_invoices'}), name="stats"),
+    path('invoices/analytics',
+         InvoiceViewSet.as_view({'get': 'invoice_analytics'}), name="invoice-analytics"),
+    path('invoices/send-customer-invoices',
+         InvoiceViewSet.as_view({'post': 'send_customer_invoices'}), name="invoices-sending"),
     path('invoices/<int:pk>/send-customer-invoice',
          InvoiceViewSet.as_view({'post': 'send_customer_invoice'}), name="invoice-sending"),
 
-    path('invoices/review', InvoiceViewSet.as_view({'get': 'review_invoices'})),
+    path('invoices/review', InvoiceViewSet.as_view({'get': 'review_invoices'}), name="invoices-review"),
+
+    # async variants of the read endpoints above, for ASGI serving
+    path('async/invoices/', async_views.invoice_list_view, name="async-invoices-list"),
+    path('async/invoices/<int:pk>', async_views.invoice_detail_view, name="async-invoice-detail"),
+    path('async/invoices/review', async_views.review_invoices_view, name="async-invoices-review"),
+    path('async/invoices/daily_stats', async_views.daily_statistic_view, name="async-daily-stats"),
+    path('async/invoices/stats', async_views.stats_invoices_view, name="async-stats"),
+
     path('organizations/', OrganizationViewSet.as_view({'post': 'create', 'get': 'list'})),
     path('organizations/<int:pk>', OrganizationViewSet.as_view({'delete': 'destroy', 'put': 'update', 'get': 'retrieve'}))
 ]
@@ -1,10 +1,10 @@
 import datetime
 from itertools import chain
 
-from django.db.models import Sum, Count
-from django.db.models.functions import TruncMonth, TruncYear
+from django.db.models import Prefetch
 from django.db.transaction import atomic
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters import rest_framework as filters
 from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
@@ -12,21 +12,40 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from bill.csv_stream import CSVStream
-from bill.models import Invoice, Organization
-from bill.serializers import InvoiceSerializer, OrganizationSerializer, ReviewInvoiceSerializer
-from bill.services.emailing import send_customer_invoice
+from bill.models import Invoice, Organization, PaymentItem
+from bill.serializers import InvoiceSerializer, OrganizationSerializer, ReviewInvoiceSerializer, \
+    InvoiceAnalyticsSerializer, BulkInvoiceStatusSerializer
+from bill.services.emailing import send_customer_invoice, send_customer_invoices
+from bill.services.invoices import MAX_BULK_INVOICES, resolve_bulk_invoices, bulk_save_invoices, \
+    get_transition_error, bulk_change_status
+from bill.services.statistics import get_paid_day, sync_daily_totals, get_daily_statistic, \
+    get_monthly_statistic, get_invoice_analytics
+from finance.conditional import ConditionalGetMixin
+from finance.eager_loading import EagerLoadingMixin
+from finance.lean import LeanListMixin
+from finance.pagination import TenantCursorPagination
+from finance.replicas import ReadReplicaMixin
+from finance.sparse_fields import SparseFieldsMixin
+from goods.models import Product
 from staff.models import Employee
 
 
 class InvoiceFilter(filters.FilterSet):
     paid_at = filters.DateFromToRangeFilter()
+    # created_after / created_before, on partitioned tables only these months are read
+    created = filters.DateFromToRangeFilter(field_name='created_at')
 
     class Meta:
         model = Invoice
         fields = ['paid_at', 'status', 'created_at', 'type']
 
 
-class InvoiceViewSet(mixins.CreateModelMixin,
+class InvoiceViewSet(ReadReplicaMixin,
+                     ConditionalGetMixin,
+                     SparseFieldsMixin,
+                     LeanListMixin,
+                     EagerLoadingMixin,
+                     mixins.CreateModelMixin,
                      mixins.ListModelMixin,
                      mixins.RetrieveModelMixin,
                      viewsets.GenericViewSet):
@@ -34,14 +53,32 @@ class InvoiceViewSet(mixins.CreateModelMixin,
     serializer_class = InvoiceSerializer
     filterset_class = InvoiceFilter
     search_fields = ["organization__name"]
-    ordering = ['-created_at']
+    search_vector_fields = ["organization__name", "organization__address", "organization__description"]
+    search_trigram_fields = ["organization__name"]
+    ordering = ['-created_at', 'id']
+    ordering_fields = ['created_at', 'id']
+    pagination_class = TenantCursorPagination
+    eager_loading_actions = ('list', 'retrieve', 'review_invoices', 'send_customer_invoice')
+    read_replica_actions = ('list', 'retrieve', 'get_invoice_report', 'daily_statistic', 'stats_invoices',
+                            'invoice_analytics')
+    lean_list = True
 
     def get_queryset(self):
-        return super().get_queryset().filter(company=self.request.user.employee.company)
+        return self.request.tenant.filter(super().get_queryset())
+
+    def get_conditional_dependencies(self):
+        # checked for the whole company: the tables are small, while joining
+        # them to every invoice of the list is not cheap
+        tenant = self.request.tenant
+        return [(tenant.filter(Organization.objects.all()), ('updated_at',)),
+                (tenant.filter(Employee.objects.all()), ('updated_at', 'company__updated_at')),
+                (tenant.filter(Product.objects.all()), ('updated_at', 'category__updated_at'))]
 
     def create(self, request, *args, **kwargs):
-        organization = get_object_or_404(Organization, id=request.data.get('organization'))
-        approver = get_object_or_404(Employee, id=request.data.get('approver'))
+        organization = get_object_or_404(Organization.objects.select_related('bank_detail'),
+                                         id=request.data.get('organization'))
+        approver = get_object_or_404(Employee.objects.select_related('user', 'company__bank_detail'),
+                                     id=request.data.get('approver'))
 
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -50,6 +87,45 @@ class InvoiceViewSet(mixins.CreateModelMixin,
 
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @action(detail=False, methods=['post'])
+    def bulk_create_invoices(self, request, pk=None):
+        payloads = request.data
+        if not isinstance(payloads, list) or not payloads:
+            raise ValidationError({"message": "Ожидается список счетов"})
+        if len(payloads) > MAX_BULK_INVOICES:
+            raise ValidationError({"message": f"Можно создать не более {MAX_BULK_INVOICES} счетов за раз"})
+        partial = request.query_params.get('partial', '').lower() in ('1', 'true')
+
+        results = [{"index": index} for index in range(len(payloads))]
+        valid = []
+        for index, payload in enumerate(payloads):
+            serializer = self.get_serializer(data=payload)
+            if serializer.is_valid():
+                valid.append((index, payload, serializer.validated_data))
+            else:
+                results[index]["errors"] = serializer.errors
+
+        resolved, products = resolve_bulk_invoices(request.tenant.company,
+                                                   [(payload, data) for _, payload, data in valid])
+        to_create = []
+        for (index, _, _), (invoice_kwargs, errors) in zip(valid, resolved):
+            if errors is not None:
+                results[index]["errors"] = errors
+            else:
+                to_create.append((index, invoice_kwargs))
+
+        has_errors = len(to_create) != len(payloads)
+        if has_errors and not partial:
+            return Response({"created": 0, "results": results}, status=status.HTTP_400_BAD_REQUEST)
+
+        invoices = bulk_save_invoices(request.tenant.company,
+                                      [invoice_kwargs for _, invoice_kwargs in to_create], products)
+        for (index, _), invoice in zip(to_create, invoices):
+            results[index]["id"] = invoice.id
+
+        return Response({"created": len(invoices), "results": results},
+                        status=status.HTTP_207_MULTI_STATUS if has_errors else status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
     @atomic
     def change_invoice_status(self, request, pk=None):
@@ -57,40 +133,34 @@ class InvoiceViewSet(mixins.CreateModelMixin,
         serializer = ReviewInvoiceSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         invoice_status = serializer.validated_data.get('status')
+        previous_status = invoice.status
 
-        if invoice.status == invoice.ON_REVIEW:
-            if not request.user.employee == invoice.approver:
-                raise ValidationError({"message": 'Только начальник может подтвердить или отменить заказ'})
-            if invoice_status in (Invoice.CANCELED, Invoice.APPLYED):
-                invoice.status = invoice_status
-                invoice.save()
-            else:
-                raise ValidationError(
-                    {"message": f'Статус не может быть обновлен на {invoice_status}'})
-
-        elif invoice.status == invoice.APPLYED:
-            if invoice_status in (Invoice.PAID, Invoice.CANCELED):
-                if invoice_status == Invoice.PAID:
-                    invoice.paid_at = datetime.datetime.now()
-                invoice.status = invoice_status
-                invoice.save()
-            else:
-                raise ValidationError(
-                    {"message": f'Статус не может быть обновлен на {invoice_status}'})
-
-        else:
-            raise ValidationError(
-                {"message": f'Статус не может быть обновлен на {invoice_status}'})
+        error = get_transition_error(invoice.status, invoice_status, request.tenant.employee == invoice.approver)
+        if error is not None:
+            raise ValidationError({"message": error})
+        if invoice_status == Invoice.PAID:
+            invoice.paid_at = timezone.now()
+        invoice.status = invoice_status
+        invoice.save()
 
+        sync_daily_totals(invoice, previous_status)
         return Response({'status': f'Статус счета был изменен на {invoice.status}'})
 
+    @action(detail=False, methods=['post'])
+    def bulk_change_invoice_status(self, request, pk=None):
+        serializer = BulkInvoiceStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        changed, results = bulk_change_status(self.get_queryset(), request.tenant.employee,
+                                              serializer.validated_data['ids'],
+                                              serializer.validated_data['status'])
+        return Response({"changed": changed, "results": results})
+
     @action(detail=False, methods=['get'])
-    @atomic
     def get_invoice_report(self, request, pk=None):
+        # Rows are read lazily while the response is streamed, i.e. after the
+        # view has returned, so the report is not wrapped into a transaction.
         invoices = self.filter_queryset(self.get_queryset())\
-            .select_related('approver', 'organization')\
             .filter(status=Invoice.PAID)\
-            .filter(company=request.user.employee.company)\
             .values_list('id', 'created_at', 'pay_to', 'paid_at', 'total_price',
                                                 'organization__name', 'approver__position',
                                                 'approver__user__email')
@@ -108,71 +178,114 @@ class InvoiceViewSet(mixins.CreateModelMixin,
     @action(detail=False, methods=['get'])
     @atomic
     def review_invoices(self, request, pk=None):
-        q = self.get_queryset().filter(approver=request.user.employee, status=Invoice.ON_REVIEW)
+        q = self.get_queryset().filter(approver=request.tenant.employee, status=Invoice.ON_REVIEW)
         serializer = self.get_serializer(q, many=True)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
-    @atomic
     def daily_statistic(self, request, pk=None):
-        now = datetime.date.today()
-        q = self.get_queryset().filter(paid_at__year=now.year,
-                                       paid_at__month=now.month,
-                                       paid_at__day=now.day)
-        costs = q.filter(status=Invoice.PAID, type=Invoice.COST)
-        costs_price = costs.aggregate(costs=Sum('total_price'))
-        amount_of_costs = costs.count()
-
-        income = q.filter(status=Invoice.PAID, type=Invoice.INCOME)
-        current_amount_paid_of_invoices = income.count()
-        price = income.aggregate(income=Sum('total_price'))
-        return Response({'income': {'price': price['income'], 'amount': current_amount_paid_of_invoices},
-                         'costs': {'price': costs_price['costs'], 'amount': amount_of_costs}})
+        today = get_paid_day(timezone.now())
+        return Response(get_daily_statistic(request.tenant.company, today))
 
     @action(detail=True, methods=['post'])
     @atomic
     def send_customer_invoice(self, request, pk=None):
-        bank_details = request.user.employee.company.bank_detail
+        bank_details = request.tenant.company.bank_detail
         invoice = self.get_object()
         if bank_details is None:
             raise ValidationError({"message": "Заполните данные о компании!"})
 
         if invoice.type != Invoice.INCOME or invoice.status != Invoice.APPLYED:
             raise ValidationError({"message": "Неверный статус или тип!"})
-        send_customer_invoice(request.user.employee.company, invoice)
+        send_customer_invoice(request.tenant.company, invoice)
         return Response({'message': 'Email был отправлен!'})
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['post'])
     @atomic
+    def send_customer_invoices(self, request, pk=None):
+        company = request.tenant.company
+        if company.bank_detail is None:
+            raise ValidationError({"message": "Заполните данные о компании!"})
+
+        data = request.data if isinstance(request.data, dict) else {}
+        ids = data.get('ids')
+        after = data.get('after')
+        if after is not None and (not isinstance(after, int) or ids is not None):
+            raise ValidationError({"after": "Ожидается id последнего отправленного счета, без списка ids"})
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(invoice_id, int) for invoice_id in ids):
+                raise ValidationError({"ids": "Ожидается список id счетов"})
+            if len(ids) > MAX_BULK_INVOICES:
+                raise ValidationError({"ids": f"Можно отправить не более {MAX_BULK_INVOICES} счетов за раз"})
+            invoices = self.get_queryset().filter(id__in=ids)
+        else:
+            # sending changes nothing in the invoices: the next batch is
+            # asked for with the `after` the response hands back
+            invoices = self.filter_queryset(self.get_queryset())\
+                .filter(type=Invoice.INCOME, status=Invoice.APPLYED).order_by('id')
+            if after is not None:
+                invoices = invoices.filter(id__gt=after)
+        invoices = invoices.select_related('organization')\
+            .prefetch_related(Prefetch('payment_items', queryset=PaymentItem.objects.select_related('product')))
+        has_more = False
+        if ids is None:
+            invoices = list(invoices[:MAX_BULK_INVOICES + 1])
+            has_more = len(invoices) > MAX_BULK_INVOICES
+            invoices = invoices[:MAX_BULK_INVOICES]
+            ids = [invoice.id for invoice in invoices]
+            after = ids[-1] if has_more else None
+
+        found = {invoice.id: invoice for invoice in invoices}
+        results = {invoice_id: {"id": invoice_id} for invoice_id in ids}
+        to_send = []
+        for invoice_id in results:
+            invoice = found.get(invoice_id)
+            if invoice is None:
+                results[invoice_id]["message"] = "Счет не найден"
+            elif invoice.type != Invoice.INCOME or invoice.status != Invoice.APPLYED:
+                results[invoice_id]["message"] = "Неверный статус или тип!"
+            else:
+                to_send.append(invoice)
+
+        emails = send_customer_invoices(company, to_send)
+        for invoice, email in zip(to_send, emails):
+            results[invoice.id].update({"email_id": email.id, "message": "Email был отправлен!"})
+
+        return Response({"sent": len(emails), "has_more": has_more, "after": after,
+                         "results": list(results.values())})
+
+    @action(detail=False, methods=['get'])
     def stats_invoices(self, request, pk=None):
-        date_from = datetime.datetime.now() - datetime.timedelta(days=365)
-
-        income_data = self.get_queryset().filter(type=Invoice.INCOME, status=Invoice.PAID)\
-            .filter(paid_at__gte=date_from)\
-            .annotate(month=TruncMonth("paid_at")) \
-            .values("month", year=TruncYear("month"))\
-            .annotate(total_price=Sum("total_price"))
-        costs_data = self.get_queryset().filter(type=Invoice.COST, status=Invoice.PAID)\
-            .filter(paid_at__gte=date_from)\
-            .annotate(month=TruncMonth("paid_at")) \
-            .values("month", year=TruncYear("month"))\
-            .annotate(total_price=Sum("total_price"))
-
-        income_count_data = self.get_queryset().filter(type=Invoice.INCOME, status=Invoice.PAID)\
-            .filter(paid_at__gte=date_from)\
-            .annotate(month=TruncMonth("paid_at")) \
-            .values("month", year=TruncYear("month"))\
-            .annotate(counts=Count("total_price"))
-
-        return Response({"income_data": income_data,
-                         "costs_data": costs_data,
-                         "income_count_data": income_count_data})
-
-
-class OrganizationViewSet(viewsets.ModelViewSet):
+        today = get_paid_day(timezone.now())
+        date_from = today - datetime.timedelta(days=365)
+        return Response(get_monthly_statistic(request.tenant.company, date_from, today))
+
+    @action(detail=False, methods=['get'])
+    def invoice_analytics(self, request, pk=None):
+        serializer = InvoiceAnalyticsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        results = get_invoice_analytics(request.tenant.company,
+                                        serializer.validated_data['date_from'],
+                                        serializer.validated_data['date_to'],
+                                        serializer.validated_data['granularity'],
+                                        serializer.validated_data['timezone'])
+        return Response({'granularity': serializer.validated_data['granularity'],
+                         'timezone': str(serializer.validated_data['timezone']),
+                         'results': results})
+
+
+class OrganizationViewSet(ReadReplicaMixin, ConditionalGetMixin, SparseFieldsMixin, LeanListMixin, EagerLoadingMixin,
+                          viewsets.ModelViewSet):
     queryset = Organization.objects.all()
     serializer_class = OrganizationSerializer
     search_fields = ["name", "address"]
+    search_vector_fields = ["name", "address", "description"]
+    search_trigram_fields = ["name"]
+    ordering = ['id']
+    ordering_fields = ['id', 'name']
+    pagination_class = TenantCursorPagination
+    read_replica_actions = ('list', 'retrieve')
+    lean_list = True
 
     def get_queryset(self):
-        return super().get_queryset().filter(company=self.request.user.employee.company)
+        return self.request.tenant.filter(super().get_queryset())
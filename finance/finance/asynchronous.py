@@ -0,0 +1,180 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Prefetch
+from django.http import HttpResponseNotAllowed
+
+
+def can_run_concurrently(using=DEFAULT_DB_ALIAS):
+    """Queries of one request run in parallel threads only on PostgreSQL,
+    when settings.ASYNC_CONCURRENT_QUERIES is on and the request's connection
+    is not in a transaction, whose uncommitted rows other connections can't
+    see. Call it in the thread of the request's queries. Every thread uses
+    its own connection, so it should come from the pool (or CONN_MAX_AGE > 0)."""
+    connection = connections[using]
+    return getattr(settings, 'ASYNC_CONCURRENT_QUERIES', False) \
+        and connection.vendor == 'postgresql' and not connection.in_atomic_block
+
+
+_slots = {}
+_slots_lock = threading.Lock()
+
+
+def _offload_slots(using):
+    """Process-wide limit of queries running on extra connections: by
+    default half of the pool, the rest stays for the requests' own
+    connections."""
+    size = getattr(settings, 'ASYNC_MAX_OFFLOADED_QUERIES', None)
+    if size is None:
+        size = max(settings.DATABASES[using].get('POOL', {}).get('MAX_SIZE', 8) // 2, 1)
+    with _slots_lock:
+        if (using, size) not in _slots:
+            _slots[using, size] = threading.BoundedSemaphore(size)
+        return _slots[using, size]
+
+
+def _offloaded(function, slots):
+    def run():
+        try:
+            return function()
+        finally:
+            # returns the worker thread's connection to the pool
+            for connection in connections.all(initialized_only=True):
+                connection.close_if_unusable_or_obsolete()
+            slots.release()
+    return run
+
+
+async def gather_queries(*functions, using=DEFAULT_DB_ALIAS):
+    """Runs independent synchronous ORM calls and returns their results in
+    order. The first one runs in the request's thread; when the database
+    allows it (see can_run_concurrently) the others run at the same time on
+    connections of their own, as long as there are free slots (see
+    _offload_slots). A request never waits for a slot: whatever doesn't get
+    one runs in its thread after the first call.
+
+    Concurrent queries do not share a transaction, each sees the data
+    committed when it starts."""
+    offloaded = {}
+    if len(functions) > 1 and await sync_to_async(can_run_concurrently)(using):
+        slots = _offload_slots(using)
+        for index, function in enumerate(functions[1:], 1):
+            if not slots.acquire(blocking=False):
+                break
+            offloaded[index] = asyncio.ensure_future(
+                sync_to_async(_offloaded(function, slots), thread_sensitive=False)())
+
+    results = [None] * len(functions)
+    try:
+        for index, function in enumerate(functions):
+            if index not in offloaded:
+                results[index] = await sync_to_async(function)()
+    finally:
+        # offloaded calls are awaited even when an inline one failed
+        done = await asyncio.gather(*offloaded.values(), return_exceptions=True)
+    for index, result in zip(offloaded, done):
+        if isinstance(result, BaseException):
+            raise result
+        results[index] = result
+    return results
+
+
+def _split_prefetches(queryset):
+    """Turns the top level reverse foreign key prefetches of the queryset
+    into querysets that do not depend on its result."""
+    model = queryset.model
+    base = queryset.prefetch_related(None)
+    related, remaining = [], []
+    for lookup in queryset._prefetch_related_lookups:
+        prefetch = lookup if isinstance(lookup, Prefetch) else Prefetch(lookup)
+        field = model._meta.get_field(prefetch.prefetch_through) \
+            if '__' not in prefetch.prefetch_through else None
+        if field is None or not field.one_to_many or prefetch.to_attr:
+            remaining.append(lookup)
+            continue
+        related_queryset = prefetch.queryset if prefetch.queryset is not None \
+            else field.related_model._default_manager.all()
+        related_queryset = related_queryset.filter(**{f'{field.field.name}__in': base.values('pk')})
+        related.append((field, related_queryset))
+    if remaining:
+        base = base.prefetch_related(*remaining)
+    return base, related
+
+
+def _attach_related(objects, field, related_objects):
+    by_owner = defaultdict(list)
+    for related_object in related_objects:
+        by_owner[getattr(related_object, field.field.attname)].append(related_object)
+    cache_name = field.get_cache_name()
+    for obj in objects:
+        values = by_owner.get(obj.pk, [])
+        for value in values:
+            field.field.set_cached_value(value, obj)
+        queryset = getattr(obj, field.get_accessor_name()).get_queryset()
+        queryset._result_cache = values
+        queryset._prefetch_done = True
+        if not hasattr(obj, '_prefetched_objects_cache'):
+            obj._prefetched_objects_cache = {}
+        obj._prefetched_objects_cache[cache_name] = queryset
+
+
+async def afetch(queryset):
+    """Evaluates the queryset and its reverse foreign key prefetches at the
+    same time: each prefetch filters on a subquery of the queryset instead of
+    waiting for its primary keys. Other prefetches run after the main query
+    as usual."""
+    base, related = _split_prefetches(queryset)
+    results = await gather_queries(lambda: list(base),
+                                   *(lambda related_queryset=related_queryset: list(related_queryset)
+                                     for _, related_queryset in related),
+                                   using=queryset.db)
+    objects = results[0]
+    for (field, _), related_objects in zip(related, results[1:]):
+        _attach_related(objects, field, related_objects)
+    return objects
+
+
+def async_action(viewset_class, action, handler):
+    """Async Django view serving `action` of a DRF viewset with `handler`.
+
+    Authentication, permissions, throttling, exception handling and
+    rendering are the viewset's own, run in a worker thread. The handler is
+    a coroutine `handler(viewset, request, **kwargs)` that returns a DRF
+    Response and awaits its queries. Only GET requests are served."""
+
+    def start(request, kwargs):
+        viewset = viewset_class(action_map={request.method.lower(): action}, format_kwarg=None)
+        viewset.setup(request, **kwargs)
+        viewset.headers = viewset.default_response_headers
+        viewset.request = viewset.initialize_request(request, **kwargs)
+        try:
+            viewset.initial(viewset.request, **kwargs)
+        except Exception as exc:
+            return viewset, viewset.handle_exception(exc)
+        return viewset, None
+
+    def finish(viewset, response):
+        response = viewset.finalize_response(viewset.request, response)
+        return response.render()
+
+    async def view(request, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET'])
+        viewset, response = await sync_to_async(start)(request, kwargs)
+        if response is None:
+            try:
+                response = await handler(viewset, viewset.request, **kwargs)
+            except Exception as exc:
+                response = await sync_to_async(viewset.handle_exception)(exc)
+        return await sync_to_async(finish)(viewset, response)
+
+    # like DRF views, CSRF is checked by SessionAuthentication only
+    view.csrf_exempt = True
+    # the same attribute as on viewset views, for URL introspection
+    view.actions = {'get': action}
+    view.metrics_label = f'{viewset_class.__name__}.{action}.async'
+    return view
@@ -0,0 +1,100 @@
+"""PostgreSQL backend that takes connections from a process-wide pool.
+
+Configured like django.db.backends.postgresql, plus an optional POOL dict:
+
+    'ENGINE': 'finance.backends.postgresql_pool',
+    'POOL': {'MIN_SIZE': 2, 'MAX_SIZE': 20, 'TIMEOUT': 10,
+             'MAX_LIFETIME': 1800, 'HEALTH_CHECK': True},
+
+Keep CONN_MAX_AGE at 0: Django then "closes" the connection at the end of
+every request, which returns it to the pool instead of disconnecting."""
+import threading
+
+from django.db.backends.postgresql import base, creation
+
+from finance.backends.postgresql_pool.pool import ConnectionPool
+
+POOL_DEFAULTS = {
+    'MIN_SIZE': 0,
+    'MAX_SIZE': 10,
+    'TIMEOUT': 30,
+    'MAX_LIFETIME': 3600,
+    'HEALTH_CHECK': True,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(alias, conn_params):
+    # Connections to the maintenance database, used to create and drop the
+    # test database, get their own pool.
+    return alias, repr(sorted(conn_params.items()))
+
+
+def get_pool(alias, conn_params, options):
+    key = _pool_key(alias, conn_params)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = {**POOL_DEFAULTS, **options}
+            pool = _pools[key] = ConnectionPool(min_size=options['MIN_SIZE'],
+                                                max_size=options['MAX_SIZE'],
+                                                timeout=options['TIMEOUT'],
+                                                max_lifetime=options['MAX_LIFETIME'],
+                                                health_check=options['HEALTH_CHECK'])
+        return pool
+
+
+def get_pool_stats():
+    """Counters and sizes of every pool of the process, by database alias."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    stats = {}
+    for (alias, _), pool in pools:
+        pool_stats = pool.stats()
+        if alias in stats:
+            pool_stats = {name: stats[alias][name] + value for name, value in pool_stats.items()}
+        stats[alias] = pool_stats
+    return stats
+
+
+def close_pools(alias=None):
+    """Closes and forgets the pools of a database alias, or all pools."""
+    with _pools_lock:
+        keys = [key for key in _pools if alias is None or key[0] == alias]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    # Idle pooled connections to the test database would block
+    # DROP DATABASE and CREATE DATABASE ... TEMPLATE.
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        close_pools(self.connection.alias)
+        super()._clone_test_db(suffix, verbosity, keepdb)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        return get_pool(self.alias, conn_params, self.settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        self._pool = self.get_pool(conn_params)
+        connection = self._pool.get(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self._pool.put(self.connection)
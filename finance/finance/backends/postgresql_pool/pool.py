@@ -0,0 +1,172 @@
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection became available within the pool timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of raw psycopg2 connections.
+
+    `get(connect)` hands out an idle connection or opens a new one with
+    `connect()` while fewer than `max_size` exist, otherwise it waits up to
+    `timeout` seconds. Idle connections are reused most recently returned
+    first, so surplus ones age out; a connection is checked with `SELECT 1`
+    on checkout when `health_check` is on and is closed instead of reused
+    once it is older than `max_lifetime` seconds. `min_size` connections are
+    opened with the first checkout and kept open."""
+
+    def __init__(self, min_size=0, max_size=10, timeout=30, max_lifetime=3600, health_check=True):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError('Pool sizes must satisfy 0 <= MIN_SIZE <= MAX_SIZE and MAX_SIZE >= 1.')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+
+        self._condition = threading.Condition()
+        self._idle = []
+        self._created_at = {}
+        self._size = 0
+        self._filled = False
+        self._closed = False
+        self.counters = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'created': 0,
+                         'closed': 0, 'health_check_failures': 0}
+
+    def stats(self):
+        with self._condition:
+            return {**self.counters, 'size': self._size, 'idle': len(self._idle),
+                    'in_use': self._size - len(self._idle),
+                    'min_size': self.min_size, 'max_size': self.max_size}
+
+    def get(self, connect):
+        if not self._filled:
+            self._fill(connect)
+        while True:
+            connection = self._checkout(connect)
+            if self._is_healthy(connection):
+                with self._condition:
+                    self.counters['checkouts'] += 1
+                return connection
+            self._discard(connection)
+
+    def put(self, connection):
+        """Returns a connection, rolling back any open transaction. Broken,
+        expired connections and connections of a closed pool are closed."""
+        if self._closed or connection.closed or self._is_expired(connection) or not self._reset(connection):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def close(self):
+        """Closes idle connections, connections in use are closed when returned."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._discard(connection)
+
+    def _fill(self, connect):
+        with self._condition:
+            if self._filled:
+                return
+            self._filled = True
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+        for opened in range(missing):
+            try:
+                connection = self._connect(connect)
+            except Exception:
+                # release the slots reserved for the remaining connections
+                with self._condition:
+                    self._size -= missing - opened - 1
+                    self._filled = False
+                    self._condition.notify_all()
+                raise
+            with self._condition:
+                self._idle.append(connection)
+                self._condition.notify()
+
+    def _checkout(self, connect):
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        with self._condition:
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection available within {self.timeout}s '
+                                      f'({self.max_size} in use).')
+                if not waited:
+                    waited = True
+                    self.counters['waits'] += 1
+                self._condition.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._size += 1
+        return self._connect(connect)
+
+    def _connect(self, connect):
+        try:
+            connection = connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._created_at[id(connection)] = time.monotonic()
+            self.counters['created'] += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self._created_at.pop(id(connection), None)
+            self._size -= 1
+            self.counters['closed'] += 1
+            self._condition.notify()
+
+    def _is_expired(self, connection):
+        created_at = self._created_at.get(id(connection))
+        return self.max_lifetime is not None and created_at is not None \
+            and time.monotonic() - created_at >= self.max_lifetime
+
+    def _is_healthy(self, connection):
+        if connection.closed or self._is_expired(connection):
+            return False
+        if not self.health_check:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            # without autocommit the check opened a transaction
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            with self._condition:
+                self.counters['health_check_failures'] += 1
+            return False
+        return True
+
+    @staticmethod
+    def _reset(connection):
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                return False
+        return True
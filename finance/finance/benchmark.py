@@ -0,0 +1,329 @@
+"""End-to-end HTTP load benchmark of the API.
+
+Every route of bill.urls, goods.urls and staff.urls has a scenario (or a
+documented reason in SKIPPED), see check_coverage. Scenarios act as the
+manager of a tenant made by generate_benchmark_data. Objects that requests
+delete or change irreversibly are created right before their scenario, one
+per request, so every request does the same work.
+
+The runner talks to the database of the server under test to prepare them,
+so both have to use the same settings."""
+import datetime
+import json
+import random
+from importlib import import_module
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from bill.models import Invoice, Organization
+from bill.services.benchmark_data import BENCHMARK_COMPANY, BENCHMARK_CATEGORY, BENCHMARK_DOMAIN, \
+    DEFAULT_PASSWORD
+from finance.loadgen import load
+from goods.models import Category, Product
+from staff.authentication import issue_token
+from staff.models import BankDetails, Company, Employee
+
+URLCONFS = ('bill.urls', 'goods.urls', 'staff.urls')
+API_PREFIX = '/api/'
+# how many different objects read-only scenarios cycle through
+SAMPLE_SIZE = 100
+
+SKIPPED = {
+    ('companies/<int:pk>', 'DELETE'): "удалил бы компанию, от имени которой идет нагрузка",
+    ('employees/', 'POST'): "сотрудник без пользователя не создается, сотрудников добавляет invite-staff",
+}
+
+
+class Scenario:
+    """`build(fixtures, count)` returns the (path, payload) pairs requests
+    cycle through; the path is relative to API_PREFIX."""
+
+    def __init__(self, name, method, route, build):
+        self.name = name
+        self.method = method
+        self.route = route
+        self.build = build
+
+
+class BenchmarkFixtures:
+    """Objects of the benchmark tenant that the scenarios refer to."""
+
+    def __init__(self, company=None, password=DEFAULT_PASSWORD, seed=0):
+        companies = Company.objects.select_related('bank_detail').order_by('id')
+        self.company = companies.get(id=company) if company is not None \
+            else companies.filter(name__startswith=BENCHMARK_COMPANY).first()
+        if self.company is None:
+            raise Company.DoesNotExist("Нет данных для нагрузки, запустите generate_benchmark_data")
+        self.rng = random.Random(seed)
+        self.run = timezone.now().strftime('%Y%m%d%H%M%S')
+        self.password = password
+
+        staff = list(Employee.objects.filter(company=self.company).select_related('user').order_by('id'))
+        self.manager = next(employee for employee in staff if employee.user.is_staff)
+        # another user logs in, so that rotated tokens do not log the manager out
+        self.login_user = next(employee.user for employee in staff if employee != self.manager)
+        self.token = issue_token(self.manager.user).key
+
+        invoices = Invoice.objects.filter(company=self.company)
+        self.invoices = self._sample(invoices)
+        self.sendable_invoices = self._sample(invoices.filter(type=Invoice.INCOME, status=Invoice.APPLYED))
+        self.organizations = self._sample(Organization.objects.filter(company=self.company))
+        self.products = self._sample(Product.objects.filter(company=self.company))
+        self.categories = self._sample(Category.objects.filter(name__startswith=BENCHMARK_CATEGORY))
+        self.employees = [employee.id for employee in staff
+                          if employee != self.manager and employee.user != self.login_user]
+
+    def _sample(self, queryset):
+        ids = list(queryset.order_by().values_list('id', flat=True)[:SAMPLE_SIZE * 10])
+        return self.rng.sample(ids, min(len(ids), SAMPLE_SIZE))
+
+    def email(self, kind, number):
+        return f'{kind}-{self.run}-{number}@{BENCHMARK_DOMAIN}'
+
+    def new_organizations(self, count):
+        banks = BankDetails.objects.bulk_create([BankDetails(**bank_detail_payload(number))
+                                                 for number in range(count)])
+        return [organization.id for organization in Organization.objects.bulk_create([
+            Organization(**organization_payload(number) | {'bank_detail': bank, 'company': self.company})
+            for number, bank in enumerate(banks)])]
+
+    def new_products(self, count):
+        return [product.id for product in Product.objects.bulk_create([
+            Product(name=f'Удаляемая услуга {number}', description='', producer='', company=self.company,
+                    category_id=self.categories[0] if self.categories else None)
+            for number in range(count)])]
+
+    def new_categories(self, count):
+        return [category.id for category in Category.objects.bulk_create([
+            Category(name=f'{BENCHMARK_CATEGORY} удаляемая {number}') for number in range(count)])]
+
+    def new_employees(self, count):
+        users = User.objects.bulk_create([User(username=self.email('employee', number),
+                                               email=self.email('employee', number), password='!')
+                                          for number in range(count)])
+        return [employee.id for employee in Employee.objects.bulk_create([
+            Employee(user=user, company=self.company, position='Бухгалтер') for user in users])]
+
+    def new_review_invoices(self, count):
+        return [invoice.id for invoice in Invoice.objects.bulk_create([
+            Invoice(status=Invoice.ON_REVIEW, pay_to=timezone.now() + datetime.timedelta(days=14),
+                    total_price=0, organization_id=self.organizations[0], approver=self.manager,
+                    company=self.company)
+            for _ in range(count)])]
+
+
+def bank_detail_payload(number):
+    return {'name': f'Банк {number}', 'address': 'г. Минск, ул. Банковская, 1',
+            'bank_number': f'BY{number:010d}', 'settlement_account': f'BY{number:016d}'}
+
+
+def organization_payload(number):
+    return {'name': f'ООО «Нагрузка {number}»', 'taxes_number': f'{number:09d}',
+            'address': 'г. Минск, пр. Независимости, 1', 'phone_number': '+375291234567',
+            'email': f'organization{number}@{BENCHMARK_DOMAIN}', 'description': 'Создано нагрузочным тестом'}
+
+
+def invoice_payload(fixtures, number):
+    products = fixtures.products[number % len(fixtures.products):][:3] or fixtures.products[:1]
+    return {'type': Invoice.INCOME,
+            'pay_to': (timezone.now() + datetime.timedelta(days=14)).isoformat(),
+            'organization': fixtures.organizations[number % len(fixtures.organizations)],
+            'approver': fixtures.manager.id,
+            'payment_items': [{'product_id': product, 'price': '10.50', 'amount': 2} for product in products]}
+
+
+def product_payload(fixtures, number):
+    return {'name': f'Услуга нагрузки {number}', 'description': 'Создано нагрузочным тестом',
+            'producer': 'Нагрузка', 'category': fixtures.categories[number % len(fixtures.categories)]}
+
+
+def company_payload(fixtures):
+    company = fixtures.company
+    bank_detail = company.bank_detail
+    return {'name': company.name, 'description': company.description,
+            'bank_detail': {'name': bank_detail.name, 'address': bank_detail.address,
+                            'bank_number': bank_detail.bank_number,
+                            'settlement_account': bank_detail.settlement_account,
+                            'details': bank_detail.details}}
+
+
+def _path(route, pk=None, **query):
+    path = route.replace('<int:pk>', str(pk)) if pk is not None else route
+    return f'{path}?{urlencode(query)}' if query else path
+
+
+def _static(route, payload=None, **query):
+    return lambda fixtures, count: [(_path(route, **query), payload)]
+
+
+def _each(route, ids, payload=None):
+    return lambda fixtures, count: [(_path(route, pk), payload) for pk in ids(fixtures)]
+
+
+def _once(route, create, payload=None):
+    """Every request gets a new object from `create(fixtures, count)`."""
+    return lambda fixtures, count: [(_path(route, pk), payload) for pk in create(fixtures, count)]
+
+
+def _numbered(route, payload):
+    return lambda fixtures, count: [(_path(route), payload(fixtures, number)) for number in range(count)]
+
+
+def _report_period(fixtures, count):
+    today = timezone.localdate()
+    return [(_path('invoices/invoices-report', paid_at_after=today - datetime.timedelta(days=30),
+                   paid_at_before=today), None)]
+
+
+def _analytics_period(fixtures, count):
+    today = timezone.localdate()
+    return [(_path('invoices/analytics', date_from=today - datetime.timedelta(days=365), date_to=today,
+                   granularity='month'), None)]
+
+
+def _send_invoices(fixtures, count):
+    return [(_path('invoices/send-customer-invoices'), {'ids': fixtures.sendable_invoices[:20]})]
+
+
+def _bulk_change_status(fixtures, count):
+    # every request approves invoices of its own
+    return [(_path('invoices/change-status'), {'ids': fixtures.new_review_invoices(20), 'status': Invoice.APPLYED})
+            for _ in range(count)]
+
+
+def _bulk_invoices(fixtures, count):
+    return [(_path('invoices/bulk'), [invoice_payload(fixtures, number) for number in range(50)])]
+
+
+SCENARIOS = [
+    # bill
+    Scenario('invoice-list', 'GET', 'invoices/', _static('invoices/')),
+    Scenario('invoice-list-filtered', 'GET', 'invoices/',
+             _static('invoices/', status=Invoice.PAID, type=Invoice.INCOME)),
+    Scenario('invoice-search', 'GET', 'invoices/', _static('invoices/', search='Контрагент')),
+    Scenario('invoice-create', 'POST', 'invoices/', _numbered('invoices/', invoice_payload)),
+    Scenario('invoice-bulk-create', 'POST', 'invoices/bulk', _bulk_invoices),
+    Scenario('invoice-detail', 'GET', 'invoices/<int:pk>',
+             _each('invoices/<int:pk>', lambda fixtures: fixtures.invoices)),
+    Scenario('invoice-change-status', 'POST', 'invoices/<int:pk>/change-status',
+             _once('invoices/<int:pk>/change-status', BenchmarkFixtures.new_review_invoices,
+                   {'status': Invoice.APPLYED})),
+    Scenario('invoice-bulk-change-status', 'POST', 'invoices/change-status', _bulk_change_status),
+    Scenario('invoice-report', 'GET', 'invoices/invoices-report', _report_period),
+    Scenario('invoice-daily-stats', 'GET', 'invoices/daily_stats', _static('invoices/daily_stats')),
+    Scenario('invoice-stats', 'GET', 'invoices/stats', _static('invoices/stats')),
+    Scenario('invoice-analytics', 'GET', 'invoices/analytics', _analytics_period),
+    Scenario('invoice-send-many', 'POST', 'invoices/send-customer-invoices', _send_invoices),
+    Scenario('invoice-send', 'POST', 'invoices/<int:pk>/send-customer-invoice',
+             _each('invoices/<int:pk>/send-customer-invoice', lambda fixtures: fixtures.sendable_invoices, {})),
+    Scenario('invoice-review', 'GET', 'invoices/review', _static('invoices/review')),
+    Scenario('async-invoice-list', 'GET', 'async/invoices/', _static('async/invoices/')),
+    Scenario('async-invoice-detail', 'GET', 'async/invoices/<int:pk>',
+             _each('async/invoices/<int:pk>', lambda fixtures: fixtures.invoices)),
+    Scenario('async-invoice-review', 'GET', 'async/invoices/review', _static('async/invoices/review')),
+    Scenario('async-invoice-daily-stats', 'GET', 'async/invoices/daily_stats',
+             _static('async/invoices/daily_stats')),
+    Scenario('async-invoice-stats', 'GET', 'async/invoices/stats', _static('async/invoices/stats')),
+    Scenario('organization-list', 'GET', 'organizations/', _static('organizations/')),
+    Scenario('organization-search', 'GET', 'organizations/', _static('organizations/', search='Контрагент')),
+    Scenario('organization-create', 'POST', 'organizations/',
+             _numbered('organizations/', lambda fixtures, number: organization_payload(number)
+                       | {'bank_detail': bank_detail_payload(number)})),
+    Scenario('organization-detail', 'GET', 'organizations/<int:pk>',
+             _each('organizations/<int:pk>', lambda fixtures: fixtures.organizations)),
+    Scenario('organization-update', 'PUT', 'organizations/<int:pk>',
+             lambda fixtures, count: [(_path('organizations/<int:pk>', pk),
+                                       organization_payload(pk) | {'bank_detail': bank_detail_payload(pk)})
+                                      for pk in fixtures.organizations]),
+    Scenario('organization-delete', 'DELETE', 'organizations/<int:pk>',
+             _once('organizations/<int:pk>', BenchmarkFixtures.new_organizations)),
+    # goods
+    Scenario('product-list', 'GET', 'products/', _static('products/')),
+    Scenario('product-search', 'GET', 'products/', _static('products/', search='Услуга')),
+    Scenario('product-create', 'POST', 'products/', _numbered('products/', product_payload)),
+    Scenario('product-detail', 'GET', 'products/<int:pk>',
+             _each('products/<int:pk>', lambda fixtures: fixtures.products)),
+    Scenario('product-update', 'PUT', 'products/<int:pk>',
+             lambda fixtures, count: [(_path('products/<int:pk>', pk), product_payload(fixtures, number))
+                                      for number, pk in enumerate(fixtures.products)]),
+    Scenario('product-delete', 'DELETE', 'products/<int:pk>',
+             _once('products/<int:pk>', BenchmarkFixtures.new_products)),
+    Scenario('category-list', 'GET', 'categories/', _static('categories/')),
+    Scenario('category-create', 'POST', 'categories/',
+             _numbered('categories/', lambda fixtures, number: {'name': f'{BENCHMARK_CATEGORY} новая {number}'})),
+    Scenario('category-detail', 'GET', 'categories/<int:pk>',
+             _each('categories/<int:pk>', lambda fixtures: fixtures.categories)),
+    Scenario('category-update', 'PUT', 'categories/<int:pk>',
+             lambda fixtures, count: [(_path('categories/<int:pk>', pk), {'name': f'{BENCHMARK_CATEGORY} {pk}'})
+                                      for pk in fixtures.categories]),
+    Scenario('category-delete', 'DELETE', 'categories/<int:pk>',
+             _once('categories/<int:pk>', BenchmarkFixtures.new_categories)),
+    # staff
+    Scenario('company-list', 'GET', 'companies/', _static('companies/')),
+    Scenario('company-detail', 'GET', 'companies/<int:pk>',
+             _each('companies/<int:pk>', lambda fixtures: [fixtures.company.id])),
+    Scenario('company-update', 'PUT', 'companies/<int:pk>',
+             lambda fixtures, count: [(_path('companies/<int:pk>', fixtures.company.id),
+                                       company_payload(fixtures))]),
+    Scenario('employee-list', 'GET', 'employees/', _static('employees/')),
+    Scenario('employee-detail', 'GET', 'employees/<int:pk>',
+             _each('employees/<int:pk>', lambda fixtures: fixtures.employees)),
+    Scenario('employee-update', 'PUT', 'employees/<int:pk>',
+             _each('employees/<int:pk>', lambda fixtures: fixtures.employees, {'position': 'Бухгалтер'})),
+    Scenario('employee-delete', 'DELETE', 'employees/<int:pk>',
+             _once('employees/<int:pk>', BenchmarkFixtures.new_employees)),
+    Scenario('employee-invite', 'POST', 'employees/invite-staff',
+             _numbered('employees/invite-staff', lambda fixtures, number: {'email': fixtures.email('invite', number)})),
+    Scenario('signup', 'POST', 'signup/',
+             _numbered('signup/', lambda fixtures, number: {'email': fixtures.email('signup', number),
+                                                            'password': fixtures.password})),
+    Scenario('login', 'POST', 'login/',
+             lambda fixtures, count: [(_path('login/'), {'email': fixtures.login_user.email,
+                                                         'password': fixtures.password})]),
+]
+
+
+def view_methods(callback):
+    """HTTP methods a URL pattern's view handles, OPTIONS and HEAD aside."""
+    actions = getattr(callback, 'actions', None)
+    if actions:
+        methods = actions
+    else:
+        view_class = callback.view_class
+        methods = [method for method in view_class.http_method_names if hasattr(view_class, method)]
+    return {method.upper() for method in methods if method not in ('options', 'head')}
+
+
+def iter_routes(urlconfs=URLCONFS):
+    for urlconf in urlconfs:
+        for pattern in import_module(urlconf).urlpatterns:
+            for method in sorted(view_methods(pattern.callback)):
+                yield str(pattern.pattern), method
+
+
+def check_coverage(scenarios=SCENARIOS, skipped=SKIPPED):
+    """Routes and methods that have neither a scenario nor a reason to skip."""
+    covered = {(scenario.route, scenario.method) for scenario in scenarios} | set(skipped)
+    return [route for route in iter_routes() if route not in covered]
+
+
+def run_benchmark(base_url, fixtures, scenarios=SCENARIOS, requests=1000, concurrency=50, stdout=None):
+    """Runs the scenarios one after another, returns their results.
+    Scenarios without objects to request in the tenant are left out."""
+    headers = {'Authorization': f'Token {fixtures.token}', 'Content-Type': 'application/json'}
+    results = []
+    for scenario in scenarios:
+        targets = [(scenario.method, base_url + API_PREFIX + path,
+                    None if payload is None else json.dumps(payload, ensure_ascii=False).encode())
+                   for path, payload in scenario.build(fixtures, requests)]
+        if not targets:
+            continue
+        result = load(base_url + API_PREFIX + scenario.route, requests=requests, concurrency=concurrency,
+                      headers=headers, targets=targets)
+        results.append({'scenario': scenario.name, 'method': scenario.method, 'route': scenario.route,
+                        **result.as_dict()})
+        if stdout is not None:
+            stdout.write(f"{scenario.name}: {results[-1]['throughput']} rps, p99 {results[-1]['p99']} ms")
+    return results
@@ -0,0 +1,100 @@
+import hashlib
+
+from django.db.models import SET_NULL, Count, F, Max, Subquery
+from django.db.models.constants import LOOKUP_SEP
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+
+def SET_NULL_AND_TOUCH(collector, field, sub_objs, using):
+    """on_delete for foreign keys of rendered models: SET_NULL that also
+    moves `updated_at` of the changed rows. The deletion updates them with a
+    query, which skips auto_now, and their validators would not change."""
+    SET_NULL(collector, field, sub_objs, using)
+    if sub_objs:
+        collector.add_field_update(sub_objs[0]._meta.get_field('updated_at'), timezone.now(), sub_objs)
+
+
+def _is_to_many(model, lookup):
+    for name in lookup.split(LOOKUP_SEP)[:-1]:
+        field = model._meta.get_field(name)
+        if field.one_to_many or field.many_to_many:
+            return True
+        model = field.related_model
+    return False
+
+
+class ConditionalGetMixin:
+    """Viewset mixin answering `list` and `retrieve` with 304 Not Modified
+    when the client's ETag (or, for retrieve, Last-Modified) still matches.
+
+    Validators come from one aggregate query over the same filtered
+    queryset: the number of rows and the latest value of every
+    `conditional_fields` lookup. Rendered models that are not worth joining
+    to every row are covered by get_conditional_dependencies instead. Any
+    change of a rendered row, or a row added to or removed from the list,
+    changes the ETag; the serializer and its prefetches only run when it
+    has changed.
+
+    Lists get no Last-Modified: removing a row does not move the latest
+    modification time, so only the ETag notices it."""
+    conditional_fields = ('updated_at',)
+
+    def get_conditional_dependencies(self):
+        """(queryset, lookups) pairs of other rendered models: the latest
+        values of the lookups go into the validators of every object."""
+        return ()
+
+    def get_validators(self, queryset):
+        """(ETag, last modification time) of the queryset, None when it is
+        empty."""
+        lookups = {f'modified_{number}': lookup for number, lookup in enumerate(self.conditional_fields)}
+        aggregates = {name: Max(lookup) for name, lookup in lookups.items()}
+        for dependency, dependency_lookups in self.get_conditional_dependencies():
+            for lookup in dependency_lookups:
+                # an uncorrelated subquery, evaluated once
+                latest = dependency.order_by(F(lookup).desc(nulls_last=True)).values(lookup)[:1]
+                aggregates[f'modified_{len(aggregates)}'] = Max(Subquery(latest))
+        distinct = any(_is_to_many(queryset.model, lookup) for lookup in lookups.values())
+        values = queryset.order_by().aggregate(rows=Count('pk', distinct=distinct), **aggregates)
+        if not values['rows']:
+            return None
+        modified = [values[name] for name in aggregates]
+
+        company = self.request.tenant.company
+        # the query string selects the rows and, with sparse fieldsets, the fields
+        key = '|'.join([type(self).__name__, self.action, str(company.pk if company else None),
+                        self.request.GET.urlencode(), str(values['rows'])] + [str(value) for value in modified])
+        last_modified = max((value for value in modified if value is not None), default=None)
+        return f'W/"{hashlib.sha1(key.encode()).hexdigest()}"', last_modified
+
+    def _conditional(self, request, validators, render, last_modified=True):
+        if validators is None:
+            return render()
+        etag, modified = validators
+        # HTTP dates have whole seconds
+        modified = int(modified.timestamp()) if last_modified and modified is not None else None
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            response = render()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if modified is not None:
+                response['Last-Modified'] = http_date(modified)
+            # representations differ by user and by format
+            patch_vary_headers(response, ('Accept', 'Authorization', 'Cookie'))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        validators = self.get_validators(self.filter_queryset(self.get_queryset()))
+        return self._conditional(request, validators, lambda: super(ConditionalGetMixin, self).list(
+            request, *args, **kwargs), last_modified=False)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()) \
+            .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        # unknown objects go on to the usual 404
+        return self._conditional(request, self.get_validators(queryset),
+                                 lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,79 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+def _get_relation(model, source):
+    if '.' in source:
+        return None
+    try:
+        field = model._meta.get_field(source)
+    except FieldDoesNotExist:
+        return None
+    return field if field.is_relation else None
+
+
+def get_eager_loading(serializer, prefix=''):
+    """Walks the readable fields of a ModelSerializer and returns the
+    `select_related` and `prefetch_related` lookups needed to render it
+    without a query per row.
+
+    Nested serializers over forward and reverse one-to-one relations become
+    joins, `many=True` serializers and many-related fields become prefetches
+    whose querysets are planned recursively."""
+    select_related, prefetch_related = [], []
+    model = serializer.Meta.model
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        relation = _get_relation(model, field.source)
+        if relation is None:
+            continue
+        lookup = prefix + field.source
+
+        if relation.one_to_many or relation.many_to_many:
+            queryset = relation.related_model._default_manager.all()
+            child = getattr(field, 'child', None)
+            if isinstance(child, serializers.ModelSerializer):
+                queryset = eager_load(queryset, child)
+            prefetch_related.append(Prefetch(lookup, queryset=queryset))
+        elif isinstance(field, serializers.ModelSerializer):
+            select_related.append(lookup)
+            nested_select, nested_prefetch = get_eager_loading(field, lookup + '__')
+            select_related.extend(nested_select)
+            prefetch_related.extend(nested_prefetch)
+        elif isinstance(field, serializers.RelatedField) \
+                and not isinstance(field, serializers.PrimaryKeyRelatedField):
+            # The primary key is already on the row, any other representation
+            # of a related object needs the object itself.
+            select_related.append(lookup)
+
+    return select_related, prefetch_related
+
+
+def eager_load(queryset, serializer):
+    select_related, prefetch_related = get_eager_loading(serializer)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+class EagerLoadingMixin:
+    """Viewset mixin that applies the joins and prefetches planned from the
+    view's serializer to `get_queryset()`.
+
+    Only actions listed in `eager_loading_actions` are planned: actions that
+    aggregate or project the queryset with `values()` must not get prefetches."""
+    eager_loading_actions = ('list', 'retrieve', 'update', 'partial_update')
+
+    def uses_eager_loading(self):
+        return self.action in self.eager_loading_actions
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.uses_eager_loading():
+            queryset = eager_load(queryset, self.get_serializer())
+        return queryset
@@ -0,0 +1,263 @@
+"""Serializer-free rendering of list responses.
+
+A LeanPlan is compiled once per ModelSerializer class from its readable
+fields: plain fields become `values()` columns with a converter giving the
+same representation as the DRF field, nested serializers over forward
+relations become joined columns, and `many=True` serializers over reverse
+foreign keys become one more `values()` query per level. Rendering then
+works on dicts only, without model instances or field objects.
+
+Fields the plan can't reproduce exactly (method fields, dotted sources,
+many-to-many relations, ...) make compiling fail with
+ImproperlyConfigured, so a view can't silently render something else than
+its serializer."""
+import datetime
+import decimal
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models.constants import LOOKUP_SEP
+from django.utils import timezone
+from phonenumber_field.modelfields import PhoneNumberField
+from phonenumber_field.phonenumber import to_python
+from rest_framework import serializers
+from rest_framework.fields import ISO_8601
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+_plans = {}
+
+
+def _datetime(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None:
+        return lambda value: value
+    field_timezone = getattr(field, 'timezone', None)
+
+    def convert(value):
+        # DateTimeField.enforce_timezone, with the timezone active when rendering
+        value_timezone = field_timezone or (timezone.get_current_timezone() if settings.USE_TZ else None)
+        if value_timezone is not None:
+            value = value.astimezone(value_timezone) if timezone.is_aware(value) \
+                else timezone.make_aware(value, value_timezone)
+        elif timezone.is_aware(value):
+            value = timezone.make_naive(value, datetime.timezone.utc)
+        if output_format.lower() != ISO_8601:
+            return value.strftime(output_format)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def _date(output_format):
+    if output_format is None:
+        return lambda value: value
+    if output_format.lower() == ISO_8601:
+        return lambda value: value.isoformat()
+    return lambda value: value.strftime(output_format)
+
+
+def _decimal(field):
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.localize:
+        raise ImproperlyConfigured("Локализованные DecimalField не поддерживаются")
+    exponent = decimal.Decimal('.1') ** field.decimal_places if field.decimal_places is not None else None
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        if exponent is not None:
+            value = value.quantize(exponent, rounding=field.rounding, context=context)
+        return '{:f}'.format(value) if coerce_to_string else value
+    return convert
+
+
+def _phone_number(model_field):
+    # what the model field's descriptor turns the column into
+    return lambda value: str(to_python(value, region=model_field.region))
+
+
+def _get_converter(field, model_field):
+    """Function giving field.to_representation(value) for non-null column
+    values, None for unsupported fields."""
+    if isinstance(field, serializers.PrimaryKeyRelatedField):
+        return None if field.pk_field is not None else (lambda value: value)
+    if isinstance(field, serializers.ChoiceField):
+        choices = dict(field.choice_strings_to_values)
+        return lambda value: value if value == '' else choices.get(str(value), value)
+    if isinstance(field, serializers.DateTimeField):
+        return _datetime(field)
+    if isinstance(field, serializers.DateField):
+        return _date(getattr(field, 'format', api_settings.DATE_FORMAT))
+    if isinstance(field, serializers.DecimalField):
+        return _decimal(field)
+    if isinstance(field, serializers.CharField):
+        if isinstance(model_field, PhoneNumberField):
+            return _phone_number(model_field)
+        return str
+    if isinstance(field, serializers.IntegerField):
+        return int
+    if isinstance(field, serializers.FloatField):
+        return float
+    if type(field) is serializers.BooleanField:
+        return bool
+    return None
+
+
+def _unsupported(serializer, name, reason):
+    return ImproperlyConfigured(f"{type(serializer).__name__}.{name}: {reason}, "
+                                f"используйте сериализатор")
+
+
+class ManyRelation:
+    """Rows of a `many=True` nested serializer over a reverse foreign key,
+    or only their primary keys when there is no serializer."""
+
+    def __init__(self, relation, owner_lookup, serializer=None):
+        self.model = relation.related_model
+        self.field_name = relation.field.name
+        # the foreign key comes back as the owner's primary key
+        self.owner_lookup = owner_lookup
+        self.plan = LeanPlan(serializer, extra_lookups=(self.field_name,)) if serializer is not None else None
+
+    def fetch(self, owner_ids):
+        """Rendered rows by owner primary key."""
+        if not owner_ids:
+            return {}
+        queryset = self.model._default_manager.filter(**{f'{self.field_name}__in': owner_ids}) \
+            .order_by(*(self.model._meta.ordering or ['pk']))
+        grouped = defaultdict(list)
+        if self.plan is None:
+            for owner_id, pk in queryset.values_list(self.field_name, 'pk'):
+                grouped[owner_id].append(pk)
+            return grouped
+        rows = list(queryset.values(*self.plan.lookups))
+        for row, data in zip(rows, self.plan.render(rows)):
+            grouped[row[self.field_name]].append(data)
+        return grouped
+
+
+class LeanPlan:
+    def __init__(self, serializer, prefix='', extra_lookups=()):
+        self.model = serializer.Meta.model
+        self.pk_lookup = prefix + self.model._meta.pk.name
+        # (name, kind, payload) in the serializer's field order
+        self.entries = []
+        self.lookups = [self.pk_lookup, *extra_lookups]
+        self.many = []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            source = field.source
+            if source == '*' or '.' in source:
+                raise _unsupported(serializer, name, "источник не является полем модели")
+            try:
+                model_field = self.model._meta.get_field(source)
+            except FieldDoesNotExist:
+                raise _unsupported(serializer, name, "нет такого поля модели")
+
+            if isinstance(field, serializers.ListSerializer):
+                if not (model_field.one_to_many and isinstance(field.child, serializers.ModelSerializer)):
+                    raise _unsupported(serializer, name, "поддерживаются только обратные внешние ключи")
+                many = ManyRelation(model_field, self.pk_lookup, field.child)
+                self.entries.append((name, 'many', many))
+                self.many.append(many)
+            elif isinstance(field, serializers.ManyRelatedField):
+                if not (model_field.one_to_many and type(field.child_relation) is serializers.PrimaryKeyRelatedField
+                        and field.child_relation.pk_field is None):
+                    raise _unsupported(serializer, name, "поддерживаются только ключи обратных внешних ключей")
+                many = ManyRelation(model_field, self.pk_lookup)
+                self.entries.append((name, 'many', many))
+                self.many.append(many)
+            elif isinstance(field, serializers.ModelSerializer):
+                if not (model_field.many_to_one or model_field.one_to_one) or model_field.auto_created:
+                    raise _unsupported(serializer, name, "поддерживаются только прямые связи")
+                nested = LeanPlan(field, prefix + source + LOOKUP_SEP)
+                self.entries.append((name, 'one', nested))
+                self.lookups.extend(lookup for lookup in nested.lookups if lookup not in self.lookups)
+                self.many.extend(nested.many)
+            else:
+                if model_field.is_relation and not isinstance(field, serializers.PrimaryKeyRelatedField):
+                    raise _unsupported(serializer, name, "связанный объект без вложенного сериализатора")
+                converter = _get_converter(field, model_field)
+                if converter is None:
+                    raise _unsupported(serializer, name, f"{type(field).__name__} не поддерживается")
+                lookup = prefix + source
+                self.entries.append((name, 'value', (lookup, converter)))
+                if lookup not in self.lookups:
+                    self.lookups.append(lookup)
+
+    def render_row(self, row, children):
+        data = {}
+        for name, kind, payload in self.entries:
+            if kind == 'value':
+                lookup, convert = payload
+                value = row[lookup]
+                data[name] = None if value is None else convert(value)
+            elif kind == 'one':
+                data[name] = None if row[payload.pk_lookup] is None else payload.render_row(row, children)
+            else:
+                data[name] = children[payload].get(row[payload.owner_lookup], [])
+        return data
+
+    def render(self, rows):
+        children = {many: many.fetch({row[many.owner_lookup] for row in rows
+                                      if row[many.owner_lookup] is not None})
+                    for many in self.many}
+        return [self.render_row(row, children) for row in rows]
+
+
+def get_lean_plan(serializer_class):
+    plan = _plans.get(serializer_class)
+    if plan is None:
+        plan = _plans[serializer_class] = LeanPlan(serializer_class())
+    return plan
+
+
+class LeanListMixin:
+    """Viewset mixin rendering the `list` action with the LeanPlan of the
+    view's serializer class instead of the serializer, when `lean_list` is
+    on. The response is the same, byte for byte.
+
+    Prefetches and joins of the queryset are dropped, the plan reads what it
+    needs; the ordering fields used by cursor pagination are read as well.
+    Must come before EagerLoadingMixin, which has nothing to plan then."""
+    lean_list = False
+
+    def uses_eager_loading(self):
+        if self.lean_list and self.action == 'list':
+            return False
+        return super().uses_eager_loading()
+
+    def list(self, request, *args, **kwargs):
+        if not self.lean_list:
+            return super().list(request, *args, **kwargs)
+        return self.get_lean_list_response(request)
+
+    def get_list_plan(self):
+        return get_lean_plan(self.get_serializer_class())
+
+    def get_lean_list_response(self, request):
+        plan = self.get_list_plan()
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+
+        lookups = list(plan.lookups)
+        get_ordering = getattr(self.paginator, 'get_ordering', None)
+        if get_ordering is not None:
+            for field in get_ordering(request, queryset, self):
+                field = field.lstrip('-')
+                if field not in lookups:
+                    lookups.append(field)
+        rows = queryset.values(*lookups)
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(plan.render(page))
+        return Response(plan.render(list(rows)))
@@ -0,0 +1,147 @@
+"""Minimal concurrent HTTP/1.1 load generator for the benchmark commands.
+
+Every worker keeps one keep-alive connection and sends requests back to back
+until the shared request budget is spent, so `concurrency` is the number of
+requests in flight at any moment. Requests can cycle through several
+targets, e.g. to delete a different object each time. Only the standard
+library is used."""
+import asyncio
+import math
+import time
+from urllib.parse import urlsplit
+
+
+class LoadResult:
+    def __init__(self, url, concurrency):
+        self.url = url
+        self.concurrency = concurrency
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.duration = 0.0
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        return self.requests / self.duration if self.duration else 0.0
+
+    def percentile(self, percent):
+        """Latency in milliseconds below which `percent` of requests finished
+        (nearest-rank method)."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+        return ordered[rank - 1] * 1000
+
+    def as_dict(self):
+        return {'url': self.url,
+                'concurrency': self.concurrency,
+                'requests': self.requests,
+                'errors': self.errors,
+                'statuses': {str(code): count for code, count in sorted(self.statuses.items())},
+                'duration': round(self.duration, 3),
+                'throughput': round(self.throughput, 1),
+                'p50': _round(self.percentile(50)),
+                'p95': _round(self.percentile(95)),
+                'p99': _round(self.percentile(99))}
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed by the server')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        headers['connection'] = 'close'
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+def _build_request(url, method, headers, body):
+    parts = urlsplit(url)
+    if parts.scheme != 'http':
+        raise ValueError('Only http:// URLs are supported.')
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    lines = [f'{method} {path} HTTP/1.1', f'Host: {parts.netloc}', 'Connection: keep-alive']
+    lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    if body is not None:
+        lines.append(f'Content-Length: {len(body)}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin1') + (body or b'')
+
+
+async def _worker(parts, requests, counter, total, result, timeout):
+    reader = writer = None
+    while counter[0] < total:
+        request = requests[counter[0] % len(requests)]
+        counter[0] += 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(parts.hostname, parts.port or 80), timeout)
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await asyncio.wait_for(_read_response(reader), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+            result.errors += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        result.latencies.append(time.perf_counter() - started)
+        result.statuses[status] = result.statuses.get(status, 0) + 1
+        if not keep_alive:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(url, requests=1000, concurrency=50, method='GET', headers=None, body=None, timeout=30,
+                   targets=None):
+    """Sends `requests` requests to `url` with `concurrency` of them in flight.
+
+    `targets`, a list of (method, url, body) on the same host, replaces
+    `method`, `url` and `body`: the n-th request goes to the n-th target,
+    cycling when there are fewer targets than requests."""
+    targets = targets or [(method, url, body)]
+    built = [_build_request(target_url, target_method, headers, target_body)
+             for target_method, target_url, target_body in targets]
+    parts = urlsplit(targets[0][1])
+    result = LoadResult(url, concurrency)
+    counter = [0]
+    started = time.perf_counter()
+    await asyncio.gather(*(_worker(parts, built, counter, requests, result, timeout)
+                           for _ in range(concurrency)))
+    result.duration = time.perf_counter() - started
+    return result
+
+
+def load(url, **options):
+    return asyncio.run(run_load(url, **options))
@@ -0,0 +1,268 @@
+"""Per-endpoint request metrics in Prometheus text format.
+
+MetricsMiddleware records, for every view: request count by status, a
+latency histogram, the number and total time of SQL queries and the size
+of responses. The view label is `ViewSet.action` for DRF viewsets. Metrics
+live in the memory of each worker process, so every worker has to be
+scraped (or run one worker per scrape target).
+
+Queries are counted by the current QueryCounter, a context variable, so
+those that async views run in sync_to_async threads (gather_queries
+included) are counted for the request too."""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework import permissions
+from rest_framework.views import APIView
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# other methods share one label, clients can send any verb
+HTTP_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'))
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests = defaultdict(int)
+            self._latency_buckets = defaultdict(lambda: [0] * len(self.buckets))
+            self._latency_sum = defaultdict(float)
+            self._latency_count = defaultdict(int)
+            self._sql_queries = defaultdict(int)
+            self._sql_seconds = defaultdict(float)
+            self._response_bytes = defaultdict(int)
+
+    def observe(self, view, method, status, duration, queries, sql_seconds, response_bytes):
+        key = (view, method)
+        with self._lock:
+            self._requests[(view, method, str(status))] += 1
+            buckets = self._latency_buckets[key]
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    buckets[index] += 1
+            self._latency_sum[key] += duration
+            self._latency_count[key] += 1
+            self._sql_queries[key] += queries
+            self._sql_seconds[key] += sql_seconds
+            self._response_bytes[key] += response_bytes
+
+    def add_response_bytes(self, view, method, response_bytes):
+        with self._lock:
+            self._response_bytes[(view, method)] += response_bytes
+
+    def render(self):
+        with self._lock:
+            lines = []
+            _family(lines, 'finance_http_requests_total', 'counter', 'HTTP requests by view and status.',
+                    ((('view', 'method', 'status'), key, value) for key, value in self._requests.items()))
+
+            lines += ['# HELP finance_http_request_duration_seconds Time spent in the Django stack.',
+                      '# TYPE finance_http_request_duration_seconds histogram']
+            for (view, method), buckets in sorted(self._latency_buckets.items()):
+                labels = {'view': view, 'method': method}
+                for bound, count in zip(self.buckets, buckets):
+                    lines.append(_sample('finance_http_request_duration_seconds_bucket',
+                                         {**labels, 'le': repr(bound)}, count))
+                count = self._latency_count[(view, method)]
+                lines.append(_sample('finance_http_request_duration_seconds_bucket', {**labels, 'le': '+Inf'}, count))
+                lines.append(_sample('finance_http_request_duration_seconds_sum', labels,
+                                     self._latency_sum[(view, method)]))
+                lines.append(_sample('finance_http_request_duration_seconds_count', labels, count))
+
+            for name, help_text, values in (
+                    ('finance_http_sql_queries_total', 'SQL queries run by requests.', self._sql_queries),
+                    ('finance_http_sql_duration_seconds_total', 'Time spent in SQL queries.', self._sql_seconds),
+                    ('finance_http_response_size_bytes_total', 'Bytes of response bodies.', self._response_bytes)):
+                _family(lines, name, 'counter', help_text,
+                        ((('view', 'method'), key, value) for key, value in values.items()))
+        _render_pool_stats(lines)
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, labels, value):
+    rendered = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in labels.items())
+    return f'{name}{{{rendered}}} {value}'
+
+
+def _family(lines, name, metric_type, help_text, samples):
+    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+    for label_names, key, value in sorted(samples, key=lambda sample: sample[1]):
+        lines.append(_sample(name, dict(zip(label_names, key)), value))
+
+
+def _render_pool_stats(lines):
+    if not any(connection.settings_dict['ENGINE'] == 'finance.backends.postgresql_pool'
+               for connection in connections.all()):
+        return
+    from finance.backends.postgresql_pool.base import get_pool_stats
+
+    stats = get_pool_stats()
+    counters = ('checkouts', 'waits', 'timeouts', 'created', 'closed', 'health_check_failures')
+    for name in counters + ('size', 'idle', 'in_use'):
+        metric = f'finance_db_pool_{name}' + ('_total' if name in counters else '')
+        _family(lines, metric, 'counter' if name in counters else 'gauge',
+                f'Connection pool {name.replace("_", " ")}.',
+                ((('alias',), (alias,), pool[name]) for alias, pool in stats.items()))
+
+
+registry = MetricsRegistry()
+
+
+def get_method_label(method):
+    return method if method in HTTP_METHODS else 'other'
+
+
+def get_view_label(view_func, method):
+    label = getattr(view_func, 'metrics_label', None)
+    if label:
+        return label
+    cls = getattr(view_func, 'cls', None)
+    if cls is not None:
+        actions = getattr(view_func, 'actions', None) or {}
+        return f'{cls.__name__}.{actions.get(method.lower(), method.lower())}'
+    module = getattr(view_func, '__module__', '')
+    if module.startswith('django.contrib.admin'):
+        return 'admin'
+    return f"{module}.{getattr(view_func, '__qualname__', type(view_func).__name__)}"
+
+
+class QueryCounter:
+    """Number and total time of the queries of one request, which may run in
+    several threads."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.seconds += seconds
+
+
+_current_counter = contextvars.ContextVar('query_counter', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _current_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter.add(time.perf_counter() - started)
+
+
+def _watch(connection, **kwargs):
+    """Installs the query counting execute_wrapper on a connection, once."""
+    if _count_query not in connection.execute_wrappers:
+        # outermost: the connection.execute_wrapper() blocks open around this
+        # call remove the last wrapper when they exit
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+# connections of every thread, including the ones opened by sync_to_async
+connection_created.connect(_watch)
+
+
+def _counted(content, view, method):
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        registry.add_response_bytes(view, method, size)
+
+
+class MetricsMiddleware:
+    """Records request metrics into `registry`. Put it first in MIDDLEWARE,
+    so that the latency covers the other middleware too. Works in both sync
+    and async stacks, so it doesn't force the ASGI handler into a thread."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function for Django's handler.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self._acall(request)
+        # connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            _watch(connection)
+        request.metrics_view = 'unmatched'
+        counter = QueryCounter()
+        token = _current_counter.set(counter)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_counter.reset(token)
+        return self._record(request, response, counter, time.perf_counter() - started)
+
+    async def _acall(self, request):
+        request.metrics_view = 'unmatched'
+        counter = QueryCounter()
+        token = _current_counter.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_counter.reset(token)
+        return self._record(request, response, counter, time.perf_counter() - started)
+
+    def _record(self, request, response, counter, duration):
+        view, method = request.metrics_view, get_method_label(request.method)
+        if response.streaming:
+            # the body is sent after the view returned, count it as it goes
+            response_bytes = 0
+            response.streaming_content = _counted(response.streaming_content, view, method)
+        else:
+            response_bytes = len(response.content)
+        registry.observe(view, method, response.status_code, duration,
+                         counter.queries, counter.seconds, response_bytes)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = get_view_label(view_func, get_method_label(request.method))
+
+
+class CanReadMetrics(permissions.BasePermission):
+    """Scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`,
+    people with a superuser account."""
+
+    def has_permission(self, request, view):
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        keyword, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if token and keyword == 'Bearer' and constant_time_compare(credentials, token):
+            return True
+        return bool(request.user and request.user.is_superuser)
+
+
+class MetricsView(APIView):
+    permission_classes = (CanReadMetrics,)
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
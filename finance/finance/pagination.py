@@ -0,0 +1,34 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.settings import api_settings
+
+from finance.search import SEARCH_RANK
+
+
+class TenantCursorPagination(CursorPagination):
+    """Keyset pagination for tenant lists.
+
+    A page is located by the value of the first ordering field taken from the
+    cursor instead of an OFFSET, so pages deep in the history cost the same
+    as the first one. The ordering comes from the view's `ordering` (or the
+    `ordering` query parameter) through OrderingFilter; `id` is appended as
+    the tie-breaker, so rows with equal values keep their order between
+    pages. Views limit client orderings with `ordering_fields` to non-null
+    columns with mostly distinct values: a null can't be a cursor position
+    and many equal values make the cursor skip them with an OFFSET."""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        # Ranked search results keep their relevance order across pages,
+        # unless the client asked for an explicit ordering. Equal ranks are
+        # common, the rows with the cursor's rank are told apart by the
+        # ordering after it, down to id.
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering += ('id',)
+        if SEARCH_RANK in queryset.query.annotations \
+                and not request.query_params.get(api_settings.ORDERING_PARAM):
+            return (f'-{SEARCH_RANK}',) + ordering
+        return ordering
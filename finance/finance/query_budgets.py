@@ -0,0 +1,220 @@
+"""Query-count budgets for API endpoints.
+
+A budget is the largest number of SQL queries an endpoint may run, whatever
+the number of rows it reads. QueryBudgetMixin requests every endpoint of
+a URLconf with 1, 10 and 100 rows and fails when a budget is exceeded,
+listing the queries grouped by call site: the line of project code and the
+serializer field that ran them, which is where an N+1 usually hides.
+
+Authentication caches are cleared before every request, so budgets include
+the queries of a cold cache. A bulk insert or a delete that Django splits
+into batches (e.g. because SQLite binds at most 999 parameters per query)
+counts as one query."""
+import os
+import re
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from finance.benchmark import iter_routes
+from staff.authentication import token_cache, basic_cache
+from staff.models import BankDetails, Company, Employee
+
+API_PREFIX = '/api/'
+# longest first: site-packages is inside the standard library directory
+LIBRARY_PATHS = tuple(sorted({os.path.dirname(os.__file__), *(path for path in sys.path if 'site-packages' in path)},
+                             key=len, reverse=True))
+# Django functions that split one statement into several queries
+BATCH_FUNCTIONS = ('_batched_insert', 'delete_batch', 'update_batch')
+
+
+class QueryBudget:
+    """`kwargs(rows)` returns the arguments of the route, `data(rows)` the
+    request body and `query(rows)` the query string; `rows` is what
+    create_rows returned."""
+
+    def __init__(self, method, route, queries, kwargs=None, data=None, query=None, status=None):
+        self.method = method
+        self.route = route
+        self.queries = queries
+        self.kwargs = kwargs
+        self.data = data
+        self.query = query
+        self.status = status
+
+    def __str__(self):
+        return f'{self.method} {self.route}'
+
+
+def route_path(route, **kwargs):
+    return API_PREFIX + re.sub(r'<(?:\w+:)?(\w+)>', lambda match: str(kwargs[match.group(1)]), route)
+
+
+def _short_name(filename):
+    for root in (str(settings.BASE_DIR),) + LIBRARY_PATHS:
+        if filename.startswith(root + os.sep):
+            return filename[len(root) + 1:]
+    return filename
+
+
+# arguments of connection.execute_wrapper() functions
+WRAPPER_ARGUMENTS = {'execute', 'sql', 'params', 'many', 'context'}
+
+
+def _is_project(frame):
+    filename = frame.f_code.co_filename
+    code = frame.f_code
+    # middleware and execute wrappers (finance.metrics) are on every stack
+    # and tell nothing about the query
+    return filename.startswith(str(settings.BASE_DIR) + os.sep) and not filename.startswith(LIBRARY_PATHS) \
+        and not hasattr(frame.f_locals.get('self'), 'get_response') \
+        and not WRAPPER_ARGUMENTS <= set(code.co_varnames[:code.co_argcount])
+
+
+def _serializer_field(frame):
+    field = frame.f_locals.get('self') if frame.f_code.co_name in ('to_representation', 'get_attribute') else None
+    if not isinstance(field, serializers.Field) or field.parent is None:
+        return None
+    return f'{type(field.parent).__name__}.{field.field_name}'
+
+
+def get_call_site(frame):
+    """Describes where the query of `frame` comes from: the innermost line of
+    project code, the serializer field being rendered if any, and the
+    innermost line outside the ORM, which tells how the query was triggered
+    (e.g. a related object read by a field)."""
+    project = field = trigger = None
+    # frames of this module and above it are the test, not the request
+    while frame is not None and project is None and frame.f_code.co_filename != __file__:
+        filename = frame.f_code.co_filename
+        short_name = _short_name(filename)
+        if trigger is None and not short_name.startswith(os.path.join('django', 'db')):
+            trigger = f'{short_name}:{frame.f_lineno} in {frame.f_code.co_name}'
+        if field is None:
+            field = _serializer_field(frame)
+        if _is_project(frame):
+            project = f'{short_name}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    call_site = project or trigger
+    if field is not None:
+        call_site += f' [{field}]'
+    if project is not None and trigger not in (None, project):
+        call_site += f' (via {trigger})'
+    return call_site
+
+
+def _batch_frame(frame):
+    while frame is not None:
+        if frame.f_code.co_name in BATCH_FUNCTIONS:
+            return frame
+        frame = frame.f_back
+    return None
+
+
+class QueryRecorder:
+    """execute_wrapper that keeps every query with its call site."""
+
+    def __init__(self):
+        self.queries = []
+        self.count = 0
+        self._batch = None
+
+    def __call__(self, execute, sql, params, many, context):
+        caller = sys._getframe(1)
+        batch = _batch_frame(caller)
+        if batch is None or batch is not self._batch:
+            self.count += 1
+        self._batch = batch
+        self.queries.append((sql, get_call_site(caller)))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return self.count
+
+    def report(self):
+        groups = defaultdict(list)
+        for sql, call_site in self.queries:
+            groups[call_site].append(sql)
+        lines = []
+        for call_site, queries in sorted(groups.items(), key=lambda group: -len(group[1])):
+            lines.append(f'{len(queries):>5} x {call_site}')
+            for sql in dict.fromkeys(queries):
+                lines.append(f'          {sql[:500]}')
+        return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin. Subclasses set `urlconf`, `budgets` and, for routes
+    that cannot be requested, `skipped` {(route, method): reason}, and
+    implement create_rows. setUp makes `self.user`, an employee of
+    `self.company` (with bank details), and authenticates `self.client`
+    with its token; `staff_user` makes the user staff."""
+    urlconf = None
+    budgets = ()
+    skipped = {}
+    row_counts = (1, 10, 100)
+    staff_user = False
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('test@mail.com', 'test@mail.com', 'testingpassword',
+                                                         is_staff=self.staff_user)
+        bank_detail = BankDetails.objects.create(name="bank", address="address", bank_number="number",
+                                                 settlement_account="account")
+        self.company = Company.objects.create(name="test", description="description", bank_detail=bank_detail)
+        self.employee = Employee.objects.create(position="position", company=self.company, user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def create_rows(self, count):
+        """Abstract: creates `count` rows of everything the endpoints list
+        and returns the objects the budgets refer to, usually as a
+        SimpleNamespace."""
+        raise NotImplementedError(f"{type(self).__name__} must implement create_rows(count)")
+
+    def request(self, budget, rows):
+        path = route_path(budget.route, **(budget.kwargs(rows) if budget.kwargs else {}))
+        data = budget.data(rows) if budget.data else None
+        if budget.query:
+            data = budget.query(rows)
+        token_cache.clear()
+        basic_cache.clear()
+
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = getattr(self.client, budget.method.lower())(path, data, format='json')
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content, recorder
+
+    def assertWithinBudget(self, budget, count):
+        with transaction.atomic():
+            rows = self.create_rows(count)
+            response, content, recorder = self.request(budget, rows)
+            transaction.set_rollback(True)
+
+        if budget.status is not None:
+            self.assertEqual(response.status_code, budget.status, content[:500])
+        else:
+            self.assertLess(response.status_code, 400, content[:500])
+        if len(recorder) > budget.queries:
+            self.fail(f'{budget} with {count} rows ran {len(recorder)} queries, '
+                      f'the budget is {budget.queries}:\n{recorder.report()}')
+
+    def test_query_budgets(self):
+        for budget in self.budgets:
+            for count in self.row_counts:
+                with self.subTest(endpoint=str(budget), rows=count):
+                    self.assertWithinBudget(budget, count)
+
+    def test_budgets_cover_urlconf(self):
+        if self.urlconf is None:
+            return
+        declared = {(budget.route, budget.method) for budget in self.budgets} | set(self.skipped)
+        self.assertEqual([route for route in iter_routes([self.urlconf]) if route not in declared], [])
@@ -0,0 +1,276 @@
+"""Routing of read-only views to streaming replicas of the default database.
+
+Views opt in per action with ReadReplicaMixin.read_replica_actions; for
+those actions every read of the request, including the rows of streamed
+responses, goes through ReplicaRouter to one of READ_REPLICAS['ALIASES'].
+Everything else, and every query inside a transaction, stays on default.
+
+A request is kept on default when:
+- its company or user made a write request less than STICKY_SECONDS ago
+  (marked by ReplicaStickinessMiddleware), so users read their own writes;
+- no replica is healthy: replicas are checked at most once per
+  HEALTH_CHECK_INTERVAL seconds per process, and are unhealthy when they
+  can't be reached or lag more than MAX_LAG seconds behind. A database
+  error during a routed request marks its replica unhealthy at once.
+
+Stickiness is stored in the CACHE Django cache, which has to be shared by
+all workers (e.g. Redis) for it to hold across processes: replicas are
+refused with a per-process cache, see check_shared_cache."""
+import asyncio
+import contextlib
+import itertools
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # database aliases of the replicas
+    'ALIASES': [],
+    # how long reads of a tenant stay on default after it writes
+    'STICKY_SECONDS': 10,
+    # replicas lagging more are not used
+    'MAX_LAG': 30,
+    'HEALTH_CHECK_INTERVAL': 5,
+    'CACHE': 'default',
+}
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def replica_settings():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+def get_read_alias():
+    """Replica the reads of the current request go to, None for default."""
+    return _read_alias.get()
+
+
+@contextlib.contextmanager
+def read_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def _read_during(iterator, alias):
+    # each chunk is produced with the alias set, as the response may be
+    # iterated in another context than the view
+    iterator = iter(iterator)
+    while True:
+        with read_from(alias):
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+def _in_transaction():
+    # the atomic blocks TestCase wraps tests into don't count
+    return any(not block._from_testcase for block in connections[DEFAULT_DB_ALIAS].atomic_blocks)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = get_read_alias()
+        if alias is None or _in_transaction():
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_settings()['ALIASES']:
+            return False
+        return None
+
+
+class ReplicaHealth:
+    """Per-process health of the replicas, rechecked at most once per
+    HEALTH_CHECK_INTERVAL seconds."""
+    LAG_SQL = """
+        SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"""
+
+    def __init__(self):
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def get_lag(self, alias):
+        """Replication lag in seconds, None when the replica can't be reached."""
+        connection = connections[alias]
+        try:
+            if connection.vendor != 'postgresql':
+                connection.ensure_connection()
+                return 0
+            with connection.cursor() as cursor:
+                cursor.execute(self.LAG_SQL)
+                lag = cursor.fetchone()[0]
+            return float(lag or 0)
+        except DatabaseError:
+            logger.warning("Реплика %s недоступна", alias, exc_info=True)
+            connection.close_if_unusable_or_obsolete()
+            return None
+
+    def is_healthy(self, alias):
+        options = replica_settings()
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(alias)
+            if checked is not None and now - checked[0] < options['HEALTH_CHECK_INTERVAL']:
+                return checked[1]
+            # other threads keep the last result while this one checks
+            self._checked[alias] = (now, checked[1] if checked else False)
+        lag = self.get_lag(alias)
+        healthy = lag is not None and lag <= options['MAX_LAG']
+        if lag is not None and not healthy:
+            logger.warning("Реплика %s отстает на %.1f с", alias, lag)
+        with self._lock:
+            self._checked[alias] = (time.monotonic(), healthy)
+        return healthy
+
+    def mark_unhealthy(self, alias):
+        with self._lock:
+            self._checked[alias] = (time.monotonic(), False)
+
+    def reset(self):
+        with self._lock:
+            self._checked.clear()
+
+
+replica_health = ReplicaHealth()
+_next_replica = itertools.count()
+
+
+def _sticky_keys(user_id, company_id):
+    keys = [f'read-replica-sticky:user:{user_id}']
+    if company_id is not None:
+        keys.append(f'read-replica-sticky:company:{company_id}')
+    return keys
+
+
+def check_shared_cache():
+    """Raises ImproperlyConfigured when replicas are on but stickiness would
+    only hold in the worker that served the write."""
+    options = replica_settings()
+    if options['ALIASES'] and isinstance(caches[options['CACHE']], (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured(f"READ_REPLICAS: кэш {options['CACHE']!r} не общий для процессов, "
+                                   f"задайте FINANCE_REDIS_URL")
+
+
+def mark_write(user_id, company_id=None):
+    """Keeps the reads of the user and of its company on default for
+    STICKY_SECONDS."""
+    options = replica_settings()
+    if options['ALIASES']:
+        caches[options['CACHE']].set_many(dict.fromkeys(_sticky_keys(user_id, company_id), True),
+                                          options['STICKY_SECONDS'])
+
+
+def is_sticky(user_id, company_id=None):
+    options = replica_settings()
+    return bool(caches[options['CACHE']].get_many(_sticky_keys(user_id, company_id)))
+
+
+def choose_replica(request):
+    """Healthy replica for a read-only request, or None to read from default."""
+    aliases = replica_settings()['ALIASES']
+    if not aliases or not request.user.is_authenticated:
+        return None
+    company = request.tenant.company
+    if is_sticky(request.user.pk, company.pk if company is not None else None):
+        return None
+    start = next(_next_replica)
+    for offset in range(len(aliases)):
+        alias = aliases[(start + offset) % len(aliases)]
+        if replica_health.is_healthy(alias):
+            return alias
+    return None
+
+
+class ReadReplicaMixin:
+    """APIView mixin that sends the reads of safe requests to
+    `read_replica_actions` to a replica, see choose_replica."""
+    read_replica_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.read_alias = None
+        if request.method in SAFE_METHODS and getattr(self, 'action', None) in self.read_replica_actions:
+            self.read_alias = choose_replica(request)
+        # restored with set() rather than a token: async views (finance.asynchronous)
+        # run initial and finalize_response in different contexts
+        self._previous_read_alias = _read_alias.get()
+        _read_alias.set(self.read_alias)
+
+    def handle_exception(self, exc):
+        alias = getattr(self, 'read_alias', None)
+        if alias is not None and isinstance(exc, DatabaseError):
+            replica_health.mark_unhealthy(alias)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if hasattr(self, '_previous_read_alias'):
+            _read_alias.set(self._previous_read_alias)
+            del self._previous_read_alias
+            if self.read_alias is not None and getattr(response, 'streaming', False):
+                response.streaming_content = _read_during(response.streaming_content, self.read_alias)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ReplicaStickinessMiddleware:
+    """Marks the user and the company of every write request, see
+    mark_write. Must come after TenantMiddleware. Works in both sync and
+    async stacks; in the async one only writes hop to a thread."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        check_shared_cache()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function for Django's handler.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self._acall(request)
+        response = self.get_response(request)
+        if self.is_write(request):
+            self.mark(request)
+        return response
+
+    async def _acall(self, request):
+        response = await self.get_response(request)
+        if self.is_write(request):
+            # the user and the tenant may need queries, the cache does I/O
+            await sync_to_async(self.mark)(request)
+        return response
+
+    def is_write(self, request):
+        return request.method not in SAFE_METHODS and bool(replica_settings()['ALIASES'])
+
+    def mark(self, request):
+        if request.user.is_authenticated:
+            company = request.tenant.company
+            mark_write(request.user.pk, company.pk if company is not None else None)
@@ -0,0 +1,63 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connections
+from django.db.models import FloatField, Q
+from django.db.models.functions import Cast, Upper
+from rest_framework.filters import SearchFilter
+
+SEARCH_CONFIG = 'russian'
+SEARCH_RANK = 'search_rank'
+
+
+def search_vector(*fields):
+    """tsvector of the fields with Russian stemming. Must stay identical to the
+    expression of the GIN indexes created by the search migrations."""
+    return SearchVector(*fields, config=SEARCH_CONFIG)
+
+
+class FullTextSearchFilter(SearchFilter):
+    """SearchFilter that runs ranked full-text and trigram search on PostgreSQL.
+
+    A view opts in with `search_vector_fields`, the fields of its tsvector
+    index, and `search_trigram_fields`, the fields with a trigram index on
+    `UPPER(field)`. A row matches when the stemmed words match, when a
+    trigram field is similar to the query or contains it as a substring;
+    every match is annotated with `search_rank` and ordered by it.
+
+    Views without these attributes and databases other than PostgreSQL get
+    the default `icontains` search over `search_fields`."""
+
+    def get_search_vector_fields(self, view, request):
+        return getattr(view, 'search_vector_fields', None)
+
+    def get_search_trigram_fields(self, view, request):
+        return getattr(view, 'search_trigram_fields', ())
+
+    def filter_queryset(self, request, queryset, view):
+        vector_fields = self.get_search_vector_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not vector_fields or not search_terms or connections[queryset.db].vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+
+        text = ' '.join(search_terms)
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        vector = search_vector(*vector_fields)
+        rank = SearchRank(vector, query)
+
+        conditions = Q(search_vector=query)
+        annotations = {'search_vector': vector}
+        for index, field in enumerate(self.get_search_trigram_fields(view, request)):
+            alias = f'search_trigram_{index}'
+            annotations[alias] = Upper(field)
+            conditions |= Q(**{f'{alias}__trigram_similar': text.upper()})
+            for term in search_terms:
+                conditions |= Q(**{f'{alias}__contains': term.upper()})
+            rank += TrigramSimilarity(alias, text.upper())
+
+        ordering = queryset.query.order_by
+        # The rank is the cursor position of ranked pages (see
+        # finance.pagination): ts_rank and similarity are real, a double
+        # compares exactly with the position read back from the cursor.
+        return queryset.alias(**annotations)\
+            .filter(conditions)\
+            .annotate(**{SEARCH_RANK: Cast(rank, FloatField())})\
+            .order_by(f'-{SEARCH_RANK}', *ordering)
@@ -37,23 +37,28 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     "corsheaders",
     'bill',
     'staff',
     'goods',
+    'mailing',
     "phonenumber_field",
     'rest_framework.authtoken',
     'django_filters',
 ]
 
 MIDDLEWARE = [
+    'finance.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'staff.middleware.TenantMiddleware',
+    'finance.replicas.ReplicaStickinessMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
@@ -86,15 +91,58 @@ WSGI_APPLICATION = 'finance.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'finance.backends.postgresql_pool',
         'NAME': os.environ['FINANCE_DB_NAME'],
         'USER': os.environ['FINANCE_DB_USER'],
         'PASSWORD': os.environ['FINANCE_DB_PASSWORD'],
         'HOST': os.environ['FINANCE_HOST_DB'],
         'PORT':  os.environ['FINANCE_DB_PORT'],
+        # connections are returned to the pool at the end of each request,
+        # see finance.backends.postgresql_pool.base
+        'POOL': {
+            'MIN_SIZE': 2,
+            'MAX_SIZE': 20,
+            'TIMEOUT': 10,
+            'MAX_LIFETIME': 1800,
+            'HEALTH_CHECK': True,
+        },
     }
 }
 
+# Streaming replicas of the default database, as comma separated host[:port]
+# (see the replica profile of docker-compose.yaml). Read-only views opt in
+# with finance.replicas.ReadReplicaMixin.
+for number, replica in enumerate(filter(None, os.environ.get('FINANCE_REPLICA_HOSTS', '').split(','))):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['finance.replicas.ReplicaRouter']
+
+# Cache shared by all workers (see the redis service of docker-compose.yaml),
+# e.g. redis://127.0.0.1:6379/0. Replicas need it for read-your-writes
+# stickiness; without it each process has its own local memory cache.
+if os.environ.get('FINANCE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['FINANCE_REDIS_URL'],
+        }
+    }
+
+# see finance.replicas.DEFAULTS
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias.startswith('replica_')],
+    'STICKY_SECONDS': 10,
+    'MAX_LAG': 30,
+    'HEALTH_CHECK_INTERVAL': 5,
+    'CACHE': 'default',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -143,14 +191,33 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        'staff.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication'
+        'staff.authentication.CachedTokenAuthentication'
     ],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend',
                                 "rest_framework.filters.OrderingFilter",
-                                "rest_framework.filters.SearchFilter"]
+                                "finance.search.FullTextSearchFilter"]
+
+}
 
+# independent queries of the async invoice endpoints (bill.async_views) run
+# in parallel on pooled connections, see finance.asynchronous; at most
+# ASYNC_MAX_OFFLOADED_QUERIES at a time per process, half of the pool by default
+ASYNC_CONCURRENT_QUERIES = True
+
+# bearer token of the Prometheus scraper for /metrics, see finance.metrics
+METRICS_TOKEN = os.environ.get('FINANCE_METRICS_TOKEN')
+
+# staff.authentication.CachedTokenAuthentication and CachedBasicAuthentication,
+# see staff.authentication.DEFAULTS
+TOKEN_AUTHENTICATION = {
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 30,
+    'SHARED_CACHE': None,
+    'EXPIRY': None,
+    'ROTATE_ON_LOGIN': False,
+    'BASIC_CACHE_TTL': 60,
 }
 
 EMAIL_HOST = 'smtp.gmail.com'
@@ -0,0 +1,140 @@
+"""Sparse fieldsets: `?fields=` and `?expand=` query parameters of safe
+requests that narrow the serializer of the response.
+
+- `fields` is a comma separated list of fields to render, nested fields
+  are named with dots: `?fields=id,status,organization.name`. A nested
+  serializer named without subfields is rendered whole.
+- `expand` lists the nested serializers to render as objects, again with
+  dots for deeper levels: `?expand=organization,payment_items.product`.
+  When it is given, the other nested serializers over model relations are
+  rendered as primary keys. Naming subfields in `fields` expands the
+  relation as well.
+
+Without either parameter responses are unchanged. The narrowed serializer
+is also what eager loading and the lean list plan are made from, so
+relations that are not rendered are not joined or prefetched either."""
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.functional import cached_property
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+from finance.lean import LeanPlan
+
+# a field named without subfields
+WHOLE = None
+
+
+def parse_paths(value):
+    """Tree of nested dicts from comma separated dotted paths, WHOLE at the
+    fields named without subfields."""
+    tree = {}
+    for path in value.split(','):
+        names = [name.strip() for name in path.split('.')]
+        if not all(names):
+            continue
+        node = tree
+        for name in names[:-1]:
+            if name in node and node[name] is WHOLE:
+                break
+            node = node.setdefault(name, {})
+        else:
+            node[names[-1]] = WHOLE
+    return tree
+
+
+def _nested(field):
+    if isinstance(field, serializers.ListSerializer):
+        field = field.child
+    return field if isinstance(field, serializers.ModelSerializer) else None
+
+
+def _primary_key_field(serializer, name, field):
+    """Read-only primary key field replacing a nested serializer, None when
+    its source is not a model relation."""
+    try:
+        relation = serializer.Meta.model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return None
+    if not relation.is_relation:
+        return None
+    source = {} if field.source == name else {'source': field.source}
+    many = relation.one_to_many or relation.many_to_many
+    return serializers.PrimaryKeyRelatedField(read_only=True, many=many, **source)
+
+
+def _unknown(parameter, prefix, names):
+    raise ValidationError({parameter: [f"Неизвестное поле: {prefix}{name}" for name in sorted(names)]})
+
+
+def prune(serializer, fields=WHOLE, expand=WHOLE, prefix=''):
+    """Removes the fields of a ModelSerializer (or of the child of a
+    ListSerializer) that are not in the `fields` tree and collapses nested
+    serializers that are not in the `expand` tree, see parse_paths. WHOLE
+    keeps all of them."""
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    readable = {name: field for name, field in serializer.fields.items() if not field.write_only}
+
+    if fields is not WHOLE:
+        unknown = {name for name, subfields in fields.items() if name not in readable
+                   or subfields is not WHOLE and _nested(readable[name]) is None}
+        if unknown:
+            _unknown('fields', prefix, unknown)
+        for name in list(serializer.fields):
+            if name not in fields:
+                del serializer.fields[name]
+    if expand is not WHOLE:
+        unknown = {name for name in expand if _nested(readable.get(name)) is None}
+        if unknown:
+            _unknown('expand', prefix, unknown)
+
+    for name, field in list(serializer.fields.items()):
+        nested = _nested(field)
+        if nested is None:
+            continue
+        subfields = WHOLE if fields is WHOLE else fields[name]
+        if expand is WHOLE:
+            subexpand = WHOLE
+        elif name in expand or subfields is not WHOLE:
+            subexpand = expand.get(name) or {}
+        else:
+            replacement = _primary_key_field(serializer, name, field)
+            if replacement is not None:
+                serializer.fields[name] = replacement
+                continue
+            subexpand = {}
+        prune(nested, subfields, subexpand, f'{prefix}{name}.')
+
+
+class SparseFieldsMixin:
+    """Viewset mixin narrowing the serializers of safe requests with the
+    `fields` and `expand` query parameters, see the module docstring."""
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    @cached_property
+    def sparse_fieldset(self):
+        """(fields, expand) trees of the request, None when it asks for
+        the whole representation."""
+        request = self.request
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        fields = request.query_params.get(self.fields_query_param)
+        expand = request.query_params.get(self.expand_query_param)
+        if fields is None and expand is None:
+            return None
+        return (WHOLE if fields is None else parse_paths(fields),
+                WHOLE if expand is None else parse_paths(expand))
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.sparse_fieldset is not None:
+            prune(serializer, *self.sparse_fieldset)
+        return serializer
+
+    def get_list_plan(self):
+        if self.sparse_fieldset is None:
+            return super().get_list_plan()
+        # narrowed plans are made per request, not cached
+        return LeanPlan(self.get_serializer())
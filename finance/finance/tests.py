@@ -0,0 +1,495 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import psycopg2
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections, transaction
+from django.db.models import Case, FloatField, Value, When
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import SimpleTestCase, TestCase, override_settings
+from psycopg2 import extensions
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from finance.asynchronous import can_run_concurrently, gather_queries
+from finance.benchmark import SKIPPED, check_coverage, iter_routes
+from finance.backends.postgresql_pool.pool import ConnectionPool, PoolTimeout
+from finance.metrics import QueryCounter, _count_query, _current_counter, _watch, registry
+from finance.pagination import TenantCursorPagination
+from finance.query_budgets import QueryRecorder
+from finance.replicas import (ReplicaRouter, ReplicaStickinessMiddleware, get_read_alias, is_sticky, read_from,
+                              replica_health)
+from finance.search import SEARCH_RANK
+from bill.models import Invoice, Organization
+from staff.models import Company, Employee
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, sql):
+        if self.connection.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.connection.queries.append(sql)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.opened = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def test_connection_is_reused(self):
+        pool = ConnectionPool(max_size=2)
+        first = pool.get(self.connect)
+        pool.put(first)
+        self.assertIs(pool.get(self.connect), first)
+        # при выдаче соединение проверяется запросом
+        self.assertEqual(first.queries, ['SELECT 1', 'SELECT 1'])
+        self.assertEqual(pool.stats()['checkouts'], 2)
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_min_size(self):
+        pool = ConnectionPool(min_size=3, max_size=5)
+        pool.get(self.connect)
+        self.assertEqual(len(self.opened), 3)
+        self.assertEqual(pool.stats()['idle'], 2)
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+    def test_broken_connection_is_replaced(self):
+        pool = ConnectionPool(max_size=1)
+        first = pool.get(self.connect)
+        pool.put(first)
+        first.broken = True
+        second = pool.get(self.connect)
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.stats()['health_check_failures'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_open_transaction_is_rolled_back(self):
+        pool = ConnectionPool(max_size=1)
+        first = pool.get(self.connect)
+        first.status = extensions.TRANSACTION_STATUS_INERROR
+        pool.put(first)
+        self.assertEqual(first.status, extensions.TRANSACTION_STATUS_IDLE)
+        self.assertIs(pool.get(self.connect), first)
+
+    def test_max_lifetime(self):
+        pool = ConnectionPool(max_size=1, max_lifetime=60)
+        with patch('finance.backends.postgresql_pool.pool.time.monotonic', return_value=1000):
+            first = pool.get(self.connect)
+        with patch('finance.backends.postgresql_pool.pool.time.monotonic', return_value=1061):
+            pool.put(first)
+            self.assertTrue(first.closed)
+            self.assertIsNot(pool.get(self.connect), first)
+
+    def test_failed_connect_releases_slots(self):
+        pool = ConnectionPool(min_size=2, max_size=2)
+
+        def refuse():
+            raise psycopg2.OperationalError('connection refused')
+
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.get(refuse)
+        self.assertEqual(pool.stats()['size'], 0)
+        # после восстановления базы пул снова открывает соединения
+        pool.get(self.connect)
+        self.assertEqual(pool.stats()['size'], 2)
+
+    def test_timeout(self):
+        pool = ConnectionPool(max_size=1, timeout=0.01)
+        pool.get(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.get(self.connect)
+        self.assertEqual(pool.stats()['waits'], 1)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_waiting_checkout_gets_returned_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=5)
+        first = pool.get(self.connect)
+        result = []
+        waiter = threading.Thread(target=lambda: result.append(pool.get(self.connect)))
+        waiter.start()
+        while pool.stats()['waits'] == 0:
+            pass
+        pool.put(first)
+        waiter.join()
+        self.assertIs(result[0], first)
+        self.assertEqual(len(self.opened), 1)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql' and hasattr(connection, 'get_pool'),
+                     'нужен PostgreSQL из docker-compose с пулом соединений')
+class PooledDatabaseTestCase(TestCase):
+    def test_connection_returned_to_pool(self):
+        # в TestCase соединение внутри транзакции, проверяем на отдельном потоке
+        raw_connections = []
+
+        def request():
+            from django.db import connections
+            with connections['default'].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            raw_connections.append(connections['default'].connection)
+            connections['default'].close()
+
+        for _ in range(2):
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+
+        self.assertIs(raw_connections[0], raw_connections[1])
+        self.assertFalse(raw_connections[0].closed)
+
+
+class GatherQueriesTestCase(SimpleTestCase):
+    def test_functions_run_concurrently(self):
+        # обе функции ждут друг друга, последовательно они бы не завершились
+        barrier = threading.Barrier(2, timeout=5)
+
+        def query(result):
+            barrier.wait()
+            return result
+
+        with patch('finance.asynchronous.can_run_concurrently', return_value=True):
+            results = async_to_sync(gather_queries)(lambda: query(1), lambda: query(2))
+        self.assertEqual(results, [1, 2])
+
+    def test_functions_run_in_order_without_concurrency(self):
+        calls = []
+        with patch('finance.asynchronous.can_run_concurrently', return_value=False):
+            results = async_to_sync(gather_queries)(lambda: calls.append(1) or 1, lambda: calls.append(2) or 2)
+        self.assertEqual(results, [1, 2])
+        self.assertEqual(calls, [1, 2])
+
+    def test_single_function_runs_inline(self):
+        with patch('finance.asynchronous.can_run_concurrently') as can_run_concurrently:
+            results = async_to_sync(gather_queries)(threading.get_ident)
+        can_run_concurrently.assert_not_called()
+        # поток запроса, а не отдельное соединение
+        self.assertEqual(results, [async_to_sync(sync_to_async(threading.get_ident))()])
+
+    @override_settings(ASYNC_MAX_OFFLOADED_QUERIES=1)
+    def test_offloaded_queries_are_capped(self):
+        lock, active, peak = threading.Lock(), [0], [0]
+
+        def query(result):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return result
+
+        with patch('finance.asynchronous.can_run_concurrently', return_value=True):
+            results = async_to_sync(gather_queries)(*(lambda number=number: query(number) for number in range(4)))
+        self.assertEqual(results, [0, 1, 2, 3])
+        # поток запроса и одно дополнительное соединение
+        self.assertEqual(peak[0], 2)
+
+    @override_settings(ASYNC_CONCURRENT_QUERIES=True)
+    def test_no_concurrency_in_transaction(self):
+        connection = connections['default']
+        with patch.object(type(connection), 'vendor', 'postgresql'):
+            self.assertTrue(can_run_concurrently())
+            with patch.object(connection, 'in_atomic_block', True):
+                self.assertFalse(can_run_concurrently())
+
+
+class CursorPaginationTestCase(TestCase):
+    def test_ranked_pages_with_tied_ranks(self):
+        company = Company.objects.create(name="test")
+        organization = Organization.objects.create(company=company, name="name", taxes_number="taxes_number",
+                                                   address="address", phone_number="+376291234567",
+                                                   email="email@mail.com", description="description")
+        invoices = Invoice.objects.bulk_create(Invoice(type=Invoice.INCOME, organization=organization,
+                                                       company=company) for _ in range(7))
+        # ранги как у поиска: дробные, многие совпадают
+        queryset = Invoice.objects.annotate(**{SEARCH_RANK: Case(
+            When(id__in=[invoice.id for invoice in invoices[::3]], then=Value(1 / 3)),
+            default=Value(0.1), output_field=FloatField())}).order_by(f'-{SEARCH_RANK}')
+        view = SimpleNamespace(filter_backends=[])
+        factory = APIRequestFactory()
+
+        ids, url = [], '/api/invoices/?page_size=2'
+        while url:
+            paginator = TenantCursorPagination()
+            request = Request(factory.get(url))
+            ids.extend(invoice.id for invoice in paginator.paginate_queryset(queryset, request, view))
+            url = paginator.get_next_link()
+        # каждый счет ровно один раз: сначала лучший ранг, при равных - новые
+        expected = sorted(invoices, key=lambda invoice: (invoice not in invoices[::3], -invoice.id))
+        self.assertEqual(ids, [invoice.id for invoice in expected])
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        registry.reset()
+        User = get_user_model()
+        self.user = User.objects.create_user('test', 'test@mail.com', 'testingpassword')
+        Employee.objects.create(position="position", company=Company.objects.create(name="test"),
+                                user=self.user)
+        self.client = APIClient()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_metrics_per_view(self):
+        self.client.get("/api/invoices/")
+        self.client.get("/api/invoices/stats")
+        admin = get_user_model().objects.create_superuser('admin', 'admin@mail.com', 'testingpassword')
+        self.client.force_authenticate(admin)
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn('finance_http_requests_total{view="InvoiceViewSet.list",method="GET",status="200"} 1', body)
+        self.assertIn('finance_http_request_duration_seconds_count{view="InvoiceViewSet.stats_invoices",'
+                      'method="GET"} 1', body)
+        self.assertIn('finance_http_request_duration_seconds_bucket{view="InvoiceViewSet.list",'
+                      'method="GET",le="+Inf"} 1', body)
+        # запросы к базе посчитаны для каждого эндпоинта
+        line = next(line for line in body.splitlines()
+                    if line.startswith('finance_http_sql_queries_total{view="InvoiceViewSet.list"'))
+        self.assertGreater(int(line.split()[-1]), 0)
+
+    async def test_async_requests(self):
+        # асинхронный стек не переключается в поток, запросы к базе посчитаны
+        response = await self.async_client.get(reverse('async-invoices-list'),
+                                               authorization='Token ' + self.token.key)
+        self.assertEqual(response.status_code, 200)
+        body = await sync_to_async(registry.render)()
+        line = next(line for line in body.splitlines()
+                    if line.startswith('finance_http_sql_queries_total{view="InvoiceViewSet.list.async"'))
+        self.assertGreater(int(line.split()[-1]), 0)
+
+    @override_settings(ASYNC_CONCURRENT_QUERIES=True)
+    def test_worker_thread_queries(self):
+        # запросы gather_queries из других потоков тоже идут в счетчик запроса
+        def query():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return threading.get_ident()
+
+        counter = QueryCounter()
+        token = _current_counter.set(counter)
+        try:
+            with patch('finance.asynchronous.can_run_concurrently', return_value=True):
+                threads = async_to_sync(gather_queries)(query, query, query)
+        finally:
+            _current_counter.reset(token)
+        self.assertGreater(len(set(threads)), 1)
+        self.assertEqual(counter.queries, 3)
+
+    def test_counter_installed_inside_execute_wrapper(self):
+        # соединение открылось внутри блока execute_wrapper(): блок убирает свою обертку, а не счетчик
+        self.addCleanup(setattr, connection, 'execute_wrappers', list(connection.execute_wrappers))
+        connection.execute_wrappers[:] = [wrapper for wrapper in connection.execute_wrappers
+                                          if wrapper is not _count_query]
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            _watch(connection)
+            Company.objects.count()
+        self.assertEqual(connection.execute_wrappers, [_count_query])
+        # счетчик не заслоняет место вызова в отчетах бюджетов запросов
+        self.assertIn('finance/tests.py', recorder.queries[0][1])
+
+    def test_unknown_methods_share_label(self):
+        for method in ('PROPFIND', 'BREW', 'X-RANDOM'):
+            self.client.generic(method, "/api/invoices/")
+        body = registry.render()
+        self.assertIn('finance_http_requests_total{view="InvoiceViewSet.other",method="other",status="405"} 3', body)
+        self.assertNotIn('BREW', body)
+
+    @override_settings(METRICS_TOKEN='scraper-token')
+    def test_metrics_access(self):
+        # обычный пользователь метрики не видит
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer scraper-token')
+        self.assertEqual(client.get("/metrics").status_code, 200)
+        client.credentials(HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertIn(client.get("/metrics").status_code, (401, 403))
+
+
+class BenchmarkCoverageTestCase(SimpleTestCase):
+    def test_every_route_has_scenario(self):
+        # новый эндпоинт без сценария нагрузки не пройдет
+        self.assertEqual(check_coverage(), [])
+        routes = set(iter_routes())
+        for route in SKIPPED:
+            self.assertIn(route, routes)
+
+
+# stickiness needs a cache shared by processes
+REPLICA_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'replicas': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                 'LOCATION': os.path.join(tempfile.gettempdir(), 'finance-tests-replicas')},
+}
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': 10, 'MAX_LAG': 30,
+                                  'HEALTH_CHECK_INTERVAL': 60, 'CACHE': 'replicas'},
+                   CACHES=REPLICA_CACHES)
+class ReadReplicaTestCase(TestCase):
+    """The replica alias does not exist here: the router only records where
+    reads would go and keeps them on default."""
+
+    def setUp(self):
+        caches['replicas'].clear()
+        replica_health.reset()
+        User = get_user_model()
+        company = Company.objects.create(name="test")
+        self.user = User.objects.create_user('test', 'test@mail.com', 'testingpassword')
+        self.colleague = User.objects.create_user('colleague', 'colleague@mail.com', 'testingpassword')
+        for user in (self.user, self.colleague):
+            Employee.objects.create(position="position", company=company, user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+
+        self.routed = []
+
+        def record(router, model, **hints):
+            self.routed.append(get_read_alias())
+            return None
+
+        for target in (patch.object(ReplicaRouter, 'db_for_read', autospec=True, side_effect=record),
+                       patch.object(replica_health, 'get_lag', return_value=0)):
+            target.start()
+            self.addCleanup(target.stop)
+
+    def test_read_actions_go_to_replica(self):
+        self.assertEqual(self.client.get("/api/invoices/").status_code, 200)
+        self.assertIn('replica', self.routed)
+        self.routed.clear()
+        # действие без отметки читает из основной базы
+        self.assertEqual(self.client.get("/api/invoices/review").status_code, 200)
+        self.assertNotIn('replica', self.routed)
+
+    def test_streamed_report_reads_from_replica(self):
+        response = self.client.get("/api/invoices/invoices-report")
+        self.routed.clear()
+        b''.join(response.streaming_content)
+        self.assertEqual(set(self.routed), {'replica'})
+
+    def test_reads_stick_to_primary_after_write(self):
+        response = self.client.post("/api/organizations/", {
+            "name": "organization", "taxes_number": "taxes_number", "address": "address",
+            "phone_number": "+375291234567", "email": "email@mail.com", "description": "description",
+            "bank_detail": {"name": "bank", "address": "address", "bank_number": "number",
+                            "settlement_account": "account"}},
+            format='json')
+        self.assertEqual(response.status_code, 201)
+        self.routed.clear()
+        self.client.get("/api/organizations/")
+        self.assertNotIn('replica', self.routed)
+
+        # коллеги из той же компании тоже видят запись
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.colleague).key)
+        client.get("/api/organizations/")
+        self.assertNotIn('replica', self.routed)
+
+        caches['replicas'].clear()
+        self.client.get("/api/organizations/")
+        self.assertIn('replica', self.routed)
+
+    async def test_async_write_is_sticky(self):
+        token = await sync_to_async(lambda: Token.objects.get(user=self.user).key)()
+        response = await self.async_client.post("/api/organizations/", {"name": ""},
+                                                content_type='application/json',
+                                                authorization='Token ' + token)
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(await sync_to_async(is_sticky)(self.user.pk))
+
+    def test_local_cache_is_refused(self):
+        # липкость в памяти одного процесса не работает
+        with override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'CACHE': 'default'}):
+            with self.assertRaises(ImproperlyConfigured):
+                ReplicaStickinessMiddleware(lambda request: None)
+
+    def test_unhealthy_replica_falls_back_to_primary(self):
+        replica_health.get_lag.return_value = None
+        self.assertEqual(self.client.get("/api/invoices/").status_code, 200)
+        self.assertNotIn('replica', self.routed)
+
+        # отставание больше MAX_LAG
+        replica_health.reset()
+        replica_health.get_lag.return_value = 120
+        with self.assertLogs('finance.replicas', 'WARNING'):
+            self.client.get("/api/invoices/")
+        self.assertNotIn('replica', self.routed)
+
+        # результат проверки хранится HEALTH_CHECK_INTERVAL секунд
+        replica_health.get_lag.return_value = 0
+        self.client.get("/api/invoices/")
+        self.assertNotIn('replica', self.routed)
+
+
+class ReplicaRouterTestCase(TestCase):
+    def test_transactions_read_from_primary(self):
+        router = ReplicaRouter()
+        with read_from('replica'):
+            self.assertEqual(router.db_for_read(Invoice), 'replica')
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(Invoice))
+        self.assertIsNone(router.db_for_read(Invoice))
+        self.assertEqual(router.db_for_write(Invoice), 'default')
+
+    @override_settings(READ_REPLICAS={'ALIASES': ['replica']})
+    def test_no_migrations_on_replicas(self):
+        self.assertFalse(ReplicaRouter().allow_migrate('replica', 'bill'))
+        self.assertIsNone(ReplicaRouter().allow_migrate('default', 'bill'))
+
+
+@unittest.skipUnless('replica_0' in settings.DATABASES, 'нужна реплика в FINANCE_REPLICA_HOSTS')
+class ReplicaDatabaseTestCase(TestCase):
+    databases = '__all__'
+
+    def test_replica_is_healthy(self):
+        replica_health.reset()
+        self.assertTrue(replica_health.is_healthy('replica_0'))
+        with read_from('replica_0'):
+            self.assertEqual(Company.objects.db, 'replica_0')
@@ -16,10 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from finance.metrics import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('staff.urls')),
     path('api/', include('goods.urls')),
     path('api/', include('bill.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 
 ]
@@ -15,5 +15,4 @@ class ProductAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        company = request.user.employee.company
-        return qs.filter(company=company)
+        return request.tenant.filter(qs)
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.2 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0002_product_company'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['company', 'name'], name='product_company_name_idx'),
+        ),
+    ]
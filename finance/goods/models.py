@@ -1,10 +1,13 @@
 from django.db import models
 
+from finance.conditional import SET_NULL_AND_TOUCH
 from staff.models import Company
 
 
 class Category(models.Model):
     name = models.CharField(max_length=200, verbose_name="Название категории продукта или услуги")
+    # validator of conditional GET requests, see finance.conditional
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.id} {self.name}"
@@ -13,9 +16,17 @@ class Category(models.Model):
 class Product(models.Model):
     name = models.CharField(max_length=200, verbose_name="Название продукта или услуги")
     description = models.TextField()
-    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
+    category = models.ForeignKey(Category, on_delete=SET_NULL_AND_TOUCH, null=True)
     producer = models.CharField(max_length=200, verbose_name="Производителель продукта или услуги")
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    # validator of conditional GET requests, see finance.conditional
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # tenant lists ordered or looked up by name
+            models.Index(fields=['company', 'name'], name='product_company_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.id} {self.name} {self.producer}"
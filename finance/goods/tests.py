@@ -1,11 +1,19 @@
+import unittest
+from types import SimpleNamespace
+
 from django.contrib.auth import get_user_model
+from urllib.parse import urlencode
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
+from finance.query_budgets import QueryBudget, QueryBudgetMixin
 from goods.models import Category, Product
 from staff.models import Company, Employee
 
@@ -66,14 +74,33 @@ class ProductTestCase(TestCase):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data[0]["name"], test_product.name)
-        self.assertEqual(response.data[0]["description"],
+        self.assertEqual(response.data["results"][0]["name"], test_product.name)
+        self.assertEqual(response.data["results"][0]["description"],
                          test_product.description)
-        self.assertEqual(response.data[0]["producer"],
+        self.assertEqual(response.data["results"][0]["producer"],
                          test_product.producer)
-        self.assertEqual(response.data[0]["category"]["name"],
+        self.assertEqual(response.data["results"][0]["category"]["name"],
                          test_category.name)
 
+    def test_product_sparse_fields(self):
+        test_category = Category.objects.create(name="test_category")
+        test_product = Product.objects.create(name="test", description="test desc",
+                                              category=test_category, producer="test",
+                                              company=self.company)
+        url = reverse('product-list-create')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        # без expand категория отдается ключом и не присоединяется к странице товаров
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {"fields": "id,category", "expand": ""}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [{"id": test_product.id, "category": test_category.id}])
+        self.assertFalse([query for query in context.captured_queries
+                          if 'JOIN "goods_category"' in query["sql"] and "COUNT(" not in query["sql"]])
+
+        response = self.client.get(reverse('product-delete-update', args=[test_product.id]),
+                                   {"fields": "name,category.name"}, format='json')
+        self.assertEqual(response.data, {"name": test_product.name, "category": {"name": test_category.name}})
+
     def test_update_product(self):
         test_category = Category.objects.create(name="test_category")
         test_product = Product.objects.create(name="test", description="test desc",
@@ -104,3 +131,66 @@ class ProductTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         product = Product.objects.filter(id=test_product.id)
         self.assertEqual(len(product), 0)
+
+    def create_search_products(self):
+        category = Category.objects.create(name="Бухгалтерия")
+        names = [("Аудит отчетности", "Проверка бухгалтерских счетов"),
+                 ("Консультация", "Консультации по налогам"),
+                 ("Доставка", "Доставка документов курьером")]
+        for name, description in names:
+            Product.objects.create(name=name, description=description, category=category,
+                                   producer="test", company=self.company)
+
+    def search_products(self, query):
+        url = reverse('product-list-create') + '?' + urlencode({'search': query})
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product["name"] for product in response.data["results"]]
+
+    def test_search_product(self):
+        # поиск по подстроке названия продукта и категории работает на любой базе
+        self.create_search_products()
+        self.assertEqual(self.search_products("Аудит"), ["Аудит отчетности"])
+        self.assertEqual(len(self.search_products("Бухгалт")), 3)
+        self.assertEqual(self.search_products("ремонт"), [])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'полнотекстовый поиск есть только в PostgreSQL')
+    def test_search_product_full_text(self):
+        # слова ищутся с учетом морфологии, результаты упорядочены по релевантности
+        self.create_search_products()
+        self.assertEqual(self.search_products("налог"), ["Консультация"])
+        self.assertEqual(self.search_products("документ курьер"), ["Доставка"])
+        self.assertEqual(self.search_products("Консультацыя"), ["Консультация"])
+
+
+def product_data(rows):
+    return {"name": "name", "description": "description", "producer": "producer", "category": rows.category.id}
+
+
+class GoodsQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    urlconf = 'goods.urls'
+    budgets = [
+        QueryBudget('GET', 'products/', 3),
+        QueryBudget('GET', 'products/', 3, query=lambda rows: {"search": "product"}),
+        QueryBudget('POST', 'products/', 5, data=product_data),
+        QueryBudget('GET', 'products/<int:pk>', 3, kwargs=lambda rows: {"pk": rows.product.id}),
+        QueryBudget('PUT', 'products/<int:pk>', 4, kwargs=lambda rows: {"pk": rows.product.id}, data=product_data),
+        QueryBudget('DELETE', 'products/<int:pk>', 4, kwargs=lambda rows: {"pk": rows.product.id}),
+        QueryBudget('GET', 'categories/', 3),
+        QueryBudget('POST', 'categories/', 2, data=lambda rows: {"name": "category"}),
+        QueryBudget('GET', 'categories/<int:pk>', 3, kwargs=lambda rows: {"pk": rows.category.id}),
+        QueryBudget('PUT', 'categories/<int:pk>', 3, kwargs=lambda rows: {"pk": rows.category.id},
+                    data=lambda rows: {"name": "category"}),
+        QueryBudget('DELETE', 'categories/<int:pk>', 6, kwargs=lambda rows: {"pk": rows.category.id}),
+    ]
+
+    def create_rows(self, count):
+        # count категорий и count продуктов, у каждого своя категория
+        rows = SimpleNamespace()
+        categories = Category.objects.bulk_create(Category(name=f"category {i}") for i in range(count))
+        products = Product.objects.bulk_create(
+            Product(name=f"product {i}", description="description", category=category, producer="producer",
+                    company=self.company) for i, category in enumerate(categories))
+        rows.category, rows.product = categories[0], products[0]
+        return rows
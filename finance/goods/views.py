@@ -5,19 +5,34 @@ from rest_framework.response import Response
 
 from goods.models import Product, Category
 from goods.serializers import ProductSerializer, CategorySerializer
+from finance.conditional import ConditionalGetMixin
+from finance.eager_loading import EagerLoadingMixin
+from finance.lean import LeanListMixin
+from finance.pagination import TenantCursorPagination
+from finance.replicas import ReadReplicaMixin
+from finance.sparse_fields import SparseFieldsMixin
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ReadReplicaMixin, ConditionalGetMixin, SparseFieldsMixin, LeanListMixin, EagerLoadingMixin,
+                     viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     search_fields = ["name", "category__name"]
+    search_vector_fields = ["name", "description"]
+    search_trigram_fields = ["name", "category__name"]
+    ordering = ['id']
+    ordering_fields = ['id', 'name']
+    pagination_class = TenantCursorPagination
+    read_replica_actions = ('list', 'retrieve')
+    lean_list = True
+    conditional_fields = ('updated_at', 'category__updated_at')
 
     def get_queryset(self):
-        return super().get_queryset().filter(company=self.request.user.employee.company)
+        return self.request.tenant.filter(super().get_queryset())
 
     def create(self, request, *args, **kwargs):
         category = get_object_or_404(Category, id=request.data.get('category'))
-        # if not Product.objects.filter(category=category, company=request.user.employee.company).exists():
+        # if not Product.objects.filter(category=category, company=request.tenant.company).exists():
         #     raise ValidationError('Нужно выбрать категорию нужной компании!')
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -40,6 +55,6 @@ class ProductViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, SparseFieldsMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from mailing.services.outbox import deliver_pending_emails
+
+
+class Command(BaseCommand):
+    help = "Отправляет письма из очереди исходящих писем"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Сколько писем отправлять через одно SMTP соединение")
+        parser.add_argument('--interval', type=float, default=5,
+                            help="Пауза в секундах, когда очередь пуста")
+        parser.add_argument('--once', action='store_true',
+                            help="Отправить одну пачку писем и завершиться")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            processed = deliver_pending_emails(options['batch_size'])
+            if processed:
+                self.stdout.write(f"Обработано писем: {processed}")
+            if options['once']:
+                break
+            if processed < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.2 on 2026-10-18 20:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=300, verbose_name='Тема письма')),
+                ('body', models.TextField(verbose_name='Текст письма')),
+                ('from_email', models.CharField(max_length=300, verbose_name='Отправитель')),
+                ('recipients', models.JSONField(verbose_name='Получатели')),
+                ('status', models.CharField(choices=[('В очереди', 'В очереди'), ('Отправлено', 'Отправлено'), ('Ошибка', 'Ошибка')], default='В очереди', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Количество попыток отправки')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='outgoing_email_queue_idx'),
+        ),
+    ]
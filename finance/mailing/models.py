@@ -0,0 +1,36 @@
+from django.db import models
+from django.utils import timezone
+
+
+class OutgoingEmail(models.Model):
+    """Email written to the outbox inside the request transaction and
+    delivered later by the `send_emails` worker."""
+    PENDING = 'В очереди'
+    SENT = 'Отправлено'
+    FAILED = 'Ошибка'
+
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Ошибка'),
+    ]
+    subject = models.CharField(max_length=300, verbose_name='Тема письма')
+    body = models.TextField(verbose_name='Текст письма')
+    from_email = models.CharField(max_length=300, verbose_name='Отправитель')
+    recipients = models.JSONField(verbose_name='Получатели')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Количество попыток отправки')
+    last_error = models.TextField(blank=True, default='', verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # the body holds credentials and is erased once the email is sent or failed
+    sensitive = models.BooleanField(default=False, verbose_name='Содержит секретные данные')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outgoing_email_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id} {self.subject} {self.status}"
@@ -0,0 +1,94 @@
+import datetime
+
+from django.core.mail import EmailMessage, get_connection
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from finance import settings
+from mailing.models import OutgoingEmail
+
+MAX_ATTEMPTS = 5
+# Delay before the second attempt, doubled after every next failure.
+RETRY_DELAY = datetime.timedelta(minutes=1)
+# Claimed emails are due again after this long, in case the worker died
+# while sending them.
+LEASE = datetime.timedelta(minutes=10)
+REDACTED_BODY = '[текст удален после отправки]'
+
+
+def enqueue_mail(subject, message, recipient_list, from_email=None, sensitive=False):
+    """Writes an email to the outbox. Call it inside the transaction of the
+    change the email is about, so the email exists only if the change does.
+    The body of a `sensitive` email is erased once it is sent or failed."""
+    return OutgoingEmail.objects.create(subject=subject, body=message,
+                                        from_email=from_email or settings.EMAIL_HOST_USER,
+                                        recipients=list(recipient_list), sensitive=sensitive)
+
+
+def enqueue_mails(messages, from_email=None):
+    """Writes many emails to the outbox with one insert. `messages` are
+    (subject, message, recipient_list) tuples."""
+    return OutgoingEmail.objects.bulk_create([
+        OutgoingEmail(subject=subject, body=message,
+                      from_email=from_email or settings.EMAIL_HOST_USER,
+                      recipients=list(recipient_list))
+        for subject, message, recipient_list in messages])
+
+
+def _mark_failed(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutgoingEmail.FAILED
+    else:
+        email.next_attempt_at = now + RETRY_DELAY * 2 ** (email.attempts - 1)
+
+
+@atomic
+def _claim_pending_emails(batch_size, now):
+    emails = list(OutgoingEmail.objects.select_for_update(skip_locked=True)
+                  .filter(status=OutgoingEmail.PENDING, next_attempt_at__lte=now)
+                  .order_by('next_attempt_at')[:batch_size])
+    if emails:
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in emails]).update(next_attempt_at=now + LEASE)
+    return emails
+
+
+def deliver_pending_emails(batch_size=100):
+    """Sends up to `batch_size` due emails over one SMTP connection and
+    records the outcome of each of them. Emails are claimed with SKIP LOCKED
+    and a LEASE in a short transaction, so several workers can drain the
+    outbox at the same time without holding row locks while SMTP talks."""
+    now = timezone.now()
+    emails = _claim_pending_emails(batch_size, now)
+    if not emails:
+        return 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        for email in emails:
+            _mark_failed(email, exc, now)
+    else:
+        try:
+            for email in emails:
+                message = EmailMessage(email.subject, email.body, email.from_email,
+                                       email.recipients, connection=connection)
+                try:
+                    message.send()
+                except Exception as exc:
+                    _mark_failed(email, exc, now)
+                else:
+                    email.attempts += 1
+                    email.status = OutgoingEmail.SENT
+                    email.sent_at = timezone.now()
+        finally:
+            connection.close()
+
+    for email in emails:
+        if email.sensitive and email.status != OutgoingEmail.PENDING:
+            email.body = REDACTED_BODY
+    OutgoingEmail.objects.bulk_update(emails, ['status', 'attempts', 'last_error',
+                                               'next_attempt_at', 'sent_at', 'body'])
+    return len(emails)
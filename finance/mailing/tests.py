@@ -0,0 +1,82 @@
+from smtplib import SMTPException
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.test import TestCase
+from django.utils import timezone
+
+from mailing.models import OutgoingEmail
+from mailing.services.outbox import enqueue_mail, deliver_pending_emails, MAX_ATTEMPTS, REDACTED_BODY
+
+
+class OutboxTestCase(TestCase):
+    def test_deliver_pending_emails(self):
+        for number in range(3):
+            enqueue_mail('Тема', f'Письмо {number}', [f'test{number}@mail.com'])
+        # письма только записываются в очередь, ничего не отправляется
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(deliver_pending_emails(batch_size=10), 3)
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ['test0@mail.com'])
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), 3)
+        self.assertEqual(deliver_pending_emails(batch_size=10), 0)
+
+    @patch("mailing.services.outbox.EmailMessage.send")
+    def test_retry_with_backoff(self, send):
+        send.side_effect = SMTPException("connection lost")
+        email = enqueue_mail('Тема', 'Письмо', ['test@mail.com'])
+
+        deliver_pending_emails()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, "connection lost")
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        # письмо, время повторной отправки которого не наступило, не отправляется
+        self.assertEqual(deliver_pending_emails(), 0)
+
+        for _ in range(MAX_ATTEMPTS - 1):
+            OutgoingEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            deliver_pending_emails()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.FAILED)
+        self.assertEqual(email.attempts, MAX_ATTEMPTS)
+
+    def test_sensitive_body_erased(self):
+        sent = enqueue_mail('Приглашение', 'Пароль - secret', ['test@mail.com'], sensitive=True)
+        failed = enqueue_mail('Приглашение', 'Пароль - secret', ['fail@mail.com'], sensitive=True)
+        plain = enqueue_mail('Тема', 'Письмо', ['test@mail.com'])
+        OutgoingEmail.objects.filter(pk=failed.pk).update(attempts=MAX_ATTEMPTS - 1)
+
+        def send(message, *args, **kwargs):
+            if message.to == ['fail@mail.com']:
+                raise SMTPException("mailbox unavailable")
+            return 1
+        with patch.object(EmailMessage, 'send', autospec=True, side_effect=send):
+            deliver_pending_emails()
+
+        # после отправки или последней ошибки пароль в базе не хранится
+        for email, status in ((sent, OutgoingEmail.SENT), (failed, OutgoingEmail.FAILED)):
+            email.refresh_from_db()
+            self.assertEqual(email.status, status)
+            self.assertEqual(email.body, REDACTED_BODY)
+        plain.refresh_from_db()
+        self.assertEqual(plain.body, 'Письмо')
+
+    def test_emails_claimed_while_sending(self):
+        email = enqueue_mail('Тема', 'Письмо', ['test@mail.com'])
+        leased = []
+
+        def send(*args, **kwargs):
+            # пока идет отправка, письмо не достанется другому обработчику
+            leased.append(OutgoingEmail.objects.filter(pk=email.pk, next_attempt_at__lte=timezone.now()).exists())
+            return 1
+        with patch("mailing.services.outbox.EmailMessage.send", side_effect=send):
+            self.assertEqual(deliver_pending_emails(), 1)
+        self.assertEqual(leased, [False])
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.SENT)
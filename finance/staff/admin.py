@@ -12,8 +12,7 @@ class EmployeeAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        company = request.user.employee.company
-        return qs.filter(company=company)
+        return request.tenant.filter(qs)
 
     @admin.display(empty_value='-')
     def email_view(self, obj):
@@ -24,8 +23,7 @@ class EmployeeAdmin(admin.ModelAdmin):
 class CompanyAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        company = request.user.employee.company
-        return qs.filter(id=company.id)
+        return request.tenant.filter(qs, 'id')
 
     readonly_fields = ('bank_detail', )
 
@@ -43,8 +41,9 @@ class BankDetailsAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        company = request.user.employee.company
-
+        company = request.tenant.company
+        if company is None:
+            return qs.none()
         return qs.filter(Q(organization__company=company) | Q(company=company))
 
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class StaffConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'staff'
+
+    def ready(self):
+        from staff import signals  # noqa: F401
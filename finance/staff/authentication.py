@@ -0,0 +1,244 @@
+import datetime
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+DEFAULTS = {
+    # in-process cache, per worker
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 30,
+    # verified basic auth credentials, per worker and in the shared cache
+    'BASIC_CACHE_SIZE': 10000,
+    'BASIC_CACHE_TTL': 60,
+    # alias of a Django cache shared by all workers, None to disable
+    'SHARED_CACHE': None,
+    'SHARED_CACHE_TTL': 300,
+    # token lifetime in seconds, None for tokens that never expire
+    'EXPIRY': None,
+    # issue a new token on every login, revoking the previous one
+    'ROTATE_ON_LOGIN': False,
+}
+
+
+def auth_settings():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_AUTHENTICATION', {})}
+
+
+class TTLCache:
+    """Bounded in-process LRU mapping whose entries expire after `ttl` seconds.
+
+    Values are stored as given, callers store pickled payloads so that every
+    hit builds fresh objects instead of sharing instances between threads."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CredentialCache:
+    """In-process TTLCache in front of an optional shared Django cache.
+
+    Keys are digests, so raw credentials never reach the shared cache.
+    Invalidation clears both layers in the calling process; the in-process
+    layer of other workers keeps a revoked entry for at most its TTL."""
+
+    def __init__(self, prefix, size_setting='CACHE_SIZE', ttl_setting='CACHE_TTL',
+                 shared_ttl_setting='SHARED_CACHE_TTL'):
+        self.prefix = prefix
+        self.size_setting = size_setting
+        self.ttl_setting = ttl_setting
+        self.shared_ttl_setting = shared_ttl_setting
+        self._local = None
+        self._local_lock = threading.Lock()
+
+    def _get_local(self):
+        options = auth_settings()
+        size, ttl = options[self.size_setting], options[self.ttl_setting]
+        with self._local_lock:
+            if self._local is None or (self._local.max_size, self._local.ttl) != (size, ttl):
+                self._local = TTLCache(size, ttl)
+            return self._local
+
+    def _get_shared(self):
+        alias = auth_settings()['SHARED_CACHE']
+        return caches[alias] if alias else None
+
+    def make_key(self, digest):
+        return f'{self.prefix}:{digest}'
+
+    def get(self, digest):
+        key = self.make_key(digest)
+        local = self._get_local()
+        payload = local.get(key)
+        if payload is None:
+            shared = self._get_shared()
+            if shared is None:
+                return None
+            payload = shared.get(key)
+            if payload is None:
+                return None
+            local.set(key, payload)
+        return pickle.loads(payload)
+
+    def set(self, digest, value):
+        key = self.make_key(digest)
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._get_local().set(key, payload)
+        shared = self._get_shared()
+        if shared is not None:
+            shared.set(key, payload, auth_settings()[self.shared_ttl_setting])
+
+    def delete(self, digest):
+        key = self.make_key(digest)
+        self._get_local().delete(key)
+        shared = self._get_shared()
+        if shared is not None:
+            shared.delete(key)
+
+    def clear(self):
+        self._get_local().clear()
+
+
+token_cache = CredentialCache('auth-token')
+basic_cache = CredentialCache('auth-basic', 'BASIC_CACHE_SIZE', 'BASIC_CACHE_TTL', 'BASIC_CACHE_TTL')
+
+
+def get_token_digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def is_token_expired(token):
+    expiry = auth_settings()['EXPIRY']
+    if expiry is None:
+        return False
+    return token.created + datetime.timedelta(seconds=expiry) <= timezone.now()
+
+
+def invalidate_tokens(keys):
+    for key in keys:
+        token_cache.delete(get_token_digest(key))
+
+
+def issue_token(user):
+    """Token returned by the login view. An expired token is replaced, and
+    with ROTATE_ON_LOGIN every login replaces the previous token."""
+    token = Token.objects.filter(user=user).first()
+    if token is not None and (auth_settings()['ROTATE_ON_LOGIN'] or is_token_expired(token)):
+        token.delete()
+        token = None
+    if token is None:
+        token = Token.objects.create(user=user)
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in TokenAuthentication that caches the token together with its
+    user, employee, company and bank details.
+
+    A miss loads all of them with one joined query, a hit makes no query at
+    all, and request.tenant reuses the cached employee. Entries are dropped
+    when the token is deleted, when the user is saved and when the
+    employee, the company or its bank details are saved or deleted (see
+    staff.signals). Optional expiry is
+    configured with settings.TOKEN_AUTHENTICATION['EXPIRY']."""
+
+    def get_token(self, key):
+        digest = get_token_digest(key)
+        token = token_cache.get(digest)
+        if token is None:
+            try:
+                token = Token.objects.select_related('user__employee__company__bank_detail').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            token_cache.set(digest, token)
+        return token
+
+    def authenticate_credentials(self, key):
+        token = self.get_token(key)
+
+        if is_token_expired(token):
+            Token.objects.filter(key=token.key).delete()
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
+
+
+def get_credentials_digest(userid, password):
+    return salted_hmac('staff.authentication.basic', f'{userid}\0{password}').hexdigest()
+
+
+def get_password_digest(user):
+    return salted_hmac('staff.authentication.password', user.password).hexdigest()
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """BasicAuthentication that runs the password hasher once per TTL.
+
+    Verified credentials are remembered under a keyed digest (HMAC with
+    SECRET_KEY) of the user id and password, together with a digest of the
+    user's password hash. A repeated request only loads the user, with its
+    employee and company, and compares the digests: a password change or
+    deactivation makes it fall back to the full check."""
+
+    def authenticate_credentials(self, userid, password, request=None):
+        digest = get_credentials_digest(userid, password)
+        cached = basic_cache.get(digest)
+        if cached is not None:
+            user_id, password_digest = cached
+            user = get_user_model().objects.select_related('employee__company__bank_detail')\
+                .filter(pk=user_id).first()
+            if user is not None and user.is_active \
+                    and constant_time_compare(get_password_digest(user), password_digest):
+                return (user, None)
+            basic_cache.delete(digest)
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        basic_cache.set(digest, (user.pk, get_password_digest(user)))
+        return (user, auth)
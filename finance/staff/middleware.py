@@ -0,0 +1,79 @@
+import asyncio
+
+from django.contrib.auth import get_user_model
+
+from staff.models import Employee
+
+
+class TenantContext:
+    """Employee and company of the user making the request.
+
+    The employee is loaded on first access together with its company and
+    bank details in one joined query, or taken from the user when the
+    authentication already loaded it. The user is read when the context is
+    accessed rather than when the request comes in, because token
+    authentication only happens inside DRF views."""
+
+    def __init__(self, request):
+        self._request = request
+        self._user = None
+        self._employee = None
+
+    @staticmethod
+    def _load_employee(user):
+        if not user.is_authenticated:
+            return None
+        relation = get_user_model()._meta.get_field('employee')
+        if relation.is_cached(user):
+            employee = relation.get_cached_value(user)
+            if employee is None or Employee._meta.get_field('company').is_cached(employee):
+                return employee
+        try:
+            employee = Employee.objects.select_related('company__bank_detail').get(user=user)
+        except Employee.DoesNotExist:
+            employee = None
+        relation.set_cached_value(user, employee)
+        if employee is not None:
+            employee.user = user
+        return employee
+
+    @property
+    def employee(self):
+        user = self._request.user
+        if user is not self._user:
+            self._user = user
+            self._employee = self._load_employee(user)
+        return self._employee
+
+    @property
+    def company(self):
+        employee = self.employee
+        return employee.company if employee is not None else None
+
+    def filter(self, queryset, lookup='company'):
+        """Restricts the queryset to the tenant's rows, users without a
+        company get none."""
+        company = self.company
+        if company is None:
+            return queryset.none()
+        return queryset.filter(**{lookup: company.pk})
+
+
+class TenantMiddleware:
+    """Exposes the tenant of the request as `request.tenant`.
+
+    Must come after AuthenticationMiddleware. Works in both sync and async
+    stacks without a thread hop, since it makes no query itself."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function for Django's handler.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        request.tenant = TenantContext(request)
+        # in an async stack this returns the coroutine awaited by the caller
+        return self.get_response(request)
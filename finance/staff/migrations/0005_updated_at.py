@@ -0,0 +1,23 @@
+# Generated by Django 4.1.2 on 2026-10-18 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staff', '0004_alter_company_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.2 on 2026-10-18 21:10
+
+from django.db import migrations, models
+import finance.conditional
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staff', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='company',
+            name='bank_detail',
+            field=models.OneToOneField(null=True, on_delete=finance.conditional.SET_NULL_AND_TOUCH, to='staff.bankdetails'),
+        ),
+    ]
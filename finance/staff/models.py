@@ -1,20 +1,26 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+from finance.conditional import SET_NULL_AND_TOUCH
+
 
 class Employee(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     position = models.CharField(max_length=100, null=True, verbose_name="Должность работника")
     company = models.ForeignKey("Company", on_delete=models.CASCADE)
+    # validator of conditional GET requests, see finance.conditional
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.user.email} {self.position}"
 
 
 class Company(models.Model):
-    bank_detail = models.OneToOneField("BankDetails", on_delete=models.SET_NULL, null=True)
+    bank_detail = models.OneToOneField("BankDetails", on_delete=SET_NULL_AND_TOUCH, null=True)
     name = models.CharField(max_length=200, null=True)
     description = models.TextField(blank=True, null=True)
+    # validator of conditional GET requests, see finance.conditional
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.id} {self.name}"
@@ -28,7 +28,7 @@ class CompanySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Company
-        fields = '__all__'
+        exclude = ['updated_at']
 
     @atomic
     def update(self, instance, validated_data):
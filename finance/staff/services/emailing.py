@@ -1,18 +1,15 @@
-from django.core.mail import send_mail
-
-from finance import settings
+from mailing.services.outbox import enqueue_mail
 
 
 def send_staff_invitation(user_email, password, company_name):
-    send_mail(
+    enqueue_mail(
         'Приглашение сотрудника',
         f'Вы были приглашены в систему, компании - {company_name}.\n'
         f'Используете следующие данные для входа:\n'
         f'Email - {user_email},\n'
         f'Пароль - {password}\n',
-        settings.EMAIL_HOST_USER,
         [user_email],
-        fail_silently=False,
+        sensitive=True,
     )
 
 
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from staff.authentication import invalidate_tokens
+from staff.models import BankDetails, Company, Employee
+
+
+def drop_tokens(keys):
+    """Drops the cached tokens now and again when the transaction commits:
+    a concurrent request may cache the old rows in between."""
+    keys = list(keys)
+    invalidate_tokens(keys)
+    transaction.on_commit(lambda: invalidate_tokens(keys))
+
+
+@receiver(post_delete, sender=Token)
+def drop_deleted_token(sender, instance, **kwargs):
+    drop_tokens([instance.key])
+
+
+# Cached tokens carry the user, employee, company and bank details, so a save
+# or a delete of any of them (deactivation, password or company change, a
+# removed employee) drops the tokens of the affected users. Bulk update()
+# does not send signals and relies on the cache TTL.
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def drop_user_tokens(sender, instance, created, **kwargs):
+    if not created:
+        drop_tokens(Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+@receiver(post_save, sender=Employee)
+def drop_employee_tokens(sender, instance, **kwargs):
+    drop_tokens(Token.objects.filter(user_id=instance.user_id).values_list('key', flat=True))
+
+
+@receiver(post_delete, sender=Employee)
+def drop_deleted_employee_tokens(sender, instance, origin=None, **kwargs):
+    # a deleted company drops the tokens of all its employees at once
+    if not isinstance(origin, Company):
+        drop_employee_tokens(sender, instance)
+
+
+@receiver(post_save, sender=Company)
+def drop_company_tokens(sender, instance, created, **kwargs):
+    if not created:
+        drop_tokens(Token.objects.filter(user__employee__company=instance).values_list('key', flat=True))
+
+
+@receiver(post_save, sender=BankDetails)
+def drop_bank_details_tokens(sender, instance, created, **kwargs):
+    if not created:
+        drop_tokens(Token.objects.filter(user__employee__company__bank_detail=instance)
+                    .values_list('key', flat=True))
+
+
+# Deleted companies and bank details unlink (or delete) the employees, so
+# their tokens are found before the delete.
+@receiver(pre_delete, sender=Company)
+def drop_deleted_company_tokens(sender, instance, **kwargs):
+    drop_tokens(Token.objects.filter(user__employee__company=instance).values_list('key', flat=True))
+
+
+@receiver(pre_delete, sender=BankDetails)
+def drop_deleted_bank_details_tokens(sender, instance, **kwargs):
+    drop_tokens(Token.objects.filter(user__employee__company__bank_detail=instance)
+                .values_list('key', flat=True))
@@ -1,12 +1,20 @@
+import base64
+import datetime
 from unittest.mock import patch, MagicMock
+from types import SimpleNamespace
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.hashers import check_password
+from django.test import TestCase, RequestFactory, override_settings
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
-from staff.models import Company, Employee
+from finance.query_budgets import QueryBudget, QueryBudgetMixin
+from mailing.models import OutgoingEmail
+from staff.authentication import CachedTokenAuthentication, get_token_digest, token_cache, basic_cache
+from staff.middleware import TenantContext
+from staff.models import Company, Employee, BankDetails
 
 User = get_user_model()
 
@@ -35,14 +43,33 @@ class EmployeeTestCase(TestCase):
         empl = User.objects.filter(email="test1@mail.com")
         self.assertEqual(len(empl), 1)
 
+    def test_staff_invite_password_not_kept(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.client.post("/api/employees/invite-staff", {"email": "test1@mail.com"}, format='json')
+        # письмо с паролем помечено, его текст удалится после отправки
+        self.assertTrue(OutgoingEmail.objects.get(recipients=["test1@mail.com"]).sensitive)
+
     def test_employee_list(self):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
         response = self.client.get("/api/employees/", format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data[0]["id"], self.employee.id)
-        self.assertEqual(response.data[0]["position"], self.employee.position)
-        self.assertEqual(response.data[0]["company"]["id"], self.company.id)
-        self.assertEqual(response.data[0]["user"]["id"], self.user.id)
+        self.assertEqual(response.data["results"][0]["id"], self.employee.id)
+        self.assertEqual(response.data["results"][0]["position"], self.employee.position)
+        self.assertEqual(response.data["results"][0]["company"]["id"], self.company.id)
+        self.assertEqual(response.data["results"][0]["user"]["id"], self.user.id)
+
+    def test_employee_sparse_fields(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.get("/api/employees/", {"fields": "id,user.email", "expand": "company"},
+                                   format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [{"id": self.employee.id, "user": {"email": self.user.email}}])
+
+        response = self.client.get("/api/employees/", {"expand": "user"}, format='json')
+        self.assertEqual(response.data["results"][0]["company"], self.company.id)
+
+        response = self.client.get("/api/employees/", {"fields": "password"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_singup(self):
         response = self.client.post("/api/signup/", {
@@ -72,4 +99,195 @@ class EmployeeTestCase(TestCase):
             "email": "wrong-email@mail.com", "password": "testingpassword"}, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         print(response.data)
-        self.assertEqual(response.data["non_field_errors"][0].title(), "Unable To Log In With Provided Credentials.")
\ No newline at end of file
+        self.assertEqual(response.data["non_field_errors"][0].title(), "Unable To Log In With Provided Credentials.")
+
+
+class TenantContextTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test@mail.com', 'test@mail.com', 'testingpassword')
+        bank_detail = BankDetails.objects.create(name="bank", address="address",
+                                                 bank_number="123", settlement_account="456")
+        self.company = Company.objects.create(name="test", bank_detail=bank_detail)
+        self.employee = Employee.objects.create(position="position", company=self.company,
+                                                user=self.user)
+
+    def test_tenant_loaded_with_one_query(self):
+        request = RequestFactory().get("/")
+        request.user = User.objects.get(id=self.user.id)
+        tenant = TenantContext(request)
+
+        # сотрудник, компания и банковские реквизиты загружаются одним запросом
+        with self.assertNumQueries(1):
+            self.assertEqual(tenant.employee, self.employee)
+            self.assertEqual(tenant.company.bank_detail.name, "bank")
+        # повторные обращения и request.user.employee запросов не делают
+        with self.assertNumQueries(0):
+            self.assertEqual(tenant.company, self.company)
+            self.assertEqual(request.user.employee.company, self.company)
+            self.assertEqual(tenant.employee.user, request.user)
+
+    def test_user_without_employee_sees_nothing(self):
+        admin = User.objects.create_superuser('admin', 'admin@mail.com', 'testingpassword')
+        token = Token.objects.create(user=admin)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        response = client.get("/api/employees/", format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [])
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user('test@mail.com', 'test@mail.com', 'testingpassword')
+        self.company = Company.objects.create(name="test")
+        self.employee = Employee.objects.create(position="position", company=self.company,
+                                                user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_cached_token_makes_no_queries(self):
+        authentication = CachedTokenAuthentication()
+        with self.assertNumQueries(1):
+            authentication.authenticate_credentials(self.token.key)
+        # второй раз токен, пользователь, сотрудник и компания берутся из кеша
+        with self.assertNumQueries(0):
+            user, token = authentication.authenticate_credentials(self.token.key)
+            self.assertEqual(user.employee.company, self.company)
+
+    def test_deleted_token_is_revoked(self):
+        self.assertEqual(self.client.get("/api/employees/").status_code, status.HTTP_200_OK)
+        self.token.delete()
+        self.assertEqual(self.client.get("/api/employees/").status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_revoked(self):
+        self.assertEqual(self.client.get("/api/employees/").status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/employees/").status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_company_change_is_visible(self):
+        self.assertEqual(self.client.get("/api/companies/").data[0]["name"], "test")
+        self.company.name = "renamed"
+        self.company.save()
+        self.assertEqual(self.client.get("/api/companies/").data[0]["name"], "renamed")
+
+    def test_deleted_employee_is_revoked(self):
+        self.assertEqual(len(self.client.get("/api/companies/").data), 1)
+        self.employee.delete()
+        # удаленный сотрудник больше не видит данные компании
+        self.assertEqual(len(self.client.get("/api/companies/").data), 0)
+
+    def test_deleted_bank_details_drop_tokens(self):
+        self.company.bank_detail = BankDetails.objects.create(name="bank", address="address",
+                                                              bank_number="number", settlement_account="account")
+        self.company.save()
+        authentication = CachedTokenAuthentication()
+        authentication.authenticate_credentials(self.token.key)
+        self.company.bank_detail.delete()
+        with self.assertNumQueries(1):
+            user, token = authentication.authenticate_credentials(self.token.key)
+        self.assertIsNone(user.employee.company.bank_detail)
+
+    def test_tokens_dropped_again_on_commit(self):
+        authentication = CachedTokenAuthentication()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.employee.delete()
+            # параллельный запрос успел закешировать сотрудника до коммита
+            token_cache.set(get_token_digest(self.token.key), self.token)
+        with self.assertNumQueries(1):
+            authentication.authenticate_credentials(self.token.key)
+
+    @override_settings(TOKEN_AUTHENTICATION={'EXPIRY': 60})
+    def test_expired_token(self):
+        Token.objects.filter(key=self.token.key)\
+            .update(created=self.token.created - datetime.timedelta(minutes=2))
+        self.assertEqual(self.client.get("/api/employees/").status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+
+        # при входе выдается новый токен
+        self.client.credentials()
+        response = self.client.post("/api/login/", {
+            "email": "test@mail.com", "password": "testingpassword"}, format='json')
+        self.assertNotEqual(response.data["token"], self.token.key)
+
+    @override_settings(TOKEN_AUTHENTICATION={'ROTATE_ON_LOGIN': True})
+    def test_token_rotation_on_login(self):
+        response = self.client.post("/api/login/", {
+            "email": "test@mail.com", "password": "testingpassword"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.data["token"], self.token.key)
+        self.assertEqual(self.client.get("/api/employees/").status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CachedBasicAuthenticationTestCase(TestCase):
+    def setUp(self):
+        basic_cache.clear()
+        self.user = User.objects.create_user('test@mail.com', 'test@mail.com', 'testingpassword')
+        self.company = Company.objects.create(name="test")
+        Employee.objects.create(position="position", company=self.company, user=self.user)
+        self.client = APIClient()
+
+    def get_employees(self, password):
+        self.client.credentials(HTTP_AUTHORIZATION=_basic_auth('test@mail.com', password))
+        return self.client.get("/api/employees/")
+
+    def test_password_checked_once(self):
+        with patch('django.contrib.auth.base_user.check_password', wraps=check_password) as mock:
+            for _ in range(3):
+                self.assertEqual(self.get_employees('testingpassword').status_code, status.HTTP_200_OK)
+        # хеш пароля считается только при первом запросе
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(self.get_employees('wrongpassword').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates_cache(self):
+        self.assertEqual(self.get_employees('testingpassword').status_code, status.HTTP_200_OK)
+        self.user.set_password('newpassword')
+        self.user.save()
+        self.assertEqual(self.get_employees('testingpassword').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.get_employees('newpassword').status_code, status.HTTP_200_OK)
+
+
+def _basic_auth(username, password):
+    return 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()
+
+
+def company_data(rows):
+    return {"name": "company", "description": "description",
+            "bank_detail": {"name": "bank", "address": "address", "bank_number": "number",
+                            "settlement_account": "account"}}
+
+
+class StaffQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    urlconf = 'staff.urls'
+    skipped = {
+        ('employees/', 'POST'): "сотрудник без пользователя не создается",
+    }
+    staff_user = True
+    budgets = [
+        QueryBudget('GET', 'companies/', 3),
+        QueryBudget('GET', 'companies/<int:pk>', 3, kwargs=lambda rows: {"pk": rows.company.id}),
+        QueryBudget('PUT', 'companies/<int:pk>', 8, kwargs=lambda rows: {"pk": rows.company.id}, data=company_data),
+        QueryBudget('DELETE', 'companies/<int:pk>', 11, kwargs=lambda rows: {"pk": rows.company.id}),
+        QueryBudget('GET', 'employees/', 3),
+        QueryBudget('GET', 'employees/<int:pk>', 3, kwargs=lambda rows: {"pk": rows.employee.id}),
+        QueryBudget('PUT', 'employees/<int:pk>', 6, kwargs=lambda rows: {"pk": rows.employee.id},
+                    data=lambda rows: {"position": "position"}),
+        QueryBudget('DELETE', 'employees/<int:pk>', 5, kwargs=lambda rows: {"pk": rows.employee.id}),
+        QueryBudget('POST', 'employees/invite-staff', 8, data=lambda rows: {"email": "new@mail.com"}),
+        QueryBudget('POST', 'signup/', 8, data=lambda rows: {"email": "new@mail.com", "password": "testingpassword"}),
+        QueryBudget('POST', 'login/', 3, data=lambda rows: {"email": "test@mail.com", "password": "testingpassword"}),
+    ]
+
+    def create_rows(self, count):
+        # count сотрудников компании
+        rows = SimpleNamespace()
+        rows.company = self.company
+        users = User.objects.bulk_create(User(username=f"user{i}@mail.com", email=f"user{i}@mail.com")
+                                         for i in range(count))
+        employees = Employee.objects.bulk_create(Employee(user=user, company=self.company, position="position")
+                                                 for user in users)
+        rows.employee = employees[0]
+        return rows
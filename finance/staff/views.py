@@ -1,12 +1,18 @@
 from django.contrib.auth.models import User
 from django.db.transaction import atomic
 from rest_framework import viewsets, mixins, permissions, status
-from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
+from finance.conditional import ConditionalGetMixin
+from finance.eager_loading import EagerLoadingMixin
+from finance.lean import LeanListMixin
+from finance.pagination import TenantCursorPagination
+from finance.replicas import ReadReplicaMixin
+from finance.sparse_fields import SparseFieldsMixin
+from staff.authentication import issue_token
 from staff.models import Company, Employee
 from staff.serializers import CompanySerializer, EmployeeSerializer, UserSerializer, \
     SignUpSerializer, LoginSerializer, StaffInvitationSerializer
@@ -19,32 +25,39 @@ class IsEmployeeCompany(permissions.BasePermission):
     """
 
     def has_object_permission(self, request, view, obj):
-        if request.user.employee is None:
+        company = request.tenant.company
+        if company is None:
             return False
-        return obj == request.user.employee.company
+        return obj == company
 
 
-class CompanyViewSet(mixins.RetrieveModelMixin, mixins.ListModelMixin,
-                     mixins.DestroyModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
+class CompanyViewSet(ConditionalGetMixin, SparseFieldsMixin, EagerLoadingMixin, mixins.RetrieveModelMixin,
+                     mixins.ListModelMixin, mixins.DestroyModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        return queryset.filter(id=self.request.user.employee.company.id)
+        return self.request.tenant.filter(super().get_queryset(), 'id')
 
 
-class EmployeeViewSet(viewsets.ModelViewSet):
+class EmployeeViewSet(ReadReplicaMixin, ConditionalGetMixin, SparseFieldsMixin, LeanListMixin, EagerLoadingMixin,
+                      viewsets.ModelViewSet):
     queryset = Employee.objects.all()
     serializer_class = EmployeeSerializer
+    ordering = ['id']
+    ordering_fields = ['id']
+    pagination_class = TenantCursorPagination
+    read_replica_actions = ('list', 'retrieve')
+    lean_list = True
+    conditional_fields = ('updated_at', 'company__updated_at')
 
     def get_queryset(self):
-        return super().get_queryset().filter(company=self.request.user.employee.company)
+        return self.request.tenant.filter(super().get_queryset())
 
     @action(detail=False, methods=['post'])
     @atomic
     def send_staff_invite(self, request, pk=None):
-        employer = request.user.employee
+        employer = request.tenant.employee
         if not employer.user.is_staff:
             raise ValidationError({"message": "Только менеджер может приглашать сотрудников"})
 
@@ -94,7 +107,7 @@ class LoginView(ObtainAuthToken):
         )
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data["user"]
-        token, created = Token.objects.get_or_create(user=user)
+        token = issue_token(user)
         return Response(
             {"token": token.key, "user": UserSerializer(instance=user).data}
         )